@@ -0,0 +1,5 @@
+"""Benchmarks of the upd pipeline on synthetic trio VCFs
+
+Generate a VCF with `python -m benchmarks.generate` and time the stages of the pipeline on it
+with `python -m benchmarks.run`.
+"""
@@ -0,0 +1,253 @@
+"""Deterministic generator of synthetic trio VCFs
+
+The genotypes of the parents are drawn from the population frequency of each variant and the
+proband inherits one allele from each parent. In planted UPD regions the proband inherits both
+alleles from one parent: both of them for heterodisomy, the same one twice for isodisomy.
+
+The same arguments and seed always give the same file. A .gz file is bgzipped, like a VCF from a
+variant caller, so that its blocks can be inflated on several threads.
+"""
+import codecs
+import logging
+import random
+
+import click
+
+from upd.bgzf import BgzfWriter
+
+LOG = logging.getLogger(__name__)
+
+# Sequence lengths of GRCh37
+CONTIGS = [
+    ('1', 249250621), ('2', 243199373), ('3', 198022430), ('4', 191154276), ('5', 180915260),
+    ('6', 171115067), ('7', 159138663), ('8', 146364022), ('9', 141213431), ('10', 135534747),
+    ('11', 135006516), ('12', 133851895), ('13', 115169878), ('14', 107349540),
+    ('15', 102531392), ('16', 90354753), ('17', 81195210), ('18', 78077248), ('19', 59128983),
+    ('20', 63025520), ('21', 48129895), ('22', 51304566), ('X', 155270560), ('Y', 59373566),
+]
+
+TRIO = ['TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER']
+
+# Exome targets in WES mode, spread over the genome in proportion to sequence length
+EXOME_TARGETS = 200000
+TARGET_SIZE = 300
+
+BASES = 'ACGT'
+
+
+def parse_upd_region(region):
+    """Parse a planted UPD region
+
+    Args:
+        region (str): 'chrom:start-end:origin:type', 1-based and inclusive. origin is maternal
+                      or paternal and type is hetero or iso, e.g.
+                      '15:20000000-90000000:paternal:iso'
+
+    Returns:
+        region (tuple): (chrom, start, end, origin, type)
+    """
+    try:
+        chrom, coords, origin, kind = region.split(':')
+        start, end = (int(coord) for coord in coords.replace(',', '').split('-'))
+    except ValueError:
+        raise SyntaxError(f"Malformed UPD region: {region}")
+    if origin not in ('maternal', 'paternal') or kind not in ('hetero', 'iso'):
+        raise SyntaxError(f"Malformed UPD region: {region}")
+    return (chrom, start, end, origin, kind)
+
+
+def _positions(rng, nr_variants, exome):
+    """Draw sorted, unique positions for each sequence, in proportion to its length
+
+    Yields:
+        chrom, positions (str, list(int))
+    """
+    total = sum(length for _, length in CONTIGS)
+    cumulative = 0
+    for chrom, length in CONTIGS:
+        nr_contig = round(nr_variants * (cumulative + length) / total) - round(
+            nr_variants * cumulative / total)
+        cumulative += length
+        positions = set()
+        if exome:
+            nr_targets = max(1, round(EXOME_TARGETS * length / total))
+            targets = [rng.randrange(1, length - TARGET_SIZE) for _ in range(nr_targets)]
+            nr_contig = min(nr_contig, nr_targets * TARGET_SIZE // 2)
+            while len(positions) < nr_contig:
+                positions.add(rng.choice(targets) + rng.randrange(TARGET_SIZE))
+        else:
+            while len(positions) < nr_contig:
+                positions.add(rng.randrange(1, length + 1))
+        yield chrom, sorted(positions)
+
+
+def _upd_lookup(upd_regions, chrom, pos):
+    """Get the origin and type of the planted region holding a position, None if there is none"""
+    for region_chrom, start, end, origin, kind in upd_regions:
+        if region_chrom == chrom and start <= pos <= end:
+            return origin, kind
+    return None
+
+
+def _alleles(rng, indel_fraction):
+    """Draw REF and ALT"""
+    ref = rng.choice(BASES)
+    alt = rng.choice(BASES.replace(ref, ''))
+    if rng.random() < indel_fraction:
+        extra = ''.join(rng.choice(BASES) for _ in range(rng.randrange(1, 6)))
+        if rng.random() < 0.5:
+            return ref, ref + extra
+        return ref + extra, ref
+    return ref, alt
+
+
+def _genotype(haplotypes, rng, missing_rate, low_gq_rate):
+    """Format the GT:GQ of an individual"""
+    if rng.random() < missing_rate:
+        return './.:.'
+    gq = rng.randrange(0, 30) if rng.random() < low_gq_rate else 99
+    return '{}:{}'.format(('0/0', '0/1', '1/1')[sum(haplotypes)], gq)
+
+
+def generate_trio_vcf(out_handle, nr_variants=100000, nr_samples=3, csq_fields=2,
+                      transcripts=1, info_fields=0, indel_fraction=0.1, upd_regions=None,
+                      exome=False, missing_rate=0.01, low_gq_rate=0.05, seed=0):
+    """Write a synthetic VCF with a trio and optionally more samples
+
+    The trio is TEST_PROBAND, TEST_MOTHER and TEST_FATHER. Other samples are unrelated and
+    named SAMPLE_4 and up. The population frequency is annotated as MAX_AF, both in the CSQ field
+    and as an INFO field.
+
+    Args:
+        out_handle (file): A file opened in text mode
+        nr_variants (int): Number of variants
+        nr_samples (int): Number of samples, at least 3
+        csq_fields (int): Number of fields in the CSQ annotation, at least 2
+        transcripts (int): Number of transcripts annotated for each variant
+        info_fields (int): Number of extra INFO fields
+        indel_fraction (float): Fraction of variants that are indels
+        upd_regions (list(tuple)): Planted UPD regions as returned by parse_upd_region
+        exome (bool): Place the variants in exome sized targets instead of across the genome
+        missing_rate (float): Fraction of missing genotypes
+        low_gq_rate (float): Fraction of genotypes with GQ below 30
+        seed (int): Seed of the random number generator
+
+    Returns:
+        nr_written (int): Number of variants written
+    """
+    if nr_samples < 3:
+        raise ValueError("A trio VCF needs at least 3 samples")
+    if csq_fields < 2:
+        raise ValueError("The CSQ annotation needs at least 2 fields")
+    upd_regions = upd_regions or []
+    rng = random.Random(seed)
+
+    csq_names = ['SYMBOL'] + [f'FIELD_{i}' for i in range(1, csq_fields - 1)] + ['MAX_AF']
+    info_names = [f'INFO_{i}' for i in range(1, info_fields + 1)]
+    samples = TRIO + [f'SAMPLE_{i}' for i in range(4, nr_samples + 1)]
+
+    out_handle.write('##fileformat=VCFv4.2\n')
+    out_handle.write('##FILTER=<ID=PASS,Description="All filters passed">\n')
+    out_handle.write('##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype Quality">\n')
+    out_handle.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+    out_handle.write('##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations '
+                     'from Ensembl VEP. Format: {}">\n'.format('|'.join(csq_names)))
+    out_handle.write('##INFO=<ID=MAX_AF,Number=A,Type=Float,Description="Maximum population '
+                     'frequency">\n')
+    for name in info_names:
+        out_handle.write(f'##INFO=<ID={name},Number=1,Type=Integer,Description="Padding">\n')
+    for chrom, length in CONTIGS:
+        out_handle.write(f'##contig=<ID={chrom},length={length},assembly=b37>\n')
+    out_handle.write('#' + '\t'.join(['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER',
+                                      'INFO', 'FORMAT'] + samples) + '\n')
+
+    nr_written = 0
+    for chrom, positions in _positions(rng, nr_variants, exome):
+        for pos in positions:
+            ref, alt = _alleles(rng, indel_fraction)
+            # Skewed towards rare variants, with a tenth not annotated
+            freq = rng.betavariate(0.5, 1.5)
+            annotated = rng.random() > 0.1
+            freq_str = '{:.4g}'.format(freq) if annotated else ''
+
+            mother = (rng.random() < freq, rng.random() < freq)
+            father = (rng.random() < freq, rng.random() < freq)
+            upd = _upd_lookup(upd_regions, chrom, pos)
+            if upd is None:
+                proband = (rng.choice(mother), rng.choice(father))
+            else:
+                origin, kind = upd
+                parent = mother if origin == 'maternal' else father
+                if kind == 'iso':
+                    allele = rng.choice(parent)
+                    proband = (allele, allele)
+                else:
+                    proband = parent
+            haplotypes = [proband, mother, father] + [
+                (rng.random() < freq, rng.random() < freq) for _ in range(nr_samples - 3)
+            ]
+
+            csq = ','.join(
+                '|'.join([f'GENE{pos % 1000}'] + ['x'] * (csq_fields - 2) + [freq_str])
+                for _ in range(transcripts)
+            )
+            info = [f'CSQ={csq}']
+            if annotated:
+                info.append(f'MAX_AF={freq_str}')
+            info = ';'.join(info + [f'{name}={rng.randrange(100)}' for name in info_names])
+            genotypes = [_genotype(gt, rng, missing_rate, low_gq_rate) for gt in haplotypes]
+            out_handle.write('\t'.join([chrom, str(pos), '.', ref, alt, '1000', 'PASS', info,
+                                        'GT:GQ'] + genotypes) + '\n')
+            nr_written += 1
+
+    LOG.info("%s variants written", nr_written)
+    return nr_written
+
+
+@click.command()
+@click.argument('out_path', type=click.Path(dir_okay=False))
+@click.option('--variants', help="Number of variants", default=100000, show_default=True)
+@click.option('--samples', help="Number of samples, the first three are the trio", default=3,
+              show_default=True)
+@click.option('--csq-fields', help="Number of fields in the CSQ annotation", default=2,
+              show_default=True)
+@click.option('--transcripts', help="Number of transcripts per variant", default=1,
+              show_default=True)
+@click.option('--info-fields', help="Number of extra INFO fields", default=0, show_default=True)
+@click.option('--indel-fraction', help="Fraction of indels", default=0.1, show_default=True)
+@click.option('--upd', 'upd_regions',
+    help="Planted UPD region chrom:start-end:origin:type, origin maternal or paternal and type "
+         "hetero or iso. Can be repeated",
+    multiple=True,
+)
+@click.option('--exome', help="Place the variants in exome targets (WES)", is_flag=True)
+@click.option('--seed', help="Random seed", default=0, show_default=True)
+def cli(out_path, variants, samples, csq_fields, transcripts, info_fields, indel_fraction,
+        upd_regions, exome, seed):
+    """Generate a synthetic trio VCF, bgzipped if OUT_PATH ends with .gz"""
+    logging.basicConfig(level=logging.INFO)
+    try:
+        upd_regions = [parse_upd_region(region) for region in upd_regions]
+    except SyntaxError as err:
+        raise click.BadParameter(str(err))
+    if out_path.endswith('.gz'):
+        out_handle = codecs.getwriter('utf-8')(BgzfWriter(out_path))
+    else:
+        out_handle = open(out_path, 'w')
+    with out_handle:
+        generate_trio_vcf(
+            out_handle,
+            nr_variants=variants,
+            nr_samples=samples,
+            csq_fields=csq_fields,
+            transcripts=transcripts,
+            info_fields=info_fields,
+            indel_fraction=indel_fraction,
+            upd_regions=upd_regions,
+            exome=exome,
+            seed=seed,
+        )
+
+
+if __name__ == '__main__':
+    cli()
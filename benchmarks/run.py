@@ -0,0 +1,165 @@
+"""Time the stages of the upd pipeline
+
+Each stage is run on the output of the previous one, which is kept in memory, so the time and
+memory of a stage are measured on their own. The rate of every stage is given in variants of the
+VCF per second, so the stages can be compared with each other.
+
+Peak memory is measured with tracemalloc in a separate run, since tracing slows down the code.
+"""
+import json
+import logging
+import time
+import tracemalloc
+
+import click
+
+from upd.bed_utils import output_filtered_regions
+from upd.utils import (get_UPD_informative_sites, call_regions)
+from upd.vcf_tools import (get_vcf, open_file, parse_CSQ_header, build_prefilter)
+
+LOG = logging.getLogger(__name__)
+
+TRIO = ('TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+
+
+def _read_lines(vcf_path, threads):
+    nr_lines = 0
+    handle = open_file(vcf_path, threads)
+    for _ in handle:
+        nr_lines += 1
+    handle.close()
+    return nr_lines
+
+
+def _iterate_vcf(vcf_path, trio, threads):
+    vcf_reader = get_vcf(vcf_path, *trio, threads=threads)
+    for _ in vcf_reader:
+        pass
+    return vcf_reader.nr_variants
+
+
+def _informative_sites(vcf_path, trio, threads):
+    vcf_reader = get_vcf(vcf_path, *trio, threads=threads)
+    csq_fields = parse_CSQ_header(vcf_reader)
+    vcf_reader.prefilter = build_prefilter(min_af=0.05, vep_fields=csq_fields, af_tag='MAX_AF')
+    return list(get_UPD_informative_sites(vcf_reader, csq_fields, *trio))
+
+
+def _call_regions(sites):
+    return list(call_regions(sites))
+
+
+def _filtered_regions(calls):
+    return list(output_filtered_regions(calls))
+
+
+def _measure(func, args, memory):
+    """Run a stage once
+
+    Returns:
+        result, seconds, peak_bytes: peak_bytes is None unless memory is True
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run_benchmarks(vcf_path, trio=TRIO, threads=1, repeat=3, memory=True):
+    """Time the stages of the pipeline on a VCF
+
+    Args:
+        vcf_path (str)
+        trio (tuple): proband, mother and father IDs
+        threads (int): Number of threads used to decompress a bgzipped VCF
+        repeat (int): Number of timed runs of each stage, the fastest one is reported
+        memory (bool): Measure peak memory in an extra run of each stage
+
+    Returns:
+        results (list(dict)): For each stage the name, number of items handled, seconds,
+                              variants per second and peak memory in bytes
+    """
+    stages = [
+        ('open_file', _read_lines, lambda prev: (vcf_path, threads)),
+        ('Vcf', _iterate_vcf, lambda prev: (vcf_path, trio, threads)),
+        ('get_UPD_informative_sites', _informative_sites, lambda prev: (vcf_path, trio, threads)),
+        ('call_regions', _call_regions, lambda prev: (prev,)),
+        ('output_filtered_regions', _filtered_regions, lambda prev: (prev,)),
+    ]
+    results = []
+    nr_variants = None
+    prev = None
+    for name, func, get_args in stages:
+        args = get_args(prev)
+        timings = []
+        for _ in range(repeat):
+            result, seconds, _ = _measure(func, args, memory=False)
+            timings.append(seconds)
+        peak = None
+        if memory:
+            _, _, peak = _measure(func, args, memory=True)
+
+        if name == 'Vcf':
+            nr_variants = result
+        items = result if isinstance(result, int) else len(result)
+        seconds = min(timings)
+        results.append({
+            'stage': name,
+            'items': items,
+            'seconds': seconds,
+            'peak_bytes': peak,
+        })
+        if isinstance(result, list):
+            prev = result
+
+    for stage in results:
+        stage['variants_per_sec'] = nr_variants / stage['seconds'] if stage['seconds'] else None
+    return results
+
+
+def format_results(results):
+    """Format benchmark results as a table
+
+    Yields:
+        line (str)
+    """
+    yield "{:<28}{:>10}{:>12}{:>16}{:>12}".format('stage', 'items', 'seconds', 'variants/sec',
+                                                  'peak MB')
+    for stage in results:
+        peak = '-'
+        if stage['peak_bytes'] is not None:
+            peak = '{:.1f}'.format(stage['peak_bytes'] / 1024**2)
+        yield "{:<28}{:>10}{:>12.3f}{:>16,.0f}{:>12}".format(
+            stage['stage'], stage['items'], stage['seconds'], stage['variants_per_sec'] or 0, peak
+        )
+
+
+@click.command()
+@click.argument('vcf_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--trio', nargs=3, default=TRIO, show_default=True,
+              help="Proband, mother and father IDs")
+@click.option('--threads', default=1, show_default=True,
+              help="Number of threads used to decompress a bgzipped VCF")
+@click.option('--repeat', default=3, show_default=True,
+              help="Number of timed runs of each stage, the fastest is reported")
+@click.option('--no-memory', is_flag=True, help="Skip the peak memory measurement")
+@click.option('--json', 'json_path', type=click.Path(dir_okay=False),
+              help="Also write the results as JSON to this file")
+def cli(vcf_path, trio, threads, repeat, no_memory, json_path):
+    """Benchmark the stages of upd on VCF_PATH, see benchmarks.generate for test data"""
+    results = run_benchmarks(vcf_path, trio, threads, repeat, memory=not no_memory)
+    for line in format_results(results):
+        click.echo(line)
+    if json_path:
+        with open(json_path, 'w') as handle:
+            json.dump({'vcf': vcf_path, 'stages': results}, handle, indent=2)
+
+
+if __name__ == '__main__':
+    cli()
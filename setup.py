@@ -27,6 +27,8 @@ VERSION = None
 # What packages are optional?
 EXTRAS = {
     'tests':['pytest','pytest-cov'],
+    'numpy':['numpy'],
+    'arrow':['numpy', 'pyarrow'],
 }
 
 # The rest you shouldn't have to touch too much :)
@@ -141,7 +143,7 @@ setup(
     author=AUTHOR,
     author_email=EMAIL,
     url=URL,
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('tests', 'benchmarks')),
 
     entry_points={
         'console_scripts': ["upd = upd.__main__:base_command"],
@@ -1,3 +1,5 @@
+import gzip
+
 import pytest
 
 @pytest.fixture()
@@ -15,3 +17,66 @@ def regions_output():
 @pytest.fixture()
 def ped_path():
     return 'tests/fixtures/test.fam'
+
+@pytest.fixture()
+def indexed_vcf_path():
+    return 'tests/fixtures/test.sorted.vcf.gz'
+
+@pytest.fixture()
+def multiallelic_vcf_path():
+    """Chromosomes 1, 2 and 3 of the sorted VCF with a multi-allelic variant, with a tabix index"""
+    return 'tests/fixtures/test.multiallelic.vcf.gz'
+
+@pytest.fixture()
+def bcf_path():
+    """The sorted VCF as BCF, with a csi index"""
+    return 'tests/fixtures/test.sorted.bcf'
+
+@pytest.fixture()
+def af_vcf_paths():
+    """A VCF and the same variants as BCF, with DP, DB and a Float MAX_AF in INFO"""
+    return 'tests/fixtures/test.af.vcf.gz', 'tests/fixtures/test.af.bcf'
+
+@pytest.fixture()
+def cohort_vcf_path(vcf_path, tmp_path):
+    """A VCF with two trios, the second one a copy of the first with the parents swapped"""
+    out_path = tmp_path / 'cohort.vcf'
+    with gzip.open(vcf_path, 'rt') as handle, open(out_path, 'w') as out:
+        for line in handle:
+            if line.startswith('##'):
+                out.write(line)
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if line.startswith('#'):
+                extra = ['SWAP_PROBAND', 'SWAP_MOTHER', 'SWAP_FATHER']
+            else:
+                extra = [fields[9], fields[11], fields[10]]
+            out.write('\t'.join(fields + extra) + '\n')
+    return str(out_path)
+
+def _split_vcf(vcf_path, tmp_path):
+    """Split a sorted VCF into one VCF per chromosome, listed in reverse order"""
+    header = []
+    shards = {}
+    with gzip.open(vcf_path, 'rt') as handle:
+        for line in handle:
+            if line.startswith('#'):
+                header.append(line)
+                continue
+            shards.setdefault(line.split('\t', 1)[0], []).append(line)
+    paths = []
+    for chrom, lines in shards.items():
+        out_path = tmp_path / f'shard.{chrom}.vcf'
+        out_path.write_text(''.join(header + lines))
+        paths.append(str(out_path))
+    return paths[::-1]
+
+@pytest.fixture()
+def shard_paths(indexed_vcf_path, tmp_path):
+    """The sorted VCF split into one VCF per chromosome, listed in reverse order"""
+    return _split_vcf(indexed_vcf_path, tmp_path)
+
+@pytest.fixture()
+def multiallelic_shard_paths(multiallelic_vcf_path, tmp_path):
+    """The VCF with a multi-allelic variant split into one VCF per chromosome"""
+    return _split_vcf(multiallelic_vcf_path, tmp_path)
@@ -0,0 +1,65 @@
+import pytest
+
+from click.testing import CliRunner
+
+from upd import (UpdAnalysis, SiteTable)
+from upd.cli import cli
+
+TRIO = ('TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+
+
+def test_analysis_run(vcf_path, tmp_path):
+    ## GIVEN a VCF and the regions called by the command line
+    out_file = tmp_path / 'regions.bed'
+    CliRunner().invoke(cli, ['--vcf', vcf_path, '--proband', TRIO[0], '--mother', TRIO[1],
+                             '--father', TRIO[2], '--vep', 'regions', '--out', str(out_file)])
+    analysis = UpdAnalysis(vep=True)
+    
+    ## WHEN running the analysis from Python
+    result = analysis.run(vcf_path, *TRIO)
+    
+    ## THEN assert that the same regions are found
+    assert isinstance(result.sites, SiteTable)
+    assert result.nr_variants > len(result.sites) > 0
+    regions = [f"{region['chrom']}\t{region['start_hi'] - 1}\t{region['end_lo']}" 
+               for region in result.regions]
+    assert regions == [line.rsplit('\t', 1)[0] for line in out_file.read_text().splitlines()]
+    assert result.regions[0]['origin'] == 'PATERNAL'
+
+def test_analysis_file_object(vcf_path):
+    ## GIVEN an analysis that has read a VCF
+    analysis = UpdAnalysis(vep=True)
+    sites = list(analysis.sites(vcf_path, *TRIO))
+    
+    ## WHEN reading the same VCF from a file object
+    with open(vcf_path, 'rb') as handle:
+        handle_sites = list(analysis.sites(handle, *TRIO))
+    
+    ## THEN assert that the sites are the same and the header was only checked once
+    assert handle_sites == sites
+    assert len(analysis._headers) == 1
+
+def test_analysis_regions(indexed_vcf_path):
+    ## GIVEN an indexed VCF
+    analysis = UpdAnalysis(vep=True)
+    
+    ## WHEN searching chromosome 15 only
+    sites = list(analysis.sites(indexed_vcf_path, *TRIO, regions=['15']))
+    
+    ## THEN assert that only sites on chromosome 15 are found
+    assert sites
+    assert {site['chrom'] for site in sites} == {'15'}
+
+def test_analysis_errors(vcf_path):
+    ## GIVEN an analysis with a frequency field that is not in the VCF
+    analysis = UpdAnalysis(af_tag='NOT_AF')
+    
+    ## WHEN opening the VCF
+    ## THEN assert that an exception is raised
+    with pytest.raises(ValueError):
+        analysis.sites(vcf_path, *TRIO)
+    
+    ## WHEN giving a sample that is not in the VCF
+    ## THEN assert that an exception is raised
+    with pytest.raises(ValueError):
+        UpdAnalysis(vep=True).sites(vcf_path, 'NOT_A_SAMPLE', *TRIO[1:])
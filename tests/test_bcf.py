@@ -0,0 +1,104 @@
+import gzip
+import io
+
+import pytest
+
+from upd.bcf import (Bcf, is_bcf, open_bcf)
+from upd.utils import get_UPD_informative_sites
+from upd.vcf_tools import (get_vcf, get_indexed_vcf)
+
+TRIO = ('TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+
+
+def test_is_bcf(bcf_path, indexed_vcf_path):
+    ## GIVEN a BCF and a VCF
+    ## WHEN checking the format
+    ## THEN assert that only the BCF is recognized
+    assert is_bcf(bcf_path)
+    assert not is_bcf(indexed_vcf_path)
+
+def test_bcf_variants(bcf_path, indexed_vcf_path):
+    ## GIVEN the same variants as VCF and BCF
+    vcf_reader = get_vcf(indexed_vcf_path, *TRIO)
+    bcf_reader = get_vcf(bcf_path, *TRIO)
+    
+    ## WHEN iterating over both
+    vcf_variants = list(vcf_reader)
+    bcf_variants = list(bcf_reader)
+    
+    ## THEN assert that the variants are the same
+    assert isinstance(bcf_reader, Bcf)
+    assert len(bcf_variants) == len(vcf_variants)
+    for vcf_variant, bcf_variant in zip(vcf_variants, bcf_variants):
+        assert bcf_variant.CHROM == vcf_variant.CHROM
+        assert bcf_variant.POS == vcf_variant.POS
+        assert bcf_variant.ALT == vcf_variant.ALT
+        assert bcf_variant.is_snp == vcf_variant.is_snp
+        assert bcf_variant.gt_types == vcf_variant.gt_types
+        assert bcf_variant.gt_quals == vcf_variant.gt_quals
+        assert bcf_variant.INFO.get('CSQ') == vcf_variant.INFO.get('CSQ')
+
+def test_bcf_get_info(af_vcf_paths):
+    ## GIVEN the same variants as VCF and BCF, with several INFO fields
+    vcf_path, bcf_path = af_vcf_paths
+    
+    ## WHEN looking up single INFO keys
+    for vcf_variant, bcf_variant in zip(get_vcf(vcf_path, *TRIO), get_vcf(bcf_path, *TRIO)):
+        
+        ## THEN assert that the values are those of the VCF, frequencies as floats
+        af = vcf_variant.get_info('MAX_AF')
+        assert bcf_variant.get_info('MAX_AF') == (float(af) if af else None)
+        assert bcf_variant.get_info('CSQ') == vcf_variant.get_info('CSQ')
+        assert bcf_variant.get_info('DP') == vcf_variant.get_info('DP')
+        assert bcf_variant.get_info('DB', False) == vcf_variant.get_info('DB', False)
+        assert bcf_variant.get_info('GQ', 'missing') == 'missing'
+
+@pytest.mark.parametrize('min_af', [0.05, 0.07, 0.13])
+def test_bcf_af_tag(af_vcf_paths, min_af):
+    ## GIVEN the same variants as VCF and BCF, with the frequency in an INFO field
+    vcf_path, bcf_path = af_vcf_paths
+    
+    ## WHEN searching for informative sites, at frequencies found in the file
+    sites = [list(get_UPD_informative_sites(get_vcf(path, *TRIO), None, *TRIO, min_af=min_af))
+             for path in af_vcf_paths]
+    
+    ## THEN assert that the same sites are found
+    assert sites[0] and sites[0] == sites[1]
+
+def test_bcf_select_samples(bcf_path):
+    ## GIVEN a BCF
+    gt_types = next(open_bcf(bcf_path)).gt_types
+    
+    ## WHEN decoding the samples in another order
+    bcf_reader = open_bcf(bcf_path)
+    bcf_reader.select_samples(['TEST_FATHER', 'TEST_PROBAND'])
+    reordered = next(bcf_reader)
+    
+    ## THEN assert that the genotypes follow the selected samples
+    assert bcf_reader.samples == ['TEST_FATHER', 'TEST_PROBAND']
+    assert reordered.gt_types == [gt_types[2], gt_types[0]]
+
+def test_bcf_uncompressed(bcf_path):
+    ## GIVEN an uncompressed BCF
+    with gzip.open(bcf_path, 'rb') as handle:
+        data = handle.read()
+    
+    ## WHEN reading it
+    bcf_reader = Bcf(io.BytesIO(data))
+    
+    ## THEN assert that all variants are read
+    assert sum(1 for _ in bcf_reader) == sum(1 for _ in open_bcf(bcf_path))
+
+def test_bcf_query(bcf_path, indexed_vcf_path):
+    ## GIVEN a BCF with a csi index
+    bcf_reader = get_indexed_vcf(bcf_path, *TRIO)
+    vcf_reader = get_indexed_vcf(indexed_vcf_path, *TRIO)
+    regions = [('15', 20000000, 30000000), ('X', 0, 5000000)]
+    
+    ## WHEN querying regions
+    bcf_variants = [(var.CHROM, var.POS) for var in bcf_reader.query(regions)]
+    vcf_variants = [(var.CHROM, var.POS) for var in vcf_reader.query(regions)]
+    
+    ## THEN assert that the same variants are found as in the VCF
+    assert bcf_variants == vcf_variants
+    assert len(bcf_variants) > 0
@@ -0,0 +1,37 @@
+import pytest
+
+from upd.bed_utils import (parse_region, read_bed_regions, merge_regions)
+
+def test_parse_region():
+    ## GIVEN region strings in the samtools format
+    
+    ## WHEN parsing them
+    
+    ## THEN assert that they are converted to 0-based half open regions
+    assert parse_region('15') == ('15', 0, None)
+    assert parse_region('15:1000') == ('15', 999, None)
+    assert parse_region('15:1,000-2,000') == ('15', 999, 2000)
+    with pytest.raises(SyntaxError):
+        parse_region('15:2000-1000')
+    with pytest.raises(SyntaxError):
+        parse_region('15:start')
+
+def test_read_bed_regions():
+    ## GIVEN the lines of a BED file
+    bed_lines = ["track name=test\n", "15\t100\t200\tname\n", "\n", "X\t0\t50\n"]
+    
+    ## WHEN reading the regions
+    regions = read_bed_regions(bed_lines)
+    
+    ## THEN assert that the header and empty lines are skipped
+    assert regions == [('15', 100, 200), ('X', 0, 50)]
+
+def test_merge_regions():
+    ## GIVEN overlapping regions in random order
+    regions = [('X', 10, 20), ('15', 50, 60), ('15', 0, 55), ('X', 15, None), ('MT', 0, 10)]
+    
+    ## WHEN merging them in file order
+    merged = merge_regions(regions, ['15', 'X'])
+    
+    ## THEN assert that overlaps are merged and unknown chromosomes dropped
+    assert merged == [('15', 0, 60), ('X', 10, None)]
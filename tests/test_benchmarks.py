@@ -0,0 +1,83 @@
+import io
+
+from click.testing import CliRunner
+
+from benchmarks.generate import (cli, generate_trio_vcf, parse_upd_region)
+from benchmarks.run import run_benchmarks
+from upd.bed_utils import output_filtered_regions
+from upd.bgzf import (BgzfReader, is_bgzf)
+from upd.utils import (get_UPD_informative_sites, call_regions)
+from upd.vcf_tools import (Vcf, get_vcf, parse_CSQ_header)
+
+TRIO = ('TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+
+def test_generate_trio_vcf():
+    ## GIVEN the same arguments and seed
+    first = io.StringIO()
+    second = io.StringIO()
+    
+    ## WHEN generating two VCFs
+    nr_first = generate_trio_vcf(first, nr_variants=2000, nr_samples=4, indel_fraction=0.2)
+    generate_trio_vcf(second, nr_variants=2000, nr_samples=4, indel_fraction=0.2)
+    
+    ## THEN assert that they are identical and have the requested size
+    assert first.getvalue() == second.getvalue()
+    records = [line for line in first.getvalue().splitlines() if not line.startswith('#')]
+    assert nr_first == len(records) == 2000
+    assert all(len(record.split('\t')) == 13 for record in records)
+
+def test_generate_bgzipped_vcf(tmp_path):
+    ## GIVEN an output path ending with .gz
+    out_path = str(tmp_path / 'synthetic.vcf.gz')
+    
+    ## WHEN generating a VCF
+    result = CliRunner().invoke(cli, [out_path, '--variants', '5000'])
+    
+    ## THEN assert that it is bgzipped, and that the frequency is also found without VEP
+    assert result.exit_code == 0
+    assert is_bgzf(out_path)
+    text = io.StringIO()
+    generate_trio_vcf(text, nr_variants=5000)
+    with BgzfReader(out_path) as reader:
+        assert ''.join(reader) == text.getvalue()
+    vep_reader = get_vcf(out_path, *TRIO)
+    vep_sites = list(get_UPD_informative_sites(vep_reader, parse_CSQ_header(vep_reader), *TRIO))
+    assert vep_sites
+    assert list(get_UPD_informative_sites(get_vcf(out_path, *TRIO), None, *TRIO)) == vep_sites
+
+def test_planted_upd_region():
+    ## GIVEN a synthetic VCF with a planted paternal UPD
+    out = io.StringIO()
+    region = parse_upd_region('15:20000000-90000000:paternal:hetero')
+    generate_trio_vcf(out, nr_variants=20000, upd_regions=[region])
+    out.seek(0)
+    vcf = Vcf(out)
+    csq_fields = parse_CSQ_header(vcf)
+    
+    ## WHEN calling regions
+    sites = get_UPD_informative_sites(vcf, csq_fields, 'TEST_PROBAND', 'TEST_MOTHER', 
+                                      'TEST_FATHER')
+    lines = list(output_filtered_regions(call_regions(sites)))
+    
+    ## THEN assert that the planted region is found and nothing else
+    assert len(lines) == 1
+    chrom, start, end, info = lines[0].split('\t')
+    assert chrom == '15'
+    assert 'ORIGIN=PATERNAL' in info
+    assert 20000000 <= int(start) < int(end) <= 90000000
+
+def test_run_benchmarks(tmp_path):
+    ## GIVEN a synthetic VCF
+    vcf_path = tmp_path / 'synthetic.vcf'
+    with open(vcf_path, 'w') as handle:
+        generate_trio_vcf(handle, nr_variants=1000)
+    
+    ## WHEN running the benchmarks
+    results = run_benchmarks(str(vcf_path), repeat=1, memory=False)
+    
+    ## THEN assert that every stage is reported
+    assert [stage['stage'] for stage in results] == [
+        'open_file', 'Vcf', 'get_UPD_informative_sites', 'call_regions', 'output_filtered_regions'
+    ]
+    assert results[1]['items'] == 1000
+    assert all(stage['variants_per_sec'] > 0 for stage in results)
@@ -0,0 +1,62 @@
+import gzip
+
+from upd.bgzf import (BgzfReader, BgzfWriter, is_bgzf)
+from upd.vcf_tools import open_file
+
+def test_threaded_reader(indexed_vcf_path):
+    ## GIVEN a bgzipped VCF
+    with gzip.open(indexed_vcf_path, 'rt') as handle:
+        expected = handle.readlines()
+    
+    ## WHEN reading it with several inflate threads
+    with BgzfReader(indexed_vcf_path, threads=3, read_ahead=2) as reader:
+        lines = list(reader)
+    
+    ## THEN assert that the lines are the same and in order
+    assert lines == expected
+
+def test_threaded_reader_seek(indexed_vcf_path):
+    ## GIVEN a threaded reader that has read ahead
+    reader = BgzfReader(indexed_vcf_path, threads=2)
+    for _ in range(20000):
+        line = reader.readline()
+    offset = reader.tell()
+    next_line = reader.readline()
+    for _ in range(100):
+        reader.readline()
+    
+    ## WHEN seeking back to a saved virtual offset
+    reader.seek(offset)
+    
+    ## THEN assert that reading continues from there
+    assert reader.readline() == next_line
+    reader.close()
+
+def test_open_bgzf_file(indexed_vcf_path):
+    ## GIVEN a bgzipped VCF
+    
+    ## WHEN opening it
+    handle = open_file(indexed_vcf_path, threads=2)
+    
+    ## THEN assert that the BGZF reader is used
+    assert isinstance(handle, BgzfReader)
+    handle.close()
+
+def test_bgzf_writer(tmp_path):
+    ## GIVEN data spanning several blocks
+    data = b''.join(b'%d\tline\n' % nr for nr in range(50000))
+    out_path = str(tmp_path / 'out.gz')
+    
+    ## WHEN writing it and saving the virtual offset of a line
+    with BgzfWriter(out_path) as writer:
+        writer.write(data[:300000])
+        offset = writer.tell()
+        writer.write(data[300000:])
+    
+    ## THEN assert that it reads back as gzip and from the virtual offset
+    with gzip.open(out_path, 'rb') as handle:
+        assert handle.read() == data
+    assert is_bgzf(out_path)
+    with BgzfReader(out_path) as reader:
+        reader.seek(offset)
+        assert reader.readline() == data[300000:data.index(b'\n', 300000) + 1]
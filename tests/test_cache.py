@@ -0,0 +1,47 @@
+import os
+
+from upd.cache import SiteCache
+from upd.site_table import SiteTable
+
+SITES = [
+    {'chrom': '1', 'pos': 100, 'call': 3},
+    {'chrom': '2', 'pos': 200, 'call': 2},
+]
+
+def test_cache_key(vcf_path, tmp_path):
+    ## GIVEN a cache
+    cache = SiteCache(str(tmp_path))
+    
+    ## WHEN building keys for different filter parameters
+    key = cache.key(vcf_path, 'PB', 'MO', 'FA', min_af=0.05, min_gq=30)
+    same_key = cache.key(vcf_path, 'PB', 'MO', 'FA', min_gq=30, min_af=0.05)
+    other_key = cache.key(vcf_path, 'PB', 'MO', 'FA', min_af=0.1, min_gq=30)
+    
+    ## THEN assert that only the parameters decide the key
+    assert key == same_key
+    assert key != other_key
+
+def test_cached_sites(tmp_path):
+    ## GIVEN an empty cache
+    cache = SiteCache(str(tmp_path))
+    assert cache.get('key') is None
+    
+    ## WHEN passing sites through the cache
+    assert list(cache.cached('key', iter(SITES))) == SITES
+    
+    ## THEN assert that the sites can be read from the cache
+    assert list(cache.get('key')) == SITES
+
+def test_cache_eviction(tmp_path):
+    ## GIVEN a cache that fits one entry
+    table = SiteTable(SITES)
+    cache = SiteCache(str(tmp_path), max_size=60)
+    cache.put('old', table)
+    os.utime(cache.path('old'), (0, 0))
+    
+    ## WHEN adding another entry
+    cache.put('new', table)
+    
+    ## THEN assert that the least recently used entry is removed
+    assert cache.get('old') is None
+    assert list(cache.get('new')) == SITES
@@ -0,0 +1,71 @@
+import itertools
+
+from upd.checkpoint import Checkpoint
+from upd.utils import get_UPD_informative_sites
+from upd.vcf_tools import (get_vcf, parse_CSQ_header)
+
+TRIO = dict(proband='TEST_PROBAND', mother='TEST_MOTHER', father='TEST_FATHER')
+
+
+def checkpointed_sites(vcf_path, checkpoint_path, resume):
+    """Search a VCF with a checkpoint, like the cli does"""
+    vcf_reader = get_vcf(vcf_path, **TRIO)
+    csq_fields = parse_CSQ_header(vcf_reader)
+    checkpoint = Checkpoint(checkpoint_path, 'key')
+    checkpoint.open(resume)
+    if checkpoint.complete:
+        return checkpoint, iter(checkpoint.sites)
+    checkpoint.track(vcf_reader)
+    sites = get_UPD_informative_sites(vcf_reader, csq_fields, **TRIO)
+    return checkpoint, itertools.chain(checkpoint.sites, checkpoint.track_sites(sites))
+
+def test_checkpoint_resume(indexed_vcf_path, tmp_path):
+    ## GIVEN a search that is interrupted on chromosome 15
+    checkpoint_path = str(tmp_path / 'checkpoint')
+    vcf_reader = get_vcf(indexed_vcf_path, **TRIO)
+    expected = list(get_UPD_informative_sites(vcf_reader, parse_CSQ_header(vcf_reader), **TRIO))
+    checkpoint, sites = checkpointed_sites(indexed_vcf_path, checkpoint_path, resume=False)
+    for site in sites:
+        if site['chrom'] == '15':
+            break
+    checkpoint.close()
+    
+    ## WHEN resuming the search
+    checkpoint, sites = checkpointed_sites(indexed_vcf_path, checkpoint_path, resume=True)
+    
+    ## THEN assert that the finished chromosomes are skipped and the sites are the same
+    assert checkpoint.contigs == [str(chrom) for chrom in range(1, 15)]
+    assert checkpoint.offset > 0
+    assert list(sites) == expected
+    assert checkpoint.complete
+
+def test_checkpoint_other_key(indexed_vcf_path, tmp_path):
+    ## GIVEN a finished checkpoint
+    checkpoint_path = str(tmp_path / 'checkpoint')
+    _, sites = checkpointed_sites(indexed_vcf_path, checkpoint_path, resume=False)
+    list(sites)
+    
+    ## WHEN resuming a search with another key
+    checkpoint = Checkpoint(checkpoint_path, 'other key')
+    
+    ## THEN assert that the search starts from the beginning
+    assert checkpoint.open(resume=True) is False
+    assert checkpoint.offset == 0
+    assert len(checkpoint.sites) == 0
+    checkpoint.close()
+
+def test_checkpoint_truncated(indexed_vcf_path, tmp_path):
+    ## GIVEN a checkpoint where the last record was only partly written
+    checkpoint_path = tmp_path / 'checkpoint'
+    _, sites = checkpointed_sites(indexed_vcf_path, str(checkpoint_path), resume=False)
+    expected = list(sites)
+    data = checkpoint_path.read_bytes()
+    checkpoint_path.write_bytes(data[:-10])
+    
+    ## WHEN resuming the search
+    checkpoint, sites = checkpointed_sites(indexed_vcf_path, str(checkpoint_path), resume=True)
+    
+    ## THEN assert that the last chromosome is searched again
+    assert not checkpoint.complete
+    assert list(sites) == expected
+    assert checkpoint_path.read_bytes() == data
@@ -1,7 +1,14 @@
+import gzip
+import json
+
+import pytest
+
 from click.testing import CliRunner
 
-from upd.cli import cli
+from upd.cli import (cli, SweepValues)
 from upd.__version__ import __version__
+from upd.bgzf import is_bgzf
+from upd.tabix import read_index
 
 def test_version():
     runner = CliRunner()
@@ -19,3 +26,298 @@ def test_upd(vcf_path):
     
     assert result.exit_code == 0
 
+
+def test_upd_processes(indexed_vcf_path, tmp_path):
+    ## GIVEN an indexed VCF
+    runner = CliRunner()
+    args = ['--vcf', indexed_vcf_path, '--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER',
+            '--father', 'TEST_FATHER', '--vep']
+    serial_out = tmp_path / 'serial.bed'
+    parallel_out = tmp_path / 'parallel.bed'
+    
+    ## WHEN calling regions with one and with several processes
+    runner.invoke(cli, args + ['regions', '--out', str(serial_out)])
+    result = runner.invoke(cli, args + ['--processes', '2', 'regions', '--out', str(parallel_out)])
+    
+    ## THEN assert that the output is identical
+    assert result.exit_code == 0
+    assert parallel_out.read_text() == serial_out.read_text()
+
+def test_upd_processes_pipelined(vcf_path, tmp_path):
+    ## GIVEN a VCF without an index
+    runner = CliRunner()
+    args = ['--vcf', vcf_path, '--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER',
+            '--father', 'TEST_FATHER', '--vep']
+    serial_out = tmp_path / 'serial.bed'
+    pipelined_out = tmp_path / 'pipelined.bed'
+    
+    ## WHEN calling regions with one process and with a pipeline of several processes
+    runner.invoke(cli, args + ['regions', '--out', str(serial_out)])
+    result = runner.invoke(cli, args + ['--processes', '2', 'regions', '--out', 
+                                        str(pipelined_out)])
+    
+    ## THEN assert that the output is identical
+    assert result.exit_code == 0
+    assert pipelined_out.read_text() == serial_out.read_text()
+
+def test_upd_trios(cohort_vcf_path, tmp_path):
+    ## GIVEN a VCF with two trios
+    runner = CliRunner()
+    
+    ## WHEN calling regions for both trios in one pass
+    result = runner.invoke(cli, [
+        '--vcf', cohort_vcf_path, '--vep', '--trio', 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER',
+        '--trio', 'SWAP_PROBAND', 'SWAP_MOTHER', 'SWAP_FATHER', 'regions', '--out-dir', 
+        str(tmp_path)
+    ])
+    
+    ## THEN assert that one output is written per trio
+    assert result.exit_code == 0
+    assert 'ORIGIN=PATERNAL' in (tmp_path / 'TEST_PROBAND.upd_regions.bed').read_text()
+    assert 'ORIGIN=MATERNAL' in (tmp_path / 'SWAP_PROBAND.upd_regions.bed').read_text()
+
+def test_sweep(vcf_path, tmp_path):
+    ## GIVEN lists and ranges of region filter parameters
+    runner = CliRunner()
+    
+    ## WHEN running a parameter sweep
+    result = runner.invoke(cli, [
+        '--vcf', vcf_path, '--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER', '--father', 
+        'TEST_FATHER', '--vep', 'sweep', '--min-sites', '3,200', '--min-size', '1000:3000:1000', 
+        '--iso-het-pct', '0.01', '--out-dir', str(tmp_path)
+    ])
+    
+    ## THEN assert that one output is written per combination
+    assert result.exit_code == 0
+    assert len(list(tmp_path.iterdir())) == 6
+    default_out = tmp_path / 'upd_regions.min_sites_3.min_size_1000.iso_het_pct_0.01.bed'
+    assert len(default_out.read_text().splitlines()) == 2
+    strict_out = tmp_path / 'upd_regions.min_sites_200.min_size_1000.iso_het_pct_0.01.bed'
+    assert strict_out.read_text() == ''
+
+def test_sweep_values():
+    ## GIVEN the sweep parameter type
+    
+    ## WHEN converting lists and ranges
+    
+    ## THEN assert that the values are expanded
+    assert SweepValues(int).convert('3,5,10', None, None) == [3, 5, 10]
+    assert SweepValues(int).convert('1000:3000:1000', None, None) == [1000, 2000, 3000]
+    assert SweepValues(float).convert('0.01:0.03:0.01', None, None) == [0.01, 0.02, 0.03]
+
+@pytest.mark.parametrize('compression', ['gzip', 'bgzip', 'plain'])
+def test_upd_stdin(vcf_path, indexed_vcf_path, tmp_path, compression):
+    ## GIVEN a VCF piped to stdin
+    runner = CliRunner()
+    args = ['--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER', '--father', 'TEST_FATHER',
+            '--vep']
+    input_path = indexed_vcf_path if compression == 'bgzip' else vcf_path
+    with open(input_path, 'rb') as handle:
+        vcf_data = handle.read()
+    if compression == 'plain':
+        vcf_data = gzip.decompress(vcf_data)
+    file_out = tmp_path / 'file.bed'
+    stdin_out = tmp_path / 'stdin.bed'
+    
+    ## WHEN calling regions from stdin
+    runner.invoke(cli, ['--vcf', input_path] + args + ['regions', '--out', str(file_out)])
+    result = runner.invoke(cli, ['--vcf', '-'] + args + ['regions', '--out', str(stdin_out)], 
+                           input=vcf_data)
+    
+    ## THEN assert that the output is the same as when reading the file
+    assert result.exit_code == 0
+    assert stdin_out.read_text() == file_out.read_text()
+
+def test_upd_regions_restricted(vcf_path, indexed_vcf_path, tmp_path):
+    ## GIVEN an indexed VCF
+    runner = CliRunner()
+    args = ['--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER', '--father', 'TEST_FATHER',
+            '--vep']
+    out_file = tmp_path / 'regions.bed'
+    
+    ## WHEN calling regions on chromosome 15 only
+    result = runner.invoke(cli, ['--vcf', indexed_vcf_path, '--region', '15'] + args + 
+                           ['regions', '--out', str(out_file)])
+    
+    ## THEN assert that only the region on chromosome 15 is found
+    assert result.exit_code == 0
+    lines = out_file.read_text().splitlines()
+    assert len(lines) == 1
+    assert lines[0].startswith('15\t')
+    
+    ## WHEN restricting a VCF without an index
+    result = runner.invoke(cli, ['--vcf', vcf_path, '--region', '15'] + args + ['regions'])
+    
+    ## THEN assert that it fails
+    assert result.exit_code != 0
+
+def test_upd_metrics(vcf_path, tmp_path):
+    ## GIVEN a VCF
+    runner = CliRunner()
+    args = ['--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER', '--father', 'TEST_FATHER',
+            '--vep']
+    metrics_path = tmp_path / 'metrics.json'
+    
+    ## WHEN calling regions with and without metrics
+    runner.invoke(cli, ['--vcf', vcf_path] + args + ['regions', '--out', str(tmp_path / 'a.bed')])
+    result = runner.invoke(cli, ['--vcf', vcf_path, '--metrics', str(metrics_path)] + args + 
+                           ['regions', '--out', str(tmp_path / 'b.bed')])
+    
+    ## THEN assert that the output is the same and the metrics are written
+    assert result.exit_code == 0
+    assert (tmp_path / 'a.bed').read_text() == (tmp_path / 'b.bed').read_text()
+    metrics = json.loads(metrics_path.read_text())
+    assert set(metrics['stages']) == {'decompress', 'parse', 'filter', 'classify', 'segment', 
+                                      'write'}
+    assert set(metrics['counters']) == {'non_snp', 'af', 'gq', 'no_call'}
+    assert metrics['bytes_read'] == metrics['total_bytes']
+
+def test_upd_regions_with_sites(vcf_path, cohort_vcf_path, tmp_path):
+    ## GIVEN a VCF
+    runner = CliRunner()
+    args = ['--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER', '--father', 'TEST_FATHER',
+            '--vep']
+    
+    ## WHEN writing sites and regions in one pass and in two
+    runner.invoke(cli, ['--vcf', vcf_path] + args + ['sites', '--out', str(tmp_path / 'a.sites')])
+    runner.invoke(cli, ['--vcf', vcf_path] + args + ['regions', '--out', 
+                                                     str(tmp_path / 'a.regions')])
+    result = runner.invoke(cli, ['--vcf', vcf_path] + args + [
+        'regions', '--out', str(tmp_path / 'b.regions'), '--sites-out', str(tmp_path / 'b.sites')
+    ])
+    
+    ## THEN assert that the outputs are the same
+    assert result.exit_code == 0
+    assert (tmp_path / 'b.sites').read_text() == (tmp_path / 'a.sites').read_text()
+    assert (tmp_path / 'b.regions').read_text() == (tmp_path / 'a.regions').read_text()
+    
+    ## WHEN writing sites and regions of several trios in one pass
+    result = runner.invoke(cli, [
+        '--vcf', cohort_vcf_path, '--vep', '--trio', 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER',
+        '--trio', 'SWAP_PROBAND', 'SWAP_MOTHER', 'SWAP_FATHER', 'regions', '--out-dir', 
+        str(tmp_path / 'trios'), '--sites-out', str(tmp_path / 'trio_sites')
+    ])
+    
+    ## THEN assert that the sites of each trio are written
+    assert result.exit_code == 0
+    trio_sites = (tmp_path / 'trio_sites' / 'TEST_PROBAND.upd_sites.bed').read_text()
+    assert trio_sites == (tmp_path / 'a.sites').read_text()
+    assert (tmp_path / 'trio_sites' / 'SWAP_PROBAND.upd_sites.bed').exists()
+
+def test_upd_bcf(bcf_path, indexed_vcf_path, tmp_path):
+    ## GIVEN the same variants as VCF and BCF
+    runner = CliRunner()
+    args = ['--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER', '--father', 'TEST_FATHER',
+            '--vep']
+    
+    ## WHEN calling sites and regions on both
+    for options, command in (([], 'sites'), ([], 'regions'), (['--region', '15'], 'regions')):
+        outputs = []
+        for path in (indexed_vcf_path, bcf_path):
+            out_file = tmp_path / 'out.bed'
+            result = runner.invoke(cli, ['--vcf', path] + args + options + 
+                                   [command, '--out', str(out_file)])
+            assert result.exit_code == 0
+            outputs.append(out_file.read_text())
+        
+        ## THEN assert that the output is the same
+        assert outputs[0] == outputs[1]
+        assert outputs[0]
+    
+    ## WHEN timing the stages of a search of the BCF
+    metrics_path = tmp_path / 'metrics.json'
+    result = runner.invoke(cli, ['--vcf', bcf_path, '--metrics', str(metrics_path)] + args + 
+                           ['sites', '--out', str(tmp_path / 'sites.bed')])
+    
+    ## THEN assert that reading the records is timed, once for each record and at the end
+    assert result.exit_code == 0
+    metrics = json.loads(metrics_path.read_text())
+    assert metrics['stages']['decompress']['calls'] == metrics['variants_parsed'] + 1
+
+def test_upd_checkpoint(indexed_vcf_path, tmp_path):
+    ## GIVEN an indexed VCF
+    runner = CliRunner()
+    args = ['--vcf', indexed_vcf_path, '--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER',
+            '--father', 'TEST_FATHER', '--vep']
+    checkpoint_path = tmp_path / 'checkpoint'
+    out_file = tmp_path / 'regions.bed'
+    resumed_file = tmp_path / 'resumed.bed'
+    
+    ## WHEN calling regions with a checkpoint, and resuming from a partial checkpoint
+    result = runner.invoke(cli, args + ['--checkpoint', str(checkpoint_path), 'regions', 
+                                        '--out', str(out_file)])
+    assert result.exit_code == 0
+    data = checkpoint_path.read_bytes()
+    checkpoint_path.write_bytes(data[:len(data) // 2])
+    result = runner.invoke(cli, args + ['--checkpoint', str(checkpoint_path), '--resume', 
+                                        'regions', '--out', str(resumed_file)])
+    
+    ## THEN assert that the output is identical
+    assert result.exit_code == 0
+    assert resumed_file.read_text() == out_file.read_text()
+    assert checkpoint_path.read_bytes() == data
+
+def test_upd_sites_bgzf(indexed_vcf_path, tmp_path):
+    ## GIVEN a sorted VCF
+    runner = CliRunner()
+    args = ['--vcf', indexed_vcf_path, '--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER',
+            '--father', 'TEST_FATHER', '--vep', 'sites', '--out']
+    out_file = tmp_path / 'sites.bed'
+    gz_file = tmp_path / 'sites.bed.gz'
+    
+    ## WHEN writing the sites plain and bgzipped
+    runner.invoke(cli, args + [str(out_file)])
+    result = runner.invoke(cli, args + [str(gz_file)])
+    
+    ## THEN assert that the bgzipped file has the same lines and a tabix index
+    assert result.exit_code == 0
+    assert is_bgzf(str(gz_file))
+    assert gzip.open(gz_file, 'rt').read() == out_file.read_text()
+    index = read_index(str(gz_file) + '.tbi')
+    assert '15' in index
+
+def test_upd_regions_npz(vcf_path, tmp_path):
+    ## GIVEN a VCF
+    np = pytest.importorskip('numpy')
+    runner = CliRunner()
+    args = ['--vcf', vcf_path, '--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER',
+            '--father', 'TEST_FATHER', '--vep', 'regions', '--out']
+    out_file = tmp_path / 'regions.bed'
+    npz_file = tmp_path / 'regions.npz'
+    
+    ## WHEN writing the regions as BED and as typed columns
+    runner.invoke(cli, args + [str(out_file)])
+    result = runner.invoke(cli, args + [str(npz_file), '--format', 'npz'])
+    
+    ## THEN assert that the same regions are written
+    assert result.exit_code == 0
+    columns = np.load(str(npz_file))
+    regions = zip(columns['chrom_names'][columns['chrom']], columns['start'], columns['end'])
+    assert [f"{chrom}\t{start}\t{end}" for chrom, start, end in regions] == [
+        line.rsplit('\t', 1)[0] for line in out_file.read_text().splitlines()
+    ]
+    
+    ## WHEN writing typed columns to stdout
+    result = runner.invoke(cli, args + ['-', '--format', 'npz'])
+    
+    ## THEN assert that the command is aborted
+    assert result.exit_code != 0
+
+def test_upd_shards(indexed_vcf_path, shard_paths, tmp_path):
+    ## GIVEN a VCF and its shards
+    runner = CliRunner()
+    args = ['--proband', 'TEST_PROBAND', '--mother', 'TEST_MOTHER', '--father', 'TEST_FATHER',
+            '--vep', 'regions', '--out']
+    out_file = tmp_path / 'regions.bed'
+    shards_file = tmp_path / 'shards.bed'
+    shard_args = []
+    for path in shard_paths:
+        shard_args.extend(['--vcf', path])
+    
+    ## WHEN calling regions on the VCF and on the shards
+    runner.invoke(cli, ['--vcf', indexed_vcf_path] + args + [str(out_file)])
+    result = runner.invoke(cli, shard_args + args + [str(shards_file)])
+    
+    ## THEN assert that the regions are the same
+    assert result.exit_code == 0
+    assert shards_file.read_text() == out_file.read_text()
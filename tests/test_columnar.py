@@ -0,0 +1,61 @@
+import pytest
+
+from upd import (UpdAnalysis, SiteTable)
+from upd.bed_utils import (format_region, output_sites)
+from upd.columnar import (load_columns, write_regions, write_sites)
+
+np = pytest.importorskip('numpy')
+
+TRIO = ('TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+
+
+def test_write_sites_npz(vcf_path, tmp_path):
+    ## GIVEN the informative sites of a trio
+    sites = SiteTable(UpdAnalysis(vep=True).sites(vcf_path, *TRIO))
+    out_path = str(tmp_path / 'sites.npz')
+    
+    ## WHEN writing them as typed columns and loading them
+    write_sites(sites, out_path)
+    columns = load_columns(out_path)
+    
+    ## THEN assert that the columns are typed and give the same sites
+    assert columns['pos'].dtype == np.uint32
+    assert columns['call'].dtype == np.uint8
+    chroms = columns['chrom_names']
+    assert list(chroms[columns['chrom']]) == [site['chrom'] for site in sites]
+    assert list(columns['pos']) == list(sites.pos)
+    assert list(columns['call_names'][columns['call']]) == [line.split('\t')[3] for line in 
+                                                             output_sites(sites)]
+
+def test_write_regions_npz(vcf_path, tmp_path):
+    ## GIVEN the regions of a trio
+    regions = UpdAnalysis(vep=True).run(vcf_path, *TRIO).regions
+    out_path = str(tmp_path / 'regions.npz')
+    
+    ## WHEN writing them as typed columns and loading them
+    write_regions(regions, out_path)
+    columns = load_columns(out_path)
+    
+    ## THEN assert that the columns hold the fields of the BED lines
+    lines = [format_region(region).split('\t') for region in regions]
+    assert list(columns['chrom_names'][columns['chrom']]) == [line[0] for line in lines]
+    assert list(columns['start']) == [int(line[1]) for line in lines]
+    assert list(columns['end']) == [int(line[2]) for line in lines]
+    assert list(columns['origin_names'][columns['origin']]) == [region['origin'] 
+                                                               for region in regions]
+    assert list(columns['snps']) == [region['tot'] for region in regions]
+
+def test_write_sites_arrow(vcf_path, tmp_path):
+    ## GIVEN the informative sites of a trio and pyarrow
+    pytest.importorskip('pyarrow')
+    sites = SiteTable(UpdAnalysis(vep=True).sites(vcf_path, *TRIO))
+    out_path = str(tmp_path / 'sites.arrow')
+    
+    ## WHEN writing them as an Arrow file and loading it
+    write_sites(sites, out_path, 'arrow')
+    table = load_columns(out_path)
+    
+    ## THEN assert that the chromosomes are dictionary encoded and the sites are the same
+    assert table.num_rows == len(sites)
+    assert table.column('chrom').to_pylist() == [site['chrom'] for site in sites]
+    assert table.column('pos').to_pylist() == list(sites.pos)
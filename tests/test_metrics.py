@@ -0,0 +1,42 @@
+import json
+import time
+
+from upd.metrics import Metrics
+
+def test_nested_timers():
+    ## GIVEN metrics with an inner stage inside an outer stage
+    metrics = Metrics()
+    
+    ## WHEN timing the stages
+    with metrics.timer('outer'):
+        time.sleep(0.02)
+        with metrics.timer('inner'):
+            time.sleep(0.05)
+    
+    ## THEN assert that the inner time is not counted in the outer stage
+    outer_wall, _, outer_calls = metrics.stages['outer']
+    inner_wall, _, inner_calls = metrics.stages['inner']
+    assert inner_wall >= 0.05
+    assert 0.02 <= outer_wall < 0.05
+    assert outer_calls == inner_calls == 1
+
+def test_timed_iter_and_counters(tmp_path):
+    ## GIVEN metrics and an iterable
+    metrics = Metrics()
+    
+    ## WHEN iterating, calling and counting
+    items = list(metrics.track(metrics.timed_iter('read', range(5))))
+    double = metrics.timed_call('double', lambda x: 2 * x)
+    doubled = [double(item) for item in items]
+    metrics.update_counters({'af': 2, 'gq': 1})
+    metrics.count('af')
+    metrics_path = tmp_path / 'metrics.json'
+    metrics.write(metrics_path)
+    
+    ## THEN assert that the items pass through and the metrics are written
+    assert doubled == [0, 2, 4, 6, 8]
+    result = json.loads(metrics_path.read_text())
+    assert result['variants_parsed'] == 5
+    assert result['stages']['read']['calls'] == 6
+    assert result['stages']['double']['calls'] == 5
+    assert result['counters'] == {'af': 3, 'gq': 1}
@@ -0,0 +1,33 @@
+import pytest
+
+from upd.parallel import get_UPD_informative_sites_parallel
+from upd.utils import get_UPD_informative_sites
+from upd.vcf_tools import (get_vcf, parse_CSQ_header)
+
+def test_parallel_sites(indexed_vcf_path):
+    ## GIVEN an indexed VCF
+    vcf_reader = get_vcf(indexed_vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+    csq_fields = parse_CSQ_header(vcf_reader)
+    params = dict(
+        csq_fields=csq_fields,
+        proband='TEST_PROBAND',
+        mother='TEST_MOTHER',
+        father='TEST_FATHER',
+    )
+    
+    ## WHEN searching for informative sites in parallel
+    sites = list(get_UPD_informative_sites_parallel(indexed_vcf_path, processes=2, **params))
+    
+    ## THEN assert that the sites are the same as in a serial search
+    assert sites == list(get_UPD_informative_sites(vcf_reader, **params))
+
+def test_parallel_sites_multiallelic(multiallelic_vcf_path):
+    ## GIVEN an indexed VCF with a multi-allelic variant
+    vcf_reader = get_vcf(multiallelic_vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+    csq_fields = parse_CSQ_header(vcf_reader)
+    
+    ## WHEN searching for informative sites in parallel
+    ## THEN assert that the error of the worker is raised instead of waiting for it
+    with pytest.raises(ValueError, match='Split your variants'):
+        list(get_UPD_informative_sites_parallel(multiallelic_vcf_path, csq_fields, 'TEST_PROBAND',
+                                                'TEST_MOTHER', 'TEST_FATHER', processes=2))
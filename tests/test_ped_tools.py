@@ -0,0 +1,37 @@
+import pytest
+
+from upd.ped_tools import (parse_ped, get_trios)
+
+def test_parse_ped():
+    ## GIVEN the lines of a PED file with a header
+    ped_lines = [
+        "#family_id\tsample_id\tfather\tmother\tsex\tphenotype\n",
+        "fam\tchild\tdad\tmom\t1\t2\n",
+    ]
+    
+    ## WHEN parsing the lines
+    individuals = parse_ped(ped_lines)
+    
+    ## THEN assert that the individual is found
+    assert individuals == [{
+        'family_id': 'fam', 'sample_id': 'child', 'father': 'dad', 'mother': 'mom', 
+        'sex': '1', 'phenotype': '2'
+    }]
+
+def test_parse_malformed_ped():
+    ## GIVEN a PED line with too few columns
+    ped_lines = ["fam\tchild\tdad\n"]
+    
+    ## WHEN parsing the lines
+    with pytest.raises(SyntaxError):
+        ## THEN assert a SyntaxError is raised
+        parse_ped(ped_lines)
+
+def test_get_trios(ped_path):
+    ## GIVEN a PED file with a trio
+    
+    ## WHEN getting the trios
+    trios = get_trios(ped_path)
+    
+    ## THEN assert that only the proband is a trio
+    assert trios == [('TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')]
@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from upd.pipeline import get_UPD_informative_sites_pipelined
+from upd.utils import get_UPD_informative_sites
+from upd.vcf_tools import (get_vcf, parse_CSQ_header)
+
+TRIO = dict(proband='TEST_PROBAND', mother='TEST_MOTHER', father='TEST_FATHER')
+
+@pytest.mark.parametrize('batch_size, max_pending', [(1000, None), (3333, 1)])
+def test_pipelined_sites(vcf_path, batch_size, max_pending):
+    ## GIVEN a VCF that is not indexed
+    vcf_reader = get_vcf(vcf_path, **TRIO)
+    csq_fields = parse_CSQ_header(vcf_reader)
+    
+    ## WHEN searching for informative sites in a pipeline
+    sites = list(get_UPD_informative_sites_pipelined(vcf_reader, csq_fields, processes=2,
+                                                     batch_size=batch_size,
+                                                     max_pending=max_pending, **TRIO))
+    
+    ## THEN assert that the sites are the same, in the same order, as in a serial search
+    serial_reader = get_vcf(vcf_path, **TRIO)
+    assert sites == list(get_UPD_informative_sites(serial_reader, csq_fields, **TRIO))
+
+def test_pipelined_sites_stopped(vcf_path):
+    ## GIVEN a pipelined search
+    vcf_reader = get_vcf(vcf_path, **TRIO)
+    csq_fields = parse_CSQ_header(vcf_reader)
+    sites = get_UPD_informative_sites_pipelined(vcf_reader, csq_fields, processes=2,
+                                                batch_size=100, max_pending=1, **TRIO)
+    
+    ## WHEN only taking the first sites
+    first_sites = [next(sites) for _ in range(10)]
+    sites.close()
+    
+    ## THEN assert that the pipeline stops before the VCF has been read
+    assert len(first_sites) == 10
+    assert vcf_reader.nr_variants < 1000
+
+def test_pipelined_sites_slow_reader(vcf_path):
+    ## GIVEN a VCF that stalls after its first batch of lines is read
+    vcf_reader = get_vcf(vcf_path, **TRIO)
+    csq_fields = parse_CSQ_header(vcf_reader)
+    iter_lines = vcf_reader.iter_lines
+    resume = threading.Event()
+    resumed = []
+    
+    def stalled_lines():
+        for nr, line in enumerate(iter_lines()):
+            if nr == 1000:
+                resume.wait(10)
+                resumed.append(resume.is_set())
+            yield line
+    
+    vcf_reader.iter_lines = stalled_lines
+    sites = get_UPD_informative_sites_pipelined(vcf_reader, csq_fields, processes=2,
+                                                batch_size=1000, **TRIO)
+    
+    ## WHEN taking the first site
+    first_site = next(sites)
+    
+    ## THEN assert that it is given while the reader waits, and that the rest follows
+    assert not resumed
+    resume.set()
+    serial_reader = get_vcf(vcf_path, **TRIO)
+    assert [first_site] + list(sites) == list(get_UPD_informative_sites(serial_reader,
+                                                                        csq_fields, **TRIO))
+    assert resumed == [True]
+
+def test_pipelined_sites_multiallelic(multiallelic_vcf_path):
+    ## GIVEN a VCF with a multi-allelic variant
+    vcf_reader = get_vcf(multiallelic_vcf_path, **TRIO)
+    csq_fields = parse_CSQ_header(vcf_reader)
+    
+    ## WHEN searching for informative sites in a pipeline
+    ## THEN assert that the error of the worker is raised instead of waiting for it
+    with pytest.raises(ValueError, match='Split your variants'):
+        list(get_UPD_informative_sites_pipelined(vcf_reader, csq_fields, processes=2,
+                                                 batch_size=100, **TRIO))
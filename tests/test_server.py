@@ -0,0 +1,127 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from click.testing import CliRunner
+
+from upd.cache import SiteCache
+from upd.cli import cli
+from upd.server import (run_job, JobServer)
+
+TRIO = ('TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+
+
+def trio_job(vcf, job_id, **params):
+    job = {'id': job_id, 'vcf': vcf, 'proband': TRIO[0], 'mother': TRIO[1], 'father': TRIO[2],
+           'vep': True}
+    job.update(params)
+    return job
+
+def test_run_job(vcf_path, tmp_path):
+    ## GIVEN a VCF and the regions called by the command line
+    out_file = tmp_path / 'regions.bed'
+    CliRunner().invoke(cli, ['--vcf', vcf_path, '--proband', TRIO[0], '--mother', TRIO[1],
+                             '--father', TRIO[2], '--vep', 'regions', '--out', str(out_file)])
+    job_file = tmp_path / 'job.bed'
+    cache = SiteCache(str(tmp_path / 'cache'))
+    analyses = {}
+
+    ## WHEN running the same job twice with a cache
+    result = run_job(trio_job(vcf_path, 'first', out=str(job_file)), analyses, cache)
+    cached_result = run_job(trio_job(vcf_path, 'second'), analyses, cache)
+
+    ## THEN assert that the regions are the same and the second job used the cache
+    assert result['status'] == 'ok'
+    assert job_file.read_text() == out_file.read_text()
+    assert not result['metrics']['cached']
+    assert cached_result['metrics']['cached']
+    assert 'search' not in cached_result['metrics']['stages']
+    assert cached_result['regions'] == result['regions']
+    assert len(analyses) == 1
+
+def test_run_job_errors(vcf_path):
+    ## GIVEN jobs missing a sample or with a field that is not in the VCF
+    jobs = [
+        {'id': 1, 'vcf': vcf_path, 'proband': TRIO[0]},
+        trio_job(vcf_path, 2, af_tag='NOT_AF'),
+    ]
+
+    ## WHEN running the jobs
+    results = [run_job(job) for job in jobs]
+
+    ## THEN assert that errors are returned for the jobs
+    assert [result['status'] for result in results] == ['error', 'error']
+    assert [result['id'] for result in results] == [1, 2]
+    assert 'mother' in results[0]['error']
+
+def test_serve_lines(vcf_path, indexed_vcf_path):
+    ## GIVEN job lines with a malformed line
+    lines = [
+        json.dumps(trio_job(vcf_path, 'all')),
+        'not a job',
+        json.dumps(trio_job(indexed_vcf_path, 'chrX', regions=['X'])),
+    ]
+    results = []
+
+    ## WHEN serving the lines
+    with JobServer(processes=2) as server:
+        server.serve_lines(lines, results.append)
+
+    ## THEN assert that there is a result for each line
+    results = {result['id']: result for result in map(json.loads, results)}
+    assert results[None]['status'] == 'error'
+    assert results['all']['status'] == 'ok'
+    assert [region['chrom'] for region in results['chrX']['regions']] == ['X']
+
+def test_serve_socket(vcf_path, tmp_path):
+    ## GIVEN a server listening on a socket
+    socket_path = str(tmp_path / 'upd.sock')
+    server = JobServer()
+    thread = threading.Thread(target=server.serve_socket, args=(socket_path,), daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+
+    ## WHEN sending a job
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(trio_job(vcf_path, 'job')).encode('utf-8') + b'\n')
+        client.shutdown(socket.SHUT_WR)
+        response = client.makefile('r').read()
+
+    ## THEN assert that the result is sent back
+    result = json.loads(response)
+    assert result['id'] == 'job'
+    assert result['regions'][0]['origin'] == 'PATERNAL'
+
+def test_serve_socket_existing_file(tmp_path):
+    ## GIVEN a file at the socket path
+    socket_path = tmp_path / 'regions.bed'
+    socket_path.write_text('1\t10\t20\n')
+
+    ## WHEN serving on it
+    result = CliRunner().invoke(cli, ['serve', '--socket', str(socket_path)])
+
+    ## THEN assert that the server does not start and the file is kept
+    assert result.exit_code != 0
+    assert socket_path.read_text() == '1\t10\t20\n'
+    with JobServer() as server, pytest.raises(OSError):
+        server.serve_socket(str(socket_path))
+
+def test_upd_serve(vcf_path):
+    ## GIVEN a job line
+    job = json.dumps(trio_job(vcf_path, 'job'))
+
+    ## WHEN serving the jobs on stdin
+    result = CliRunner().invoke(cli, ['--loglevel', 'ERROR', 'serve'], input=job + '\n')
+
+    ## THEN assert that a result line is written
+    assert result.exit_code == 0
+    results = [json.loads(line) for line in result.output.splitlines() if line.startswith('{')]
+    assert [result['status'] for result in results] == ['ok']
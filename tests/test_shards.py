@@ -0,0 +1,74 @@
+import pytest
+
+from upd.shards import (expand_vcf_paths, get_UPD_informative_sites_sharded, merge_sites, 
+                        open_shards)
+from upd.utils import get_UPD_informative_sites
+from upd.vcf_tools import (get_vcf, parse_CSQ_header)
+
+TRIO = ('TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+
+
+def sharded_sites(shard_paths, processes=1):
+    shards = open_shards(shard_paths, *TRIO)
+    csq_fields = parse_CSQ_header(shards[0])
+    return list(get_UPD_informative_sites_sharded(shards, shard_paths, csq_fields, *TRIO,
+                                                  processes=processes))
+
+def test_expand_vcf_paths(shard_paths, tmp_path):
+    ## GIVEN a file of VCFs with paths relative to it
+    list_path = tmp_path / 'shards.list'
+    list_path.write_text('# shards\n' + '\n'.join(path.split('/')[-1] for path in shard_paths))
+    
+    ## WHEN expanding the paths given with --vcf
+    vcf_paths = expand_vcf_paths([str(list_path)])
+    
+    ## THEN assert that the VCFs of the list are given
+    assert vcf_paths == shard_paths
+    with pytest.raises(SyntaxError):
+        expand_vcf_paths(shard_paths + ['-'])
+
+def test_merge_sites():
+    ## GIVEN the sites of two shards, one of them with a contig missing in the header
+    first = [{'chrom': '2', 'pos': 5}, {'chrom': 'Y', 'pos': 1}]
+    second = [{'chrom': '1', 'pos': 10}, {'chrom': '2', 'pos': 3}]
+    
+    ## WHEN merging them in the order of the header contigs
+    merged = list(merge_sites([first, second], ['1', '2']))
+    
+    ## THEN assert that the sites are in contig order
+    assert [(site['chrom'], site['pos']) for site in merged] == [('1', 10), ('2', 3), ('2', 5), 
+                                                                 ('Y', 1)]
+    
+    ## WHEN a shard is not sorted
+    ## THEN assert that an exception is raised
+    with pytest.raises(SyntaxError):
+        list(merge_sites([first[::-1], second], ['1', '2']))
+
+def test_sharded_sites(indexed_vcf_path, shard_paths):
+    ## GIVEN a VCF and its shards, given in another order than the contigs
+    vcf_reader = get_vcf(indexed_vcf_path, *TRIO)
+    sites = list(get_UPD_informative_sites(vcf_reader, parse_CSQ_header(vcf_reader), *TRIO))
+    
+    ## WHEN searching the shards, with one and with two processes
+    ## THEN assert that the sites are the same as of the VCF
+    assert sharded_sites(shard_paths) == sites
+    assert sharded_sites(shard_paths, processes=2) == sites
+
+def test_open_shards_samples(shard_paths):
+    ## GIVEN a shard with other samples
+    with open(shard_paths[-1]) as handle:
+        text = handle.read()
+    with open(shard_paths[-1], 'w') as handle:
+        handle.write(text.replace('TEST_FATHER', 'TEST_FATHER\tOTHER_SAMPLE', 1))
+    
+    ## WHEN opening the shards
+    ## THEN assert that an exception is raised
+    with pytest.raises(SyntaxError):
+        open_shards(shard_paths, *TRIO)
+
+def test_sharded_sites_multiallelic(multiallelic_shard_paths):
+    ## GIVEN shards, one of them with a multi-allelic variant
+    ## WHEN searching them in parallel
+    ## THEN assert that the error of the worker is raised instead of waiting for it
+    with pytest.raises(ValueError, match='Split your variants'):
+        sharded_sites(multiallelic_shard_paths, processes=2)
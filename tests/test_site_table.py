@@ -0,0 +1,73 @@
+import pickle
+
+import pytest
+
+from upd.site_table import (MAX_CHROMS, MAX_POS, SiteTable)
+
+SITES = [
+    {'chrom': '1', 'pos': 100, 'call': 3},
+    {'chrom': '1', 'pos': 200, 'call': 2},
+    {'chrom': 'X', 'pos': 154051824, 'call': 1},
+]
+
+def test_site_table():
+    ## GIVEN a table with site calls added one by one
+    table = SiteTable()
+    for site in SITES:
+        table.append(site)
+    
+    ## WHEN iterating over the table
+    
+    ## THEN assert that the sites are returned in order and chromosomes are stored once
+    assert list(table) == SITES
+    assert table[2] == SITES[2]
+    assert len(table) == 3
+    assert table.chroms == ['1', 'X']
+    assert table.nbytes == 3 * 7
+
+def test_site_table_limits():
+    ## GIVEN a table with as many chromosomes as it can hold
+    table = SiteTable({'chrom': f'contig_{nr}', 'pos': 1, 'call': 1} for nr in range(MAX_CHROMS))
+    
+    ## WHEN adding another chromosome or a position past the end of the positions
+    ## THEN assert that the chromosome or position is named in the error, and nothing is added
+    with pytest.raises(ValueError, match='contig_new'):
+        table.add('contig_new', 1, 1)
+    with pytest.raises(ValueError, match=f'contig_0:{MAX_POS + 1}'):
+        table.add('contig_0', MAX_POS + 1, 1)
+    table.add('contig_0', MAX_POS, 1)
+    assert len(table) == len(table.chrom_codes) == len(table.calls) == MAX_CHROMS + 1
+
+def test_site_table_extend():
+    ## GIVEN two tables with different chromosomes
+    first = SiteTable(SITES[2:])
+    second = SiteTable(SITES[:2])
+    
+    ## WHEN extending one table with the other
+    first.extend(second)
+    
+    ## THEN assert that the chromosome codes are translated
+    assert list(first) == SITES[2:] + SITES[:2]
+
+def test_site_table_pickle():
+    ## GIVEN a table
+    table = SiteTable(SITES)
+    
+    ## WHEN sending it between processes
+    copy = pickle.loads(pickle.dumps(table))
+    
+    ## THEN assert that the sites are kept
+    assert list(copy) == SITES
+
+def test_site_table_write_read(tmp_path):
+    ## GIVEN a table written to a file
+    table_path = tmp_path / 'table.sites'
+    with open(table_path, 'wb') as handle:
+        SiteTable(SITES).write(handle)
+    
+    ## WHEN reading it back
+    with open(table_path, 'rb') as handle:
+        table = SiteTable.read(handle)
+    
+    ## THEN assert that the sites are the same
+    assert list(table) == SITES
@@ -0,0 +1,76 @@
+import gzip
+
+from upd.bgzf import (BgzfReader, is_bgzf)
+from upd.tabix import (find_index, read_index, TabixWriter)
+
+def test_is_bgzf(vcf_path, indexed_vcf_path):
+    ## GIVEN a gzipped and a bgzipped VCF
+    
+    ## WHEN checking if they are BGZF compressed
+    
+    ## THEN assert that only the bgzipped VCF is
+    assert is_bgzf(indexed_vcf_path) is True
+    assert is_bgzf(vcf_path) is False
+
+def test_find_index(vcf_path, indexed_vcf_path):
+    ## GIVEN an indexed and a non indexed VCF
+    
+    ## WHEN looking for the index
+    
+    ## THEN assert that it is only found for the indexed VCF
+    assert find_index(indexed_vcf_path) == indexed_vcf_path + '.tbi'
+    assert find_index(vcf_path) is None
+
+def test_contig_offset(indexed_vcf_path):
+    ## GIVEN a tabix index
+    index = read_index(indexed_vcf_path + '.tbi')
+    
+    ## WHEN seeking to the first record of a sequence
+    reader = BgzfReader(indexed_vcf_path)
+    reader.seek(index.contig_offset('15'))
+    
+    ## THEN assert that the first line is the first variant on that sequence
+    first_line = next(reader)
+    assert first_line.startswith('15\t')
+    with BgzfReader(indexed_vcf_path) as full_reader:
+        chrom_15 = [line for line in full_reader if line.startswith('15\t')]
+    assert first_line == chrom_15[0]
+    assert index.contig_offset('MT') is None
+
+def test_tabix_writer(tmp_path):
+    ## GIVEN sorted BED lines
+    lines = [f"{chrom}\t{pos}\t{pos + 1}\tSITE\n" for chrom in ['1', '2', 'X']
+             for pos in range(0, 3000000, 97)]
+    out_path = str(tmp_path / 'sites.bed.gz')
+    
+    ## WHEN writing them with a tabix index
+    with TabixWriter(out_path) as writer:
+        writer.write('#chrom\tstart\tend\tsite\n')
+        for line in lines:
+            writer.write(line)
+    
+    ## THEN assert that the lines of a region are found through the index
+    index = read_index(out_path + '.tbi')
+    assert index.names == ['1', '2', 'X']
+    with BgzfReader(out_path) as reader:
+        found = []
+        for beg, end in index.query('2', 1000000, 1001000):
+            reader.seek(beg)
+            while reader.tell() < end:
+                found.append(next(reader))
+    expected = [line for line in lines if line.startswith('2\t') and 
+                1000000 - 1 <= int(line.split('\t')[1]) < 1001000]
+    assert [line for line in found if line in expected] == expected
+
+def test_tabix_writer_unsorted(tmp_path):
+    ## GIVEN BED lines where a chromosome comes back
+    out_path = tmp_path / 'sites.bed.gz'
+    
+    ## WHEN writing them
+    with TabixWriter(str(out_path)) as writer:
+        for chrom in ['1', '2', '1']:
+            writer.write(f"{chrom}\t10\t11\tSITE\n")
+    
+    ## THEN assert that the lines are written without an index
+    assert gzip.open(out_path, 'rt').read().count('\n') == 3
+    assert not (tmp_path / 'sites.bed.gz.tbi').exists()
@@ -0,0 +1,114 @@
+import itertools
+import random
+
+import pytest
+
+from upd.site_table import SiteTable
+from upd.utils import (get_UPD_informative_sites, get_UPD_informative_sites_trios, call_regions,
+                       call_regions_table, upd_site_call, upd_site_calls, UPD_MATERNAL_ORIGIN, 
+                       UPD_PATERNAL_ORIGIN)
+from upd.vcf_tools import (get_vcf, parse_CSQ_header)
+
+def test_trio_sites(cohort_vcf_path):
+    ## GIVEN a VCF with two trios, where the second has the parents swapped
+    vcf_reader = get_vcf(cohort_vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+    csq_fields = parse_CSQ_header(vcf_reader)
+    trios = [('TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER'), 
+             ('SWAP_PROBAND', 'SWAP_MOTHER', 'SWAP_FATHER')]
+    vcf_reader.select_samples(trios[0] + trios[1])
+    
+    ## WHEN getting the sites for both trios in one pass
+    trio_sites = [[], []]
+    for trio_nr, site in get_UPD_informative_sites_trios(vcf_reader, csq_fields, trios):
+        trio_sites[trio_nr].append(site)
+    
+    ## THEN assert that the first trio gets the same sites as when run alone
+    vcf_reader = get_vcf(cohort_vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+    sites = list(get_UPD_informative_sites(vcf_reader, csq_fields, *trios[0]))
+    assert trio_sites[0] == sites
+    
+    ## THEN assert that the second trio has the parental origins swapped
+    swap = {UPD_MATERNAL_ORIGIN: UPD_PATERNAL_ORIGIN, UPD_PATERNAL_ORIGIN: UPD_MATERNAL_ORIGIN}
+    assert [swap.get(site['call'], site['call']) for site in trio_sites[1]] == [
+        site['call'] for site in sites]
+
+def test_call_regions():
+    ## GIVEN a run of paternal sites closed by an anti UPD site and a chromosome change
+    sites = [
+        {'chrom': '1', 'pos': 100, 'call': 3},
+        {'chrom': '1', 'pos': 200, 'call': 2},
+        {'chrom': '1', 'pos': 300, 'call': 5},
+        {'chrom': '1', 'pos': 400, 'call': 2},
+        {'chrom': '1', 'pos': 500, 'call': 3},
+        {'chrom': '2', 'pos': 100, 'call': 1},
+        {'chrom': '2', 'pos': 200, 'call': 1},
+    ]
+    
+    ## WHEN calling regions
+    calls = list(call_regions(sites))
+    
+    ## THEN assert that both regions are called
+    assert len(calls) == 2
+    first = calls[0]
+    assert (first['chrom'], first['call'], first['start_lo'], first['start_hi']) == (
+        '1', 2, 100, 200)
+    assert (first['end_lo'], first['end_hi'], first['run_len'], first['het_sites']) == (
+        400, 499, 2, 1)
+    assert (calls[1]['chrom'], calls[1]['call'], calls[1]['run_len']) == ('2', 1, 2)
+
+def test_call_regions_table(vcf_path):
+    ## GIVEN the sites of a VCF in a SiteTable
+    vcf_reader = get_vcf(vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+    table = SiteTable(get_UPD_informative_sites(vcf_reader, parse_CSQ_header(vcf_reader), 
+                                                'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER'))
+    
+    ## WHEN segmenting the table in bulk
+    calls = list(call_regions_table(table))
+    
+    ## THEN assert that the regions are the same as from call_regions
+    assert calls == list(call_regions(table))
+    assert len(calls) > 0
+
+def test_call_regions_table_random():
+    ## GIVEN random sites, with short chromosomes and regions that end at chromosome changes
+    rng = random.Random(0)
+    for _ in range(500):
+        table = SiteTable()
+        chrom = 1
+        pos = 0
+        for _ in range(rng.randrange(30)):
+            if rng.random() < 0.15:
+                chrom += 1
+                pos = 0
+            pos += rng.randrange(1, 100)
+            table.add(str(chrom), pos, rng.choice([0, 1, 1, 2, 2, 3, 3, 4, 5]))
+        
+        ## WHEN segmenting the table in bulk
+        calls = list(call_regions_table(table))
+        
+        ## THEN assert that the regions are the same as from call_regions
+        assert calls == list(call_regions(table))
+
+GENOTYPES = list(itertools.product(range(4), repeat=3))
+
+def test_upd_site_calls():
+    ## GIVEN lists with every combination of genotype codes
+    gt_pb, gt_mo, gt_fa = zip(*GENOTYPES)
+    
+    ## WHEN calling all sites at once
+    calls = upd_site_calls(gt_pb, gt_mo, gt_fa)
+    
+    ## THEN assert that the calls are the same as from the scalar function
+    assert list(calls) == [upd_site_call(*gts) for gts in GENOTYPES]
+
+def test_upd_site_calls_numpy():
+    ## GIVEN numpy arrays with every combination of genotype codes
+    np = pytest.importorskip('numpy')
+    gt_pb, gt_mo, gt_fa = np.array(GENOTYPES, dtype=np.int8).T
+    
+    ## WHEN calling all sites at once
+    calls = upd_site_calls(gt_pb, gt_mo, gt_fa)
+    
+    ## THEN assert that the calls are the same as from the scalar function
+    assert calls.dtype == np.uint8
+    assert calls.tolist() == [upd_site_call(*gts) for gts in GENOTYPES]
@@ -1,6 +1,9 @@
+import shutil
+
 import pytest
 
-from upd.vcf_tools import (check_samples, get_vcf, Vcf)
+from upd.vcf_tools import (check_samples, get_vcf, get_indexed_vcf, Vcf, Variant, build_prefilter,
+                           build_af_extractor, open_file)
 
 def test_check_samples():
     ## GIVEN a list three samples
@@ -74,4 +77,133 @@ def test_get_vcf_wrong_individual(vcf_path):
     with pytest.raises(SyntaxError):
         ## THEN assert a SyntaxError is raised
         vcf_obj = get_vcf(vcf_path, proband, mother, father)
-    
\ No newline at end of file
+    
+def test_variant_get_info():
+    ## GIVEN a variant line with a flag, a VEP string and an AF value
+    line = "1\t100\t.\tA\tG\t100\tPASS\tDB;CSQ=GENE|0.2;MAX_AF=0.3\tGT:GQ\t0/1:99"
+    
+    ## WHEN creating a variant
+    variant = Variant(line)
+    
+    ## THEN assert that single keys are found without building the INFO dict
+    assert variant.get_info('MAX_AF') == '0.3'
+    assert variant.get_info('CSQ') == 'GENE|0.2'
+    assert variant.get_info('DB') is True
+    assert variant.get_info('AF') is None
+    assert variant._info is None
+
+def test_variant_lazy_info():
+    ## GIVEN a variant line
+    line = "1\t100\t.\tA\tG\t100\tPASS\tDB;CSQ=GENE|0.2;MAX_AF=0.3\tGT:GQ\t0/1:99"
+    
+    ## WHEN accessing the INFO dictionary
+    variant = Variant(line)
+    info = variant.INFO
+    
+    ## THEN assert that it agrees with the single key lookup
+    assert info == {'DB': True, 'CSQ': 'GENE|0.2', 'MAX_AF': '0.3'}
+    for key in info:
+        assert variant.get_info(key) == info[key]
+
+def test_variant_sample_columns():
+    ## GIVEN a line with five samples, FORMAT keys in an unusual order and a truncated sample
+    line = ("1\t100\t.\tA\tG\t100\tPASS\tMAX_AF=0.3\tGQ:DP:GT\t"
+            "99:10:0/1\t20:10:1/1\t.:10:0/0\t50\t40:10:0|1")
+    layouts = {}
+    
+    ## WHEN parsing all samples and only some of them
+    variant = Variant(line)
+    projected = Variant(line, sample_columns=[12, 9, 13], layouts=layouts)
+    
+    ## THEN assert that only the selected genotypes are parsed, in the selected order
+    assert variant.gt_types == [1, 3, 0, 2, 2]
+    assert variant.gt_quals == [99, 20, 0, 50, 40]
+    assert projected.gt_types == [2, 1, 2]
+    assert projected.gt_quals == [50, 99, 40]
+    assert layouts == {'GQ:DP:GT': (2, 0)}
+
+def test_vcf_select_samples(cohort_vcf_path):
+    ## GIVEN a VCF with six samples
+    vcf_reader = get_vcf(cohort_vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+    all_reader = Vcf(open_file(cohort_vcf_path))
+    
+    ## WHEN selecting samples in another order
+    vcf_reader.select_samples(['SWAP_FATHER', 'TEST_PROBAND'])
+    
+    ## THEN assert that the genotypes of the selected samples are the same as when parsing all
+    assert vcf_reader.samples == ['SWAP_FATHER', 'TEST_PROBAND']
+    assert all_reader.samples == all_reader.all_samples
+    for variant, all_variant in zip(vcf_reader, all_reader):
+        assert variant.gt_types == [all_variant.gt_types[5], all_variant.gt_types[0]]
+        assert variant.gt_quals == [all_variant.gt_quals[5], all_variant.gt_quals[0]]
+
+def test_prefilter():
+    ## GIVEN a prefilter for SNPs with AF above 0.05
+    prefilter = build_prefilter(min_af=0.05, af_tag='MAX_AF')
+    
+    ## WHEN checking raw variant lines
+    snp = "1\t100\t.\tA\tG\t100\tPASS\tMAX_AF=0.3\tGT:GQ\t0/1:99"
+    indel = "1\t100\t.\tA\tGT\t100\tPASS\tMAX_AF=0.3\tGT:GQ\t0/1:99"
+    rare = "1\t100\t.\tA\tG\t100\tPASS\tMAX_AF=0.01\tGT:GQ\t0/1:99"
+    multi = "1\t100\t.\tA\tG,T\t100\tPASS\tMAX_AF=0.01\tGT:GQ\t0/1:99"
+    
+    ## THEN assert that only the informative SNP and the multi-allelic line are kept
+    assert prefilter(snp) is True
+    assert prefilter(indel) is False
+    assert prefilter(rare) is False
+    assert prefilter(multi) is True
+
+def test_vcf_prefilter(vcf_path):
+    ## GIVEN a VCF with and without a prefilter
+    all_variants = list(get_vcf(vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER'))
+    vcf_obj = get_vcf(vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+    vcf_obj.prefilter = build_prefilter()
+    
+    ## WHEN iterating over the prefiltered VCF
+    snps = list(vcf_obj)
+    
+    ## THEN assert that the non-SNPs were skipped and all lines were counted
+    assert [var.POS for var in snps] == [var.POS for var in all_variants if var.is_snp]
+    assert vcf_obj.nr_variants == len(all_variants)
+    assert vcf_obj.nr_skipped == len(all_variants) - len(snps)
+
+@pytest.mark.parametrize('index_type', ['tbi', 'csi'])
+def test_vcf_query(indexed_vcf_path, tmp_path, index_type):
+    ## GIVEN a VCF indexed with a tabix or a csi index
+    vcf_path = indexed_vcf_path
+    if index_type == 'csi':
+        vcf_path = str(tmp_path / 'test.vcf.gz')
+        shutil.copy(indexed_vcf_path, vcf_path)
+        shutil.copy(indexed_vcf_path + '.csi', vcf_path + '.csi')
+    vcf_obj = get_indexed_vcf(vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')
+    all_variants = [(var.CHROM, var.POS) for var in 
+                    get_vcf(indexed_vcf_path, 'TEST_PROBAND', 'TEST_MOTHER', 'TEST_FATHER')]
+    regions = [('15', 20000000, 30000000), ('X', 0, 5000000), ('15', 25000000, 40000000)]
+    
+    ## WHEN querying the regions
+    variants = [(var.CHROM, var.POS) for var in vcf_obj.query(regions)]
+    
+    ## THEN assert that exactly the variants in the merged regions are returned, once
+    expected = [(chrom, pos) for chrom, pos in all_variants 
+                if (chrom == '15' and 20000000 < pos <= 40000000) or 
+                   (chrom == 'X' and pos <= 5000000)]
+    assert variants == expected
+    assert len(variants) > 0
+
+def test_af_extractor():
+    ## GIVEN VEP fields and a CSQ string with two transcripts
+    vep_fields = ['Allele', 'Gene', 'MAX_AF', 'SYMBOL']
+    csq = "G|GENE1|0.1|SYM1,G|GENE2|0.3|SYM2"
+    
+    ## WHEN extracting the frequency from the first transcript or from all transcripts
+    first_af = build_af_extractor(vep_fields, 'MAX_AF')
+    max_af = build_af_extractor(vep_fields, 'MAX_AF', all_transcripts=True)
+    
+    ## THEN assert that the right frequency is returned
+    assert first_af(csq) == 0.1
+    assert max_af(csq) == 0.3
+    assert first_af("G|GENE1||SYM1") == 0.0
+    assert first_af(None) == 0.0
+    assert build_af_extractor(vep_fields[:3], 'MAX_AF')("G|GENE1|0.1,G|GENE2|0.3") == 0.1
+    assert build_af_extractor(vep_fields, 'AF')(csq) == 0.0
+    assert build_af_extractor(None, 'MAX_AF')('0.2') == 0.2
@@ -0,0 +1,9 @@
+"""Call uniparental disomy regions from germline trio VCFs
+
+The command line is in upd.cli. For use from Python, see UpdAnalysis in upd.api.
+"""
+from .__version__ import __version__
+from .api import (UpdAnalysis, UpdResult)
+from .bed_utils import (filter_regions, output_filtered_regions, output_sites)
+from .site_table import SiteTable
+from .utils import (call_regions, call_regions_table, get_UPD_informative_sites)
@@ -0,0 +1,217 @@
+"""Call UPD regions from Python, without the command line
+
+UpdAnalysis holds the filter and region parameters and can be used for any number of trios and
+VCFs, e.g. in a long running pipeline worker. Parsed headers are kept, so VCFs with the same
+header, like those of one pipeline, only have their header checked once.
+
+Nothing is printed and logging is not configured. Errors are raised as exceptions.
+
+    analysis = UpdAnalysis(vep=True)
+    result = analysis.run('trio.vcf.gz', 'PROBAND', 'MOTHER', 'FATHER')
+    for region in result.regions:
+        print(region['chrom'], region['start_hi'], region['end_lo'], region['origin'])
+"""
+import logging
+
+from .bed_utils import (filter_regions, parse_region)
+from .site_table import SiteTable
+from .tabix import (find_index, read_index)
+from .utils import (get_UPD_informative_sites, call_regions, call_regions_table)
+from .vcf_tools import (open_vcf, check_samples, parse_CSQ_header, build_prefilter)
+
+LOG = logging.getLogger(__name__)
+
+# Number of distinct headers kept by an UpdAnalysis
+HEADER_CACHE_SIZE = 16
+
+
+def _closing(vcf_reader, sites):
+    """Yield sites and close the VCF when done"""
+    try:
+        yield from sites
+    finally:
+        vcf_reader.close()
+
+
+class UpdResult(object):
+    """The informative sites and the filtered UPD regions of a trio
+
+    Attributes:
+        sites (SiteTable): The informative sites
+        regions (list(dict)): The regions, annotated by upd.bed_utils.filter_regions
+        nr_variants (int): Number of variants read from the VCF
+    """
+    def __init__(self, sites, regions, nr_variants):
+        super(UpdResult, self).__init__()
+        self.sites = sites
+        self.regions = regions
+        self.nr_variants = nr_variants
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} ({len(self.sites)} sites, {len(self.regions)} regions)"
+
+
+class UpdAnalysis(object):
+    """Search trios for UPD informative sites and call UPD regions
+
+    Args:
+        af_tag (str): Field with the population frequency
+        vep (bool): af_tag is in the VEP annotation
+        min_af (float): Minimum SNP frequency
+        min_gq (int): Minimum GQ of the trio
+        all_transcripts (bool): With vep, use the highest frequency of all transcripts
+        min_sites (int): Minimum UPD informative sites required to call a region
+        min_size (int): Minimum size (bp) required to call a region
+        iso_het_pct (float): Ratio iso/het for determining the UPD type
+        threads (int): Number of threads used to decompress a bgzipped VCF
+    """
+    def __init__(self, af_tag='MAX_AF', vep=False, min_af=0.05, min_gq=30, all_transcripts=False,
+                 min_sites=3, min_size=1000, iso_het_pct=0.01, threads=1):
+        super(UpdAnalysis, self).__init__()
+        self.af_tag = af_tag
+        self.vep = vep
+        self.min_af = min_af
+        self.min_gq = min_gq
+        self.all_transcripts = all_transcripts
+        self.min_sites = min_sites
+        self.min_size = min_size
+        self.iso_het_pct = iso_het_pct
+        self.threads = threads
+        self._headers = {}
+
+    def _check_header(self, vcf_reader):
+        """Check that the header has the frequency field
+
+        Returns:
+            csq_fields, prefilter (list(str), callable): csq_fields is None without vep
+        """
+        key = tuple(vcf_reader.raw_header)
+        checked = self._headers.get(key)
+        if checked is not None:
+            return checked
+
+        csq_fields = None
+        if self.vep:
+            csq_fields = parse_CSQ_header(vcf_reader)
+            if self.af_tag not in csq_fields:
+                raise ValueError(f"The field {self.af_tag} does not exist in the VEP annotations")
+        elif not vcf_reader.contains(self.af_tag):
+            raise ValueError(f"The field {self.af_tag} does not exist in the VCF")
+        prefilter = build_prefilter(min_af=self.min_af, vep_fields=csq_fields, af_tag=self.af_tag,
+                                    all_transcripts=self.all_transcripts)
+
+        if len(self._headers) >= HEADER_CACHE_SIZE:
+            del self._headers[next(iter(self._headers))]
+        self._headers[key] = (csq_fields, prefilter)
+        return csq_fields, prefilter
+
+    def open(self, vcf, proband, mother, father):
+        """Open a VCF or BCF and check its header
+
+        Args:
+            vcf (str or file): A path, or a binary or text file object of a VCF
+            proband (str): ID of proband in VCF
+            mother (str): ID of mother in VCF
+            father (str): ID of father in VCF
+
+        Returns:
+            vcf_reader, csq_fields (upd.vcf_tools.Vcf, list(str))
+        """
+        vcf_reader = open_vcf(vcf, self.threads)
+        if not check_samples(vcf_reader.samples, proband, mother, father):
+            raise ValueError("At least one of the given sample IDs do not exist in the VCF header")
+        vcf_reader.select_samples([proband, mother, father])
+        csq_fields, vcf_reader.prefilter = self._check_header(vcf_reader)
+        return vcf_reader, csq_fields
+
+    def _search(self, vcf, proband, mother, father, regions=None):
+        """Open a VCF and set up the search for informative sites
+
+        Returns:
+            vcf_reader, sites (upd.vcf_tools.Vcf, iterator(dict))
+        """
+        vcf_reader, csq_fields = self.open(vcf, proband, mother, father)
+        if regions:
+            regions = [parse_region(region) if isinstance(region, str) else region
+                       for region in regions]
+            index_path = find_index(vcf) if isinstance(vcf, str) else None
+            if not index_path:
+                vcf_reader.close()
+                raise ValueError("Regions can only be used with an indexed VCF or BCF")
+            vcf_reader.index = read_index(index_path)
+
+        sites = get_UPD_informative_sites(
+            vcf=vcf_reader,
+            csq_fields=csq_fields,
+            proband=proband,
+            mother=mother,
+            father=father,
+            min_af=self.min_af,
+            af_tag=self.af_tag,
+            min_gq=self.min_gq,
+            regions=regions,
+            all_transcripts=self.all_transcripts
+        )
+        return vcf_reader, sites
+
+    def sites(self, vcf, proband, mother, father, regions=None):
+        """Iterate over the informative sites of a trio
+
+        The VCF is opened and checked right away, the variants are read while iterating. A VCF 
+        given as a path is closed when all sites have been read.
+
+        Args:
+            vcf (str or file): A path, or a binary or text file object of a VCF
+            proband (str): ID of proband in VCF
+            mother (str): ID of mother in VCF
+            father (str): ID of father in VCF
+            regions (list): Only search these regions, 'chrom:start-end' strings or
+                            (chrom, start, end) tuples with 0-based start. Needs the path of an
+                            indexed VCF or BCF
+
+        Returns:
+            sites (iterator(dict)): Site calls
+        """
+        vcf_reader, sites = self._search(vcf, proband, mother, father, regions)
+        if not isinstance(vcf, str):
+            return sites
+        return _closing(vcf_reader, sites)
+
+    def regions(self, sites):
+        """Call and filter the UPD regions of informative sites
+
+        Args:
+            sites (iterable(dict)): Site calls in file order, segmented in bulk if a SiteTable
+
+        Yields:
+            region (dict): Annotated by upd.bed_utils.filter_regions
+        """
+        if isinstance(sites, SiteTable):
+            calls = call_regions_table(sites)
+        else:
+            calls = call_regions(sites)
+        yield from filter_regions(calls, self.min_sites, self.min_size, self.iso_het_pct)
+
+    def run(self, vcf, proband, mother, father, regions=None):
+        """Find the informative sites and the UPD regions of a trio
+
+        Args:
+            vcf (str or file): A path, or a binary or text file object of a VCF
+            proband (str): ID of proband in VCF
+            mother (str): ID of mother in VCF
+            father (str): ID of father in VCF
+            regions (list): Only search these regions, see sites
+
+        Returns:
+            result (UpdResult)
+        """
+        vcf_reader, sites = self._search(vcf, proband, mother, father, regions)
+        try:
+            sites = SiteTable(sites)
+        finally:
+            if isinstance(vcf, str):
+                vcf_reader.close()
+        return UpdResult(sites, list(self.regions(sites)), vcf_reader.nr_variants)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} (af_tag={self.af_tag}, min_af={self.min_af})"
@@ -0,0 +1,496 @@
+"""Reading of BCF, the binary form of VCF
+
+A BCF file is BGZF compressed (or rarely uncompressed) and starts with the magic 'BCF\\2\\2' and
+the text header. Each record is a shared part with the site information and an individual part
+with the FORMAT fields of all samples, field by field. Values are typed: a descriptor byte gives
+the type and number of values. INFO, FILTER and FORMAT keys are indexes into a dictionary of
+header IDs, CHROM is an index into the contigs of the header.
+
+Only the GT and GQ values of the selected samples are decoded. INFO values are decoded when they
+are looked up, get_info only decodes the value of its key.
+"""
+import functools
+import io
+import logging
+import re
+import struct
+
+from .bed_utils import merge_regions
+from .bgzf import (BgzfReader, is_bgzf_header, inflate_block, read_block)
+from .tabix import TabixIndex
+from .vcf_tools import Vcf
+
+LOG = logging.getLogger(__name__)
+
+BCF_MAGIC = b'BCF\x02'
+
+# Typed value types: struct format, byte width, missing and vector end sentinels
+BCF_INT8 = 1
+BCF_INT16 = 2
+BCF_INT32 = 3
+BCF_FLOAT = 5
+BCF_CHAR = 7
+TYPES = {
+    BCF_INT8: ('b', 1, -0x80, -0x7f),
+    BCF_INT16: ('h', 2, -0x8000, -0x7fff),
+    BCF_INT32: ('i', 4, -0x80000000, -0x7fffffff),
+    BCF_FLOAT: ('f', 4, 0x7F800001, 0x7F800002),
+    BCF_CHAR: ('s', 1, None, None),
+}
+
+# Genotype codes of unphased diploid calls, anything else is 2 like in Variant
+GT_TYPES = {(0, 0): 0, (0, 1): 1, (1, 1): 3}
+
+# Descriptor of a single int8, as used for most dictionary keys
+SINGLE_INT8 = 0x11
+
+SITE_STRUCT = struct.Struct('<i8xI')
+UINT32_STRUCT = struct.Struct('<I')
+_STRUCTS = {}
+
+ID_PATTERN = re.compile(r'[<,]ID=([^,>]+)')
+IDX_PATTERN = re.compile(r'[<,]IDX=(\d+)')
+
+
+def is_bcf(filename):
+    """Check if a file is BCF, BGZF compressed or not
+
+    Args:
+        filename (str)
+
+    Returns:
+        bool
+    """
+    with io.open(filename, 'rb') as handle:
+        header = handle.read(18)
+        if header[:4] == BCF_MAGIC:
+            return True
+        if not is_bgzf_header(header):
+            return False
+        handle.seek(0)
+        block = read_block(handle)
+    return block is not None and inflate_block(block)[:4] == BCF_MAGIC
+
+
+def open_bcf(filename, threads=1, samples=None, index=None):
+    """Open a BCF file, BGZF compressed or not
+
+    Args:
+        filename (str)
+        threads (int): Number of threads used to inflate blocks
+        samples (list(str)): The samples to decode, None for all samples
+        index (TabixIndex)
+
+    Returns:
+        bcf_reader (Bcf)
+    """
+    with io.open(filename, 'rb') as handle:
+        header = handle.read(18)
+    if is_bgzf_header(header):
+        handle = BgzfReader(filename, threads=threads)
+    else:
+        handle = io.open(filename, 'rb')
+    return Bcf(handle, samples=samples, index=index)
+
+
+def _struct(size, code):
+    """A compiled struct for size little-endian values"""
+    key = (size, code)
+    if key not in _STRUCTS:
+        _STRUCTS[key] = struct.Struct(f'<{size}{code}')
+    return _STRUCTS[key]
+
+
+def _typed_size(data, pos):
+    """Read the descriptor of a typed value
+
+    Returns:
+        value_type, size, pos (int, int, int): pos is the position of the first value
+    """
+    descriptor = data[pos]
+    pos += 1
+    value_type = descriptor & 0x0F
+    size = descriptor >> 4
+    if size == 15:
+        size_type = data[pos] & 0x0F
+        pos += 1
+        code, width = TYPES[size_type][:2]
+        size = struct.unpack_from('<' + code, data, pos)[0]
+        pos += width
+    return value_type, size, pos
+
+
+def _typed_int(data, pos):
+    """Read a single typed integer, e.g. a dictionary key
+
+    Returns:
+        value, pos (int, int)
+    """
+    value_type, _, pos = _typed_size(data, pos)
+    code, width = TYPES[value_type][:2]
+    return struct.unpack_from('<' + code, data, pos)[0], pos + width
+
+
+def _format_float(value):
+    """Shortest text that reads back as the same 32 bit float"""
+    for precision in range(1, 10):
+        text = '%.*g' % (precision, value)
+        if struct.unpack('<f', struct.pack('<f', float(text)))[0] == value:
+            return text
+    return repr(value)
+
+
+@functools.lru_cache(maxsize=4096)
+def _float_value(raw):
+    """The value of a 32 bit float as read from its text in a VCF
+
+    Frequencies repeat, so the conversion is cached by the raw bits.
+    """
+    return float(_format_float(struct.unpack('<f', struct.pack('<I', raw))[0]))
+
+
+def _typed_text(value_type, size, data, pos):
+    """Convert typed values to their text in a VCF"""
+    if value_type == BCF_CHAR:
+        return data[pos:pos+size].rstrip(b'\x00').decode('utf-8', errors='replace')
+    code, width, missing, vector_end = TYPES[value_type]
+    values = []
+    if value_type == BCF_FLOAT:
+        for raw in struct.unpack_from(f'<{size}I', data, pos):
+            if raw == vector_end:
+                break
+            if raw == missing:
+                values.append('.')
+                continue
+            values.append(_format_float(struct.unpack('<f', struct.pack('<I', raw))[0]))
+    else:
+        for value in struct.unpack_from(f'<{size}{code}', data, pos):
+            if value == vector_end:
+                break
+            values.append('.' if value == missing else str(value))
+    return ','.join(values)
+
+
+def parse_bcf_header(header_text):
+    """Get the dictionary of IDs and the contig names of a BCF header
+
+    Args:
+        header_text (str)
+
+    Returns:
+        ids, contigs (list(str), list(str)): Indexed by the keys used in the records
+    """
+    ids = {'PASS': 0}
+    contigs = {}
+    for line in header_text.split('\n'):
+        if not line.startswith(('##INFO', '##FILTER', '##FORMAT', '##contig')):
+            continue
+        match = ID_PATTERN.search(line)
+        if not match:
+            continue
+        idx_match = IDX_PATTERN.search(line)
+        if line.startswith('##contig'):
+            idx = int(idx_match.group(1)) if idx_match else len(contigs)
+            contigs[idx] = match.group(1)
+            continue
+        if match.group(1) in ids:
+            continue
+        ids[match.group(1)] = int(idx_match.group(1)) if idx_match else len(ids)
+
+    id_list = [None] * (max(ids.values()) + 1)
+    for key, idx in ids.items():
+        id_list[idx] = key
+    contig_list = [None] * (max(contigs) + 1 if contigs else 0)
+    for idx, name in contigs.items():
+        contig_list[idx] = name
+    return id_list, contig_list
+
+
+class BcfVariant(object):
+    """A BCF record with the attributes of Variant that are used to call UPD
+
+    gt_types: 0=HOM_REF, 1=HET, 3=HOM_ALT, 2=other, for the selected samples only. The FORMAT
+    fields are decoded the first time gt_types or gt_quals is accessed.
+    """
+    __slots__ = ('CHROM', 'POS', 'REF', 'ALT', 'is_snp', '_data', '_info_pos', '_n_info',
+                 '_reader', '_info', '_gt_types', '_gt_quals')
+
+    def __init__(self, chrom, data, reader):
+        # data is the whole record, starting with l_shared and l_indiv
+        self.CHROM = chrom
+        self._data = data
+        self._reader = reader
+        self._info = None
+        self._gt_types = None
+        self._gt_quals = None
+
+        pos0, n_allele_info = SITE_STRUCT.unpack_from(data, 12)
+        self.POS = pos0 + 1
+        self._n_info = n_allele_info & 0xFFFF
+
+        # Skip ID, then read the alleles
+        size = data[32] >> 4
+        pos = 33
+        if size == 15:
+            _, size, pos = _typed_size(data, 32)
+        pos += size
+        alleles = []
+        for _ in range(n_allele_info >> 16):
+            size = data[pos] >> 4
+            pos += 1
+            if size == 15:
+                _, size, pos = _typed_size(data, pos - 1)
+            alleles.append(data[pos:pos+size].decode('utf-8', errors='replace'))
+            pos += size
+        self.REF = alleles[0] if alleles else '.'
+        alt = ','.join(alleles[1:]) or '.'
+        self.ALT = alt.split(',')
+        self.is_snp = len(self.REF) == len(alt)
+
+        # Skip FILTER
+        value_type, size, pos = _typed_size(data, pos)
+        if size:
+            pos += size * TYPES[value_type][1]
+        self._info_pos = pos
+
+    @property
+    def gt_types(self):
+        if self._gt_types is None:
+            self._decode_format()
+        return self._gt_types
+
+    @property
+    def gt_quals(self):
+        if self._gt_quals is None:
+            self._decode_format()
+        return self._gt_quals
+
+    def _decode_format(self):
+        """Decode GT and GQ of the selected samples"""
+        reader = self._reader
+        sample_idxs = reader.sample_idxs
+        gt_types = [2] * len(sample_idxs)
+        gt_quals = [0] * len(sample_idxs)
+        data = self._data
+        n_fmt_sample = UINT32_STRUCT.unpack_from(data, 28)[0]
+        n_sample = n_fmt_sample & 0xFFFFFF
+        pos = 8 + UINT32_STRUCT.unpack_from(data, 0)[0]
+        for _ in range(n_fmt_sample >> 24):
+            if data[pos] == SINGLE_INT8:
+                key = data[pos+1]
+                pos += 2
+            else:
+                key, pos = _typed_int(data, pos)
+            value_type, size, pos = _typed_size(data, pos)
+            code, width, missing, vector_end = TYPES[value_type]
+            block = size * width
+            if key == reader.gt_code and value_type == BCF_INT8 and size == 2:
+                # The common case, read the bytes directly. 0x81 is the int8 vector end
+                for nr, sample_idx in enumerate(sample_idxs):
+                    offset = pos + 2 * sample_idx
+                    second = data[offset+1]
+                    if second == 0x81 or second & 1:
+                        continue
+                    gt_types[nr] = GT_TYPES.get(((data[offset] >> 1) - 1, (second >> 1) - 1), 2)
+            elif key == reader.gt_code and value_type != BCF_CHAR and size >= 2:
+                values = _struct(size, code)
+                for nr, sample_idx in enumerate(sample_idxs):
+                    first, second = values.unpack_from(data, pos + sample_idx * block)[:2]
+                    if second == vector_end or second & 1:
+                        continue
+                    gt_types[nr] = GT_TYPES.get(((first >> 1) - 1, (second >> 1) - 1), 2)
+            elif key == reader.gq_code and value_type in (BCF_INT8, BCF_INT16, BCF_INT32) and size:
+                value_struct = _struct(1, code)
+                for nr, sample_idx in enumerate(sample_idxs):
+                    value = value_struct.unpack_from(data, pos + sample_idx * block)[0]
+                    if value != missing and value != vector_end:
+                        gt_quals[nr] = value
+            pos += block * n_sample
+        self._gt_types = gt_types
+        self._gt_quals = gt_quals
+
+    @property
+    def INFO(self):
+        """The INFO fields as a dictionary of text values, built on first access"""
+        if self._info is None:
+            info = {}
+            data = self._data
+            pos = self._info_pos
+            for _ in range(self._n_info):
+                key, pos = _typed_int(data, pos)
+                value_type, size, pos = _typed_size(data, pos)
+                if size == 0:
+                    info[self._reader.ids[key]] = True
+                    continue
+                info[self._reader.ids[key]] = _typed_text(value_type, size, data, pos)
+                pos += size * TYPES[value_type][1]
+            self._info = info
+        return self._info
+
+    def get_info(self, key, default=None):
+        """Get the value of a single INFO key
+
+        Only the value of key is decoded, the other INFO fields are skipped by their type and
+        size.
+
+        Args:
+            key (str): The INFO key to look up
+            default: Returned if key is not present
+
+        Returns:
+            value (str, float or bool): The value as text, True for flags. A single float is
+                                        given as a float, equal to the value of its text in a VCF
+        """
+        if self._info is not None:
+            return self._info.get(key, default)
+
+        code = self._reader.id_codes.get(key)
+        if code is None:
+            return default
+        data = self._data
+        pos = self._info_pos
+        for _ in range(self._n_info):
+            if data[pos] == SINGLE_INT8:
+                info_key = data[pos+1]
+                pos += 2
+            else:
+                info_key, pos = _typed_int(data, pos)
+            value_type, size, pos = _typed_size(data, pos)
+            if size == 0:
+                # A flag
+                if info_key == code:
+                    return True
+                continue
+            if info_key != code:
+                pos += size * TYPES[value_type][1]
+                continue
+            if value_type == BCF_FLOAT and size == 1:
+                raw = UINT32_STRUCT.unpack_from(data, pos)[0]
+                if raw not in TYPES[BCF_FLOAT][2:]:
+                    return _float_value(raw)
+            return _typed_text(value_type, size, data, pos)
+        return default
+
+    def __repr__(self):
+        return f"{self.CHROM}:{self.POS}:{self.gt_types}"
+
+
+class Bcf(Vcf):
+    """Iterates over the records of a BCF file
+
+    Works like Vcf and yields BcfVariant. Only GT and GQ of the selected samples are decoded,
+    samples holds the selected samples so indexes into it match gt_types and gt_quals. The
+    prefilter of raw text lines is not used.
+
+    Args:
+        handle (BgzfReader or file): A BgzfReader or an uncompressed binary file
+        samples (list(str)): The samples to decode, None for all samples
+        index (TabixIndex): A csi index, to iterate over regions
+    """
+    def __init__(self, handle, samples=None, prefilter=None, index=None):
+        self._selected = samples
+        super(Bcf, self).__init__(handle, prefilter=prefilter, index=None)
+        self.index = index
+
+    def _initialize(self):
+        handle = self._handle
+        magic = handle.read(5)
+        if magic[:4] != BCF_MAGIC:
+            raise SyntaxError("Not a BCF file")
+        l_text = struct.unpack('<I', handle.read(4))[0]
+        header_text = handle.read(l_text).rstrip(b'\x00').decode('utf-8')
+        # The IDX keys are internal to BCF, drop them to get the VCF header
+        self.raw_header = [IDX_PATTERN.sub('', line) for line in header_text.split('\n') if line]
+        self.ids, self.contigs = parse_bcf_header(header_text)
+        self.id_codes = {key: idx for idx, key in enumerate(self.ids) if key is not None}
+        self.gt_code = self.id_codes.get('GT')
+        self.gq_code = self.id_codes.get('GQ')
+        self.all_samples = self.raw_header[-1].split('\t')[9:]
+        if not self.all_samples:
+            raise SyntaxError("No individuals in VCF")
+        self.select_samples(self._selected or self.all_samples)
+
+    @property
+    def index(self):
+        return self._index
+
+    @index.setter
+    def index(self, index):
+        # Indexes of BCF files do not hold the sequence names, they are in the header
+        if index is not None and not index.names:
+            index = TabixIndex(self.contigs, index.bins, index.min_shift, index.depth,
+                               index.linear, index.loffsets)
+        self._index = index
+
+    def select_samples(self, samples):
+        """Only decode the genotypes of some samples
+
+        Args:
+            samples (list(str)): Sample IDs in the header, gt_types follows this order
+        """
+        self.samples = list(samples)
+        self.sample_idxs = [self.all_samples.index(sample) for sample in self.samples]
+
+    def time_reading(self, metrics):
+        """Time reading and decompressing the records, see Vcf.time_reading"""
+        self._read_record = metrics.timed_call('decompress', self._read_record)
+
+    def _read_record(self):
+        """Read the next record
+
+        Returns:
+            data (bytes): The record including the two length fields, None at end of file
+        """
+        lengths = self._handle.read(8)
+        if len(lengths) < 8:
+            return None
+        l_shared, l_indiv = struct.unpack('<II', lengths)
+        data = self._handle.read(l_shared + l_indiv)
+        if len(data) != l_shared + l_indiv:
+            raise SyntaxError("Truncated BCF record")
+        return lengths + data
+
+    def _variant(self, data):
+        chrom = self.contigs[struct.unpack_from('<i', data, 8)[0]]
+        return BcfVariant(chrom, data, self)
+
+    def __next__(self):
+        data = self._read_record()
+        if data is None:
+            raise StopIteration
+        self.nr_variants += 1
+        return self._variant(data)
+
+    def query(self, regions):
+        """Iterate over the variants overlapping several regions, see Vcf.query"""
+        if self.index is None:
+            raise ValueError("Region queries need an indexed BCF")
+
+        handle = self._handle
+        contig_ids = {name: idx for idx, name in enumerate(self.contigs)}
+        done = 0
+        for chrom, start, end in merge_regions(regions, self.index.names):
+            if end is None:
+                end = self.index.max_pos
+            chrom_id = contig_ids.get(chrom)
+            for chunk_start, chunk_end in self.index.query(chrom, start, end):
+                if chunk_end <= done:
+                    continue
+                handle.seek(max(chunk_start, done))
+                while handle.tell() < chunk_end:
+                    data = self._read_record()
+                    if data is None:
+                        break
+                    record_chrom, pos, rlen = struct.unpack_from('<iii', data, 8)
+                    if record_chrom != chrom_id:
+                        continue
+                    if pos >= end:
+                        break
+                    if pos + rlen <= start:
+                        continue
+                    done = handle.tell()
+                    self.nr_variants += 1
+                    yield self._variant(data)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} ({self.samples})"
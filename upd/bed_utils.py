@@ -1,6 +1,117 @@
+from .tabix import TabixWriter
 
-def output_filtered_regions(calls, min_sites=3, min_size=1000, iso_het_pct=0.01):
-    """Takes called regions, filters them, and yields annotated BED lines
+
+def open_bed(path):
+    """Open a BED file for writing, BGZF compressed with a tabix index if it ends with .gz
+    
+    Args:
+        path (str)
+    
+    Returns:
+        handle (file or upd.tabix.TabixWriter)
+    """
+    if path.endswith('.gz'):
+        return TabixWriter(path)
+    return open(path, 'w')
+
+
+def parse_region(region):
+    """Parse a region string
+    
+    Args:
+        region (str): 'chrom', 'chrom:start' or 'chrom:start-end', 1-based and inclusive
+    
+    Returns:
+        region (tuple): (chrom, start, end) with 0-based start and exclusive end. end is None 
+                        for the end of the sequence.
+    """
+    if ':' not in region:
+        return (region, 0, None)
+    chrom, coords = region.rsplit(':', 1)
+    coords = coords.replace(',', '')
+    try:
+        if '-' in coords:
+            start, end = coords.split('-')
+            start, end = int(start), int(end)
+        else:
+            start, end = int(coords), None
+    except ValueError:
+        raise SyntaxError(f"Malformed region: {region}")
+    if start < 1 or (end is not None and end < start):
+        raise SyntaxError(f"Malformed region: {region}")
+    return (chrom, start - 1, end)
+
+
+def read_bed_regions(bed_lines):
+    """Read regions from the lines of a BED file
+    
+    Args:
+        bed_lines (iterable(str))
+    
+    Returns:
+        regions (list(tuple)): (chrom, start, end) with 0-based start and exclusive end
+    """
+    regions = []
+    for line in bed_lines:
+        if not line.strip() or line.startswith(('#', 'track', 'browser')):
+            continue
+        splitted_line = line.rstrip().split('\t')
+        try:
+            regions.append((splitted_line[0], int(splitted_line[1]), int(splitted_line[2])))
+        except (IndexError, ValueError):
+            raise SyntaxError(f"Malformed BED line: {line.rstrip()}")
+    return regions
+
+
+def merge_regions(regions, chrom_order):
+    """Sort and merge overlapping regions
+    
+    Args:
+        regions (iterable(tuple)): (chrom, start, end), end None for the end of the sequence
+        chrom_order (list(str)): Chromosomes in file order, regions on other chromosomes are 
+                                 dropped
+    
+    Returns:
+        merged (list(tuple)): Non overlapping regions in file order
+    """
+    order = {chrom: i for i, chrom in enumerate(chrom_order)}
+    end_key = lambda end: float('inf') if end is None else end
+    merged = []
+    for chrom, start, end in sorted((region for region in regions if region[0] in order),
+                                    key=lambda region: (order[region[0]], region[1])):
+        if merged and merged[-1][0] == chrom and start <= end_key(merged[-1][2]):
+            if end_key(end) > end_key(merged[-1][2]):
+                merged[-1] = (chrom, merged[-1][1], end)
+            continue
+        merged.append((chrom, start, end))
+    return merged
+
+
+SITE_TYPE_NAMES = [
+    "UNINFORMATIVE", "UPD_MATERNAL_ORIGIN", "UPD_PATERNAL_ORIGIN", "ANTI_UPD",
+    "PB_HOMOZYGOUS", "PB_HETEROZYGOUS"
+]
+
+
+def output_sites(sites):
+    """Takes informative sites and yields BED lines
+    
+    Args:
+        sites (iterable): An iterable with site calls
+    Yields:
+        out_line (str): A formated string with the position and type of a site
+    """
+    for scall in sites:
+        yield "{}\t{}\t{}\t{}".format(
+            scall['chrom'],
+            scall['pos']-1,
+            scall['pos'],
+            SITE_TYPE_NAMES[scall['call']]
+        )
+
+
+def filter_regions(calls, min_sites=3, min_size=1000, iso_het_pct=0.01):
+    """Takes called regions, filters them, and yields them annotated with origin, type and size
 
     Args:
         calls (iterable): An iterable with UPD regions
@@ -8,15 +119,12 @@ def output_filtered_regions(calls, min_sites=3, min_size=1000, iso_het_pct=0.01)
         min_size (int): Minimum size (bp) required to call a region
         iso_het_pct(float): Quota between het-sites and hom-sties
     Yields:
-        out_line (str): A formated string with the information about a region
+        region (dict): The region call with the keys origin, type, low_size and high_size added
     """
-    out_line = ("{}\t{}\t{}\tORIGIN={};TYPE={};LOW_SIZE={};INF_SITES={};SNPS={};HET_HOM={}/{}"
-               ";OPP_SITES={};START_LOW={};END_HIGH={};HIGH_SIZE={}")
-
+    call_str = {2: 'PATERNAL', 1: 'MATERNAL'}
     for rcall in calls:
         if not rcall['run_len'] > min_sites:
             continue
-        call_str = {2: 'PATERNAL', 1: 'MATERNAL'}
         lo_size = rcall['end_lo'] - rcall['start_hi']
         hi_size = rcall['end_hi'] - rcall['start_lo']
 
@@ -29,19 +137,48 @@ def output_filtered_regions(calls, min_sites=3, min_size=1000, iso_het_pct=0.01)
         if lo_size < min_size:
             continue
 
-        yield out_line.format(
-                rcall['chrom'],
-                rcall['start_hi']-1,
-                rcall['end_lo'],
-                call_str[rcall['call']],
-                upd_type,
-                lo_size,
-                rcall['run_len'],
-                rcall['tot'],
-                rcall['het_sites'],
-                rcall['hom_sites'],
-                rcall['opposites'],
-                rcall['start_lo'],
-                rcall['end_hi'],
-                hi_size
-            )
+        region = dict(rcall)
+        region['origin'] = call_str[rcall['call']]
+        region['type'] = upd_type
+        region['low_size'] = lo_size
+        region['high_size'] = hi_size
+        yield region
+
+
+REGION_LINE = ("{}\t{}\t{}\tORIGIN={};TYPE={};LOW_SIZE={};INF_SITES={};SNPS={};HET_HOM={}/{}"
+               ";OPP_SITES={};START_LOW={};END_HIGH={};HIGH_SIZE={}")
+
+
+def format_region(region):
+    """Format a region annotated by filter_regions as a BED line"""
+    return REGION_LINE.format(
+            region['chrom'],
+            region['start_hi']-1,
+            region['end_lo'],
+            region['origin'],
+            region['type'],
+            region['low_size'],
+            region['run_len'],
+            region['tot'],
+            region['het_sites'],
+            region['hom_sites'],
+            region['opposites'],
+            region['start_lo'],
+            region['end_hi'],
+            region['high_size']
+        )
+
+
+def output_filtered_regions(calls, min_sites=3, min_size=1000, iso_het_pct=0.01):
+    """Takes called regions, filters them, and yields annotated BED lines
+
+    Args:
+        calls (iterable): An iterable with UPD regions
+        min_sites (int): Minimum UPD informative sites required to call a region
+        min_size (int): Minimum size (bp) required to call a region
+        iso_het_pct(float): Quota between het-sites and hom-sties
+    Yields:
+        out_line (str): A formated string with the information about a region
+    """
+    for region in filter_regions(calls, min_sites, min_size, iso_het_pct):
+        yield format_region(region)
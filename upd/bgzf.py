@@ -0,0 +1,339 @@
+"""Reading and writing of BGZF compressed files
+
+BGZF is the blocked gzip format written by bgzip and htslib. The file is a series of gzip
+members (blocks) holding at most 64kb of uncompressed data each, with the compressed size of the
+block stored in a gzip extra field. A position in the file is given as a virtual offset: the
+offset of a block in the compressed file shifted left 16 bits, combined with the offset within
+the uncompressed block.
+"""
+import logging
+import struct
+import zlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+LOG = logging.getLogger(__name__)
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+
+# Header of a block up to the block size: gzip header with one extra field, BC of length 2
+BGZF_HEADER = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+
+# Empty block that marks the end of a BGZF file
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# Uncompressed size of written blocks, as used by htslib, so that a compressed block always fits
+BGZF_BLOCK_SIZE = 0xff00
+
+
+def is_bgzf_header(header):
+    """Check if the first 18 bytes of a file are the header of a BGZF block"""
+    return header[:4] == BGZF_MAGIC and header[12:14] == b'BC'
+
+
+def is_bgzf(filename):
+    """Check if a file is BGZF compressed
+
+    Args:
+        filename (str)
+
+    Returns:
+        bool: If the file starts with a BGZF block
+    """
+    with open(filename, 'rb') as handle:
+        header = handle.read(18)
+
+    return is_bgzf_header(header)
+
+
+def read_block(handle):
+    """Read the next BGZF block
+
+    Args:
+        handle (file): A binary file handle positioned at the start of a block
+
+    Returns:
+        block (bytes): The whole compressed block, None at end of file
+    """
+    header = handle.read(12)
+    if not header:
+        return None
+    if len(header) < 12 or header[:4] != BGZF_MAGIC:
+        raise SyntaxError("Malformed BGZF block header")
+
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = handle.read(xlen)
+    block_size = None
+    pos = 0
+    while pos + 4 <= xlen:
+        slen = struct.unpack('<H', extra[pos+2:pos+4])[0]
+        if extra[pos:pos+2] == b'BC' and slen == 2:
+            block_size = struct.unpack('<H', extra[pos+4:pos+6])[0] + 1
+        pos += 4 + slen
+
+    if block_size is None:
+        raise SyntaxError("BGZF block is missing the BC extra field")
+
+    rest = handle.read(block_size - 12 - xlen)
+    if len(rest) != block_size - 12 - xlen:
+        raise SyntaxError("Truncated BGZF block")
+    return header + extra + rest
+
+
+def deflate_block(data, level=6):
+    """Compress data into a BGZF block
+
+    Args:
+        data (bytes): At most BGZF_BLOCK_SIZE bytes
+        level (int): zlib compression level
+
+    Returns:
+        block (bytes)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    if len(cdata) > 0x10000 - len(BGZF_HEADER) - 10:
+        # Incompressible data, store it
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+    block_size = len(BGZF_HEADER) + 2 + len(cdata) + 8
+    return b''.join([
+        BGZF_HEADER,
+        struct.pack('<H', block_size - 1),
+        cdata,
+        struct.pack('<II', zlib.crc32(data), len(data)),
+    ])
+
+
+def inflate_block(block):
+    """Inflate a BGZF block
+
+    Args:
+        block (bytes): As returned by read_block
+
+    Returns:
+        data (bytes): The uncompressed block
+    """
+    xlen = struct.unpack('<H', block[10:12])[0]
+    data = zlib.decompress(block[12+xlen:-8], -15)
+    if len(data) != struct.unpack('<I', block[-4:])[0]:
+        raise SyntaxError("BGZF block has wrong uncompressed size")
+    return data
+
+
+class BgzfReader(object):
+    """Read lines from a BGZF file with support for virtual offsets
+
+    Iterating over the reader yields decoded lines, like a file opened in text mode.
+
+    With more than one thread, blocks are read ahead and inflated on a thread pool while the
+    lines of the current block are consumed. zlib releases the GIL, so the blocks are inflated
+    in parallel. Blocks are always handed out in file order.
+
+    Args:
+        filename (str or file): A path, or a binary file object e.g. a pipe. Seeking needs a 
+                                seekable file.
+        threads (int): Number of threads used to inflate blocks
+        read_ahead (int): Number of blocks to read ahead, defaults to four per thread
+    """
+    def __init__(self, filename, threads=1, read_ahead=None):
+        super(BgzfReader, self).__init__()
+        if isinstance(filename, str):
+            self.filename = filename
+            self._handle = open(filename, 'rb')
+        else:
+            self.filename = getattr(filename, 'name', 'stream')
+            self._handle = filename
+        self._block_offset = 0
+        self._next_offset = 0
+        self._buffer = b''
+        self._within = 0
+        self._pool = None
+        self._pending = deque()
+        self._read_ahead = read_ahead or 4 * threads
+        if threads > 1:
+            self._pool = ThreadPoolExecutor(threads)
+
+    def _fill(self):
+        """Queue blocks for inflation until read_ahead blocks are pending"""
+        while len(self._pending) < self._read_ahead:
+            block = read_block(self._handle)
+            if block is None:
+                break
+            future = self._pool.submit(inflate_block, block)
+            self._pending.append((self._next_offset, future))
+            self._next_offset += len(block)
+
+    def _load_block(self, offset=None):
+        """Load the next block, or the block at offset, into the buffer
+
+        Returns:
+            bool: False if at end of file
+        """
+        if offset is not None:
+            self._pending.clear()
+            self._handle.seek(offset)
+            self._next_offset = offset
+        self._within = 0
+
+        if self._pool is None:
+            self._block_offset = self._next_offset
+            block = read_block(self._handle)
+            if block is None:
+                self._buffer = b''
+                return False
+            self._next_offset += len(block)
+            self._buffer = inflate_block(block)
+            return True
+
+        self._fill()
+        if not self._pending:
+            self._block_offset = self._next_offset
+            self._buffer = b''
+            return False
+        self._block_offset, future = self._pending.popleft()
+        self._fill()
+        self._buffer = future.result()
+        return True
+
+    def seek(self, virtual_offset):
+        """Move to a virtual offset"""
+        self._load_block(virtual_offset >> 16)
+        self._within = virtual_offset & 0xFFFF
+
+    def tell(self):
+        """Return the current virtual offset"""
+        return (self._block_offset << 16) | self._within
+
+    def raw_tell(self):
+        """Return the offset in the compressed file of the next block to be read"""
+        return self._next_offset
+
+    def read(self, size):
+        """Read size bytes, fewer at end of file"""
+        parts = []
+        while size > 0:
+            if self._within >= len(self._buffer):
+                if not self._load_block():
+                    break
+                continue
+            data = self._buffer[self._within:self._within+size]
+            self._within += len(data)
+            size -= len(data)
+            parts.append(data)
+
+        return b''.join(parts)
+
+    def readline(self):
+        """Read the next line as bytes, returns b'' at end of file"""
+        parts = []
+        while True:
+            if self._within >= len(self._buffer):
+                if not self._load_block():
+                    break
+                continue
+            idx = self._buffer.find(b'\n', self._within)
+            if idx == -1:
+                parts.append(self._buffer[self._within:])
+                self._within = len(self._buffer)
+                continue
+            parts.append(self._buffer[self._within:idx+1])
+            self._within = idx + 1
+            break
+
+        return b''.join(parts)
+
+    def close(self):
+        if self._pool is not None:
+            self._pending.clear()
+            self._pool.shutdown(wait=True)
+        self._handle.close()
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line.decode('utf-8', errors='replace')
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} ({self.filename})"
+
+
+class BgzfWriter(object):
+    """Write a BGZF file, keeping track of virtual offsets
+
+    Data is buffered and compressed a full block at a time. The EOF marker is written on close.
+
+    Args:
+        filename (str or file): A path, or a binary file object
+        level (int): zlib compression level
+    """
+    def __init__(self, filename, level=6):
+        super(BgzfWriter, self).__init__()
+        if isinstance(filename, str):
+            self.filename = filename
+            self._handle = open(filename, 'wb')
+        else:
+            self.filename = getattr(filename, 'name', 'stream')
+            self._handle = filename
+        self.level = level
+        self._block_offset = 0
+        self._buffer = bytearray()
+
+    def _write_block(self, data):
+        block = deflate_block(bytes(data), self.level)
+        self._handle.write(block)
+        self._block_offset += len(block)
+
+    def write(self, data):
+        """Write bytes, compressing each block as it fills up
+
+        Returns:
+            block_offsets (list(int)): Offsets in the compressed file of the blocks the data was
+                                       written to, the last one is the block being filled
+        """
+        block_offsets = [self._block_offset]
+        self._buffer += data
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(self._buffer[:BGZF_BLOCK_SIZE])
+            del self._buffer[:BGZF_BLOCK_SIZE]
+            block_offsets.append(self._block_offset)
+        return block_offsets
+
+    def tell(self):
+        """Return the virtual offset of the next byte written"""
+        return (self._block_offset << 16) | len(self._buffer)
+
+    def flush(self):
+        """Write the buffered data as a block, the next data starts a new block"""
+        if self._buffer:
+            self._write_block(self._buffer)
+            self._buffer = bytearray()
+        self._handle.flush()
+
+    def close(self):
+        if self._handle is None:
+            return
+        self.flush()
+        self._handle.write(BGZF_EOF)
+        self._handle.close()
+        self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} ({self.filename})"
@@ -0,0 +1,128 @@
+"""On-disk cache of informative sites
+
+The sites found in a VCF only depend on the file, the trio and the filter parameters, so they
+are stored as binary site tables keyed on those. Rerunning region calling with other parameters
+then does not need to parse the VCF again.
+"""
+import hashlib
+import json
+import logging
+import os
+
+from .site_table import SiteTable
+
+LOG = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.sites'
+
+
+def sites_key(vcf_path, proband, mother, father, **params):
+    """Build a key identifying a search for informative sites
+
+    The VCF is identified by its absolute path, size and modification time.
+
+    Args:
+        vcf_path (str)
+        proband (str): ID of proband in VCF
+        mother (str): ID of mother in VCF
+        father (str): ID of father in VCF
+        params: Filter parameters, e.g. min_af, af_tag, min_gq and vep
+
+    Returns:
+        key (str)
+    """
+    stat = os.stat(vcf_path)
+    identity = {
+        'version': CACHE_VERSION,
+        'vcf': os.path.abspath(vcf_path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'trio': [proband, mother, father],
+        'params': params,
+    }
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+
+class SiteCache(object):
+    """A directory of cached site tables, evicting the least recently used above max_size
+
+    Args:
+        cache_dir (str): Directory of the cache, created if it does not exist
+        max_size (int): Maximum total size of the cache in bytes
+    """
+    def __init__(self, cache_dir, max_size=1024**3):
+        super(SiteCache, self).__init__()
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, vcf_path, proband, mother, father, **params):
+        """Build the cache key of a search for informative sites, see sites_key"""
+        return sites_key(vcf_path, proband, mother, father, **params)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        """Get a cached site table
+
+        Returns:
+            table (SiteTable): None if the key is not cached
+        """
+        cache_path = self.path(key)
+        try:
+            with open(cache_path, 'rb') as handle:
+                table = SiteTable.read(handle)
+        except FileNotFoundError:
+            return None
+        except (OSError, SyntaxError) as err:
+            LOG.warning("Ignoring broken cache file %s: %s", cache_path, err)
+            return None
+
+        # Mark as recently used
+        os.utime(cache_path)
+        LOG.info("%s informative sites read from cache", len(table))
+        return table
+
+    def put(self, key, table):
+        """Store a site table and evict old entries if the cache is too large"""
+        cache_path = self.path(key)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as handle:
+            table.write(handle)
+        os.replace(tmp_path, cache_path)
+        LOG.info("%s informative sites written to cache", len(table))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_size"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(CACHE_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, cache_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            LOG.info("Evicting %s from cache", cache_path)
+            os.remove(cache_path)
+            total_size -= size
+
+    def cached(self, key, sites):
+        """Yield sites and store them in the cache once all have been yielded
+
+        Args:
+            key (str)
+            sites (iterable(dict))
+
+        Yields:
+            site_call (dict)
+        """
+        table = SiteTable()
+        for site in sites:
+            table.append(site)
+            yield site
+        self.put(key, table)
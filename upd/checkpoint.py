@@ -0,0 +1,205 @@
+"""Checkpoints of a search for informative sites
+
+A checkpoint file records the chromosomes of a VCF that have been searched, together with their
+informative sites and the virtual offset in the bgzipped VCF where the next chromosome starts.
+An interrupted run can then be resumed at that offset, yielding the stored sites first, and gives
+the same sites as a run from the start. The regions are called from the sites, so they do not
+have to be stored.
+
+The file starts with a header holding the key of the search. A record is appended each time a
+chromosome is done, so a run that dies while writing loses at most the last record.
+"""
+import json
+import logging
+import os
+import struct
+
+from .site_table import SiteTable
+
+LOG = logging.getLogger(__name__)
+
+CHECKPOINT_MAGIC = b'UPDCKPT\x01'
+
+
+def _write_json(handle, data):
+    text = json.dumps(data).encode('utf-8')
+    handle.write(struct.pack('<I', len(text)))
+    handle.write(text)
+
+
+def _read_json(handle):
+    header = handle.read(4)
+    if not header:
+        return None
+    if len(header) != 4:
+        raise SyntaxError("Truncated checkpoint")
+    size = struct.unpack('<I', header)[0]
+    text = handle.read(size)
+    if len(text) != size:
+        raise SyntaxError("Truncated checkpoint")
+    try:
+        return json.loads(text)
+    except ValueError:
+        raise SyntaxError("Malformed checkpoint record")
+
+
+class Checkpoint(object):
+    """Records finished chromosomes and their sites while the sites are searched
+
+    Args:
+        path (str): Path of the checkpoint file
+        key (str): Identifies the VCF, trio and filters, see upd.cache.sites_key
+    """
+    def __init__(self, path, key):
+        super(Checkpoint, self).__init__()
+        self.path = path
+        self.key = key
+        self.contigs = []
+        self.offset = 0
+        self.complete = False
+        self.sites = SiteTable()
+        self._pending = SiteTable()
+        self._handle = None
+
+    def load(self):
+        """Read the finished chromosomes and their sites from the checkpoint file
+
+        Returns:
+            bool: False if there is no usable checkpoint for the key
+        """
+        try:
+            handle = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+
+        with handle:
+            try:
+                if handle.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+                    raise SyntaxError("Not a checkpoint")
+                header = _read_json(handle)
+            except SyntaxError as err:
+                LOG.warning("Ignoring checkpoint %s: %s", self.path, err)
+                return False
+            if not header or header.get('key') != self.key:
+                LOG.warning("Checkpoint %s is of another VCF, trio or filters", self.path)
+                return False
+
+            end = handle.tell()
+            while True:
+                try:
+                    record = _read_json(handle)
+                    if record is None:
+                        break
+                    sites = SiteTable.read(handle)
+                except SyntaxError as err:
+                    LOG.warning("Ignoring the last record of checkpoint %s: %s", self.path, err)
+                    break
+                self.contigs.extend(record['contigs'])
+                self.offset = record['offset']
+                self.complete = record['offset'] is None
+                self.sites.extend(sites)
+                end = handle.tell()
+
+        # Drop a partly written record
+        with open(self.path, 'r+b') as handle:
+            handle.truncate(end)
+        LOG.info("Checkpoint has %s chromosomes and %s informative sites", len(self.contigs),
+                 len(self.sites))
+        return True
+
+    def open(self, resume=False):
+        """Open the checkpoint file for writing
+
+        Args:
+            resume (bool): Continue the checkpoint in the file, if it is usable
+
+        Returns:
+            bool: True if resuming from the checkpoint
+        """
+        if resume and self.load():
+            self._handle = open(self.path, 'ab')
+            return True
+
+        self._handle = open(self.path, 'wb')
+        self._handle.write(CHECKPOINT_MAGIC)
+        _write_json(self._handle, {'key': self.key})
+        self._flush()
+        return False
+
+    def _flush(self):
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+
+    def contigs_done(self, contigs, offset):
+        """Record finished chromosomes and the sites found since the last record
+
+        Args:
+            contigs (list(str)): The chromosomes that are done
+            offset (int): Virtual offset where the search continues, None at end of file
+        """
+        _write_json(self._handle, {'contigs': contigs, 'offset': offset})
+        self._pending.write(self._handle)
+        self._flush()
+        LOG.debug("Checkpoint at %s, %s sites", ','.join(contigs), len(self._pending))
+        self.contigs.extend(contigs)
+        self.offset = offset
+        self.complete = offset is None
+        self._pending = SiteTable()
+
+    def track(self, vcf_reader):
+        """Continue reading a VCF at the checkpoint, recording each chromosome when it is done
+
+        Args:
+            vcf_reader (upd.vcf_tools.Vcf): A bgzipped VCF
+        """
+        vcf_reader.seek(self.offset)
+        vcf_reader.variant_file = self.track_lines(vcf_reader.variant_file)
+
+    def track_lines(self, handle):
+        """Iterate over the variant lines of a bgzipped VCF, skipping header lines
+
+        A chromosome is done when the first line of the next one is read, since by then all
+        sites of the chromosome have been passed through track_sites.
+
+        Args:
+            handle (upd.bgzf.BgzfReader): Positioned at the start of a line
+
+        Yields:
+            line (str)
+        """
+        chrom = None
+        prefix = None
+        while True:
+            offset = handle.tell()
+            line = handle.readline()
+            if not line:
+                break
+            line = line.decode('utf-8', errors='replace')
+            if prefix and line.startswith(prefix):
+                yield line
+                continue
+            if line.startswith('#') or not line.strip():
+                continue
+            if chrom is not None:
+                self.contigs_done([chrom], offset)
+            chrom = line.split('\t', 1)[0]
+            prefix = chrom + '\t'
+            yield line
+
+        if chrom is not None:
+            self.contigs_done([chrom], None)
+        self.close()
+
+    def track_sites(self, sites):
+        """Iterate over site calls, keeping them until their chromosome is done"""
+        for site in sites:
+            self._pending.append(site)
+            yield site
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} ({self.path}, {len(self.contigs)} chromosomes)"
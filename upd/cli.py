@@ -1,15 +1,34 @@
+import itertools
 import logging
+import os
 
 import coloredlogs
 import click
+import contextlib
 import datetime
 
 from pprint import pprint as pp
 
 from upd.__version__ import __version__
-from upd.vcf_tools import (parse_CSQ_header, get_vcf)
-from upd.utils import (get_UPD_informative_sites, call_regions)
-from upd.bed_utils import (output_filtered_regions)
+from upd.vcf_tools import (parse_CSQ_header, get_vcf, build_prefilter, open_vcf, check_samples)
+from upd.utils import (get_UPD_informative_sites, get_UPD_informative_sites_trios, call_regions,
+                       call_regions_table, RegionCaller)
+from upd.parallel import get_UPD_informative_sites_parallel
+from upd.pipeline import get_UPD_informative_sites_pipelined
+from upd.bgzf import is_bgzf
+from upd.bcf import Bcf
+from upd.tabix import (find_index, read_index)
+from upd.ped_tools import get_trios
+from upd.site_table import SiteTable
+from upd.cache import (SiteCache, sites_key)
+from upd.checkpoint import Checkpoint
+from upd.shards import (check_shard_headers, expand_vcf_paths, get_UPD_informative_sites_sharded,
+                        open_shards, set_shard_indexes)
+from upd.bed_utils import (filter_regions, open_bed, output_filtered_regions, output_sites,
+                           parse_region, read_bed_regions)
+from upd.columnar import (EXPORT_FORMATS, check_format, write_regions, write_sites)
+from upd.metrics import Metrics
+from upd.server import JobServer
 
 LOG = logging.getLogger(__name__)
 
@@ -24,20 +43,39 @@ def print_version(ctx, param, value):
 
 @click.group()
 @click.option('--vcf',
-    type=click.Path(exists=True),
-    required=True,
+    help="VCF file, plain or compressed, or BCF file. Use - to read a VCF from stdin. Can be "
+         "repeated for the shards of a VCF, e.g. one per chromosome, or a .list/.fofn file with "
+         "one VCF per line",
+    type=click.Path(exists=True, allow_dash=True),
+    multiple=True,
 )
 @click.option('--proband',
     help="ID of proband in VCF",
-    required=True,
 )
 @click.option('--mother',
     help="ID of mother in VCF",
-    required=True,
 )
 @click.option('--father',
     help="ID of father in VCF",
-    required=True,
+)
+@click.option('--ped',
+    help="PED file, analyse all trios in it in one pass over the VCF",
+    type=click.Path(exists=True),
+)
+@click.option('--trio',
+    help="IDs of a trio in VCF, can be repeated to analyse several trios in one pass",
+    nargs=3,
+    multiple=True,
+    metavar='PROBAND MOTHER FATHER',
+)
+@click.option('--region',
+    help="Only check variants in region chrom, chrom:start or chrom:start-end. Can be repeated. "
+         "Needs a bgzipped and indexed VCF",
+    multiple=True,
+)
+@click.option('--regions-file',
+    help="Only check variants in the regions of a BED file. Needs a bgzipped and indexed VCF",
+    type=click.Path(exists=True),
 )
 @click.option('--af-tag',
     help="Which field to use for population frequency filtering",
@@ -48,6 +86,10 @@ def print_version(ctx, param, value):
     help="If af-tag is in VEP annotation",
     is_flag=True,
 )
+@click.option('--all-transcripts',
+    help="With --vep, use the highest frequency of all transcripts instead of the first one",
+    is_flag=True,
+)
 @click.option('--min-af',
     help="Minimum SNP frequency",
     default=0.05,
@@ -58,6 +100,44 @@ def print_version(ctx, param, value):
     default=30,
     show_default=True
 )
+@click.option('--processes',
+    help="Number of processes. Searches the chromosomes of an indexed file in parallel, or parses "
+         "batches of lines of other VCFs in parallel",
+    default=1,
+    show_default=True
+)
+@click.option('--threads',
+    help="Number of threads used to decompress a bgzipped VCF",
+    default=1,
+    show_default=True
+)
+@click.option('--cache-dir',
+    help="Directory to cache informative sites in, reruns with the same VCF, trio and filters "
+         "skip parsing the VCF",
+    type=click.Path(file_okay=False),
+)
+@click.option('--cache-size',
+    help="Maximum size (MB) of the cache, least recently used entries are removed",
+    default=1024,
+    show_default=True
+)
+@click.option('--checkpoint', 'checkpoint_path',
+    help="Record finished chromosomes and their informative sites in this file while the VCF is "
+         "searched. Needs a bgzipped VCF",
+    type=click.Path(dir_okay=False),
+)
+@click.option('--resume',
+    help="Resume an interrupted run from --checkpoint, skipping the finished chromosomes",
+    is_flag=True,
+)
+@click.option('--metrics', 'metrics_path',
+    help="Write wall and CPU time per stage and counts of dropped variants to this JSON file",
+    type=click.Path(dir_okay=False),
+)
+@click.option('--progress',
+    help="Log progress with throughput and time left every this many seconds",
+    type=float,
+)
 @click.option('--loglevel',
     default='INFO',
     type=click.Choice(LOG_LEVELS),
@@ -72,19 +152,82 @@ def print_version(ctx, param, value):
 )
 
 @click.pass_context
-def cli(context, vcf, proband, mother, father, af_tag, vep, min_af, min_gq, loglevel):
+def cli(context, vcf, proband, mother, father, ped, trio, region, regions_file, af_tag, vep, 
+        all_transcripts, min_af, min_gq, processes, threads, cache_dir, cache_size, checkpoint_path,
+        resume, metrics_path, progress, loglevel):
     """Simple software to call UPD regions from germline exome/wgs trios"""
     coloredlogs.install(level=loglevel)
     LOG.info("Running upd version %s", __version__)
 
     context.obj = {}
     context.obj['start_time'] = datetime.datetime.now()
-    # Check if the given samples IDs exist in the VCF header
+
+    # The server reads the VCFs and trios from its jobs
+    if context.invoked_subcommand == 'serve':
+        context.obj['processes'] = processes
+        context.obj['threads'] = threads
+        context.obj['cache_dir'] = cache_dir
+        context.obj['cache_size'] = cache_size
+        return
+
     try:
-        vcf_reader = get_vcf(vcf, proband, mother, father)
+        vcf_paths = expand_vcf_paths(vcf)
     except Exception as err:
         LOG.warning(err)
         context.abort()
+    if not vcf_paths:
+        LOG.warning("Give the VCF with --vcf")
+        context.abort()
+    # The header of the first shard is checked for the others
+    vcf = vcf_paths[0]
+    shards = None
+
+    trios = list(trio)
+    if ped:
+        try:
+            trios.extend(get_trios(ped))
+        except Exception as err:
+            LOG.warning(err)
+            context.abort()
+
+    if not trios and not (proband and mother and father):
+        LOG.warning("Give the IDs of the trio with --proband, --mother and --father, "
+                    "or --ped/--trio")
+        context.abort()
+
+    if trios and len(vcf_paths) > 1:
+        LOG.warning("Several VCFs can only be searched for one trio")
+        context.abort()
+
+    if trios:
+        if proband and mother and father:
+            trios.insert(0, (proband, mother, father))
+        try:
+            vcf_reader = open_vcf(vcf, threads)
+        except Exception as err:
+            LOG.warning(err)
+            context.abort()
+
+        # Skip trios where any of the samples IDs do not exist in the VCF header
+        for trio_ids in trios:
+            if not check_samples(vcf_reader.samples, *trio_ids):
+                LOG.warning("Skipping trio %s, not all IDs exist in the VCF header", 
+                            ','.join(trio_ids))
+        trios = [trio_ids for trio_ids in trios if check_samples(vcf_reader.samples, *trio_ids)]
+        if not trios:
+            context.abort()
+        vcf_reader.select_samples(sorted(set(itertools.chain.from_iterable(trios))))
+    else:
+        # Check if the given samples IDs exist in the VCF header
+        try:
+            if len(vcf_paths) > 1:
+                shards = open_shards(vcf_paths, proband, mother, father, threads)
+                vcf_reader = shards[0]
+            else:
+                vcf_reader = get_vcf(vcf, proband, mother, father, threads)
+        except Exception as err:
+            LOG.warning(err)
+            context.abort()
 
     csq_fields = None
     if vep:
@@ -105,8 +248,213 @@ def cli(context, vcf, proband, mother, father, af_tag, vep, min_af, min_gq, logl
             LOG.warning("The field %s does not exist in the VCF", af_tag)
             context.abort()
 
+    if shards:
+        try:
+            check_shard_headers(shards, vcf_paths, csq_fields, af_tag)
+        except Exception as err:
+            LOG.warning(err)
+            context.abort()
+
+    # Restrict the search to regions using the index of the VCF
+    regions = None
+    if region or regions_file:
+        try:
+            regions = [parse_region(reg) for reg in region]
+            if regions_file:
+                with open(regions_file, 'r') as bed_handle:
+                    regions.extend(read_bed_regions(bed_handle))
+            if shards:
+                set_shard_indexes(shards, vcf_paths)
+            else:
+                index_path = None
+                if vcf != '-' and is_bgzf(vcf):
+                    index_path = find_index(vcf)
+                if not index_path:
+                    raise OSError("Regions can only be used with a bgzipped and indexed VCF or BCF")
+                vcf_reader.index = read_index(index_path)
+        except Exception as err:
+            LOG.warning(err)
+            context.abort()
+        LOG.info("Searching %s regions", len(regions))
+
+    context.obj['trios'] = trios
+
+    if resume and not checkpoint_path:
+        LOG.warning("Give the checkpoint to resume from with --checkpoint")
+        context.abort()
+
+    # Record finished chromosomes, or skip the ones finished by an interrupted run
+    checkpoint = None
+    if checkpoint_path:
+        if trios or regions or shards:
+            LOG.warning("Checkpoints are not used with --ped/--trio, regions or several VCFs")
+        elif vcf == '-' or not is_bgzf(vcf) or isinstance(vcf_reader, Bcf):
+            LOG.warning("Checkpoints need a bgzipped VCF, not writing a checkpoint")
+        else:
+            checkpoint = Checkpoint(checkpoint_path, sites_key(
+                vcf, proband, mother, father, min_af=min_af, af_tag=af_tag, min_gq=min_gq, 
+                vep=vep, all_transcripts=all_transcripts
+            ))
+            if checkpoint.open(resume):
+                LOG.info("Resuming after chromosomes %s", ','.join(checkpoint.contigs))
+            if not checkpoint.complete:
+                checkpoint.track(vcf_reader)
+            if processes > 1:
+                LOG.warning("Checkpoints are written by a search in one process")
+                processes = 1
+
+    # Time the stages and count dropped variants
+    metrics = None
+    if metrics_path or progress:
+        readers = shards or [vcf_reader]
+        position = vcf_reader.bytes_read
+        if shards:
+            position = lambda: sum(reader.bytes_read() or 0 for reader in shards)
+        metrics = Metrics(
+            progress_interval=progress,
+            position=position,
+            total_bytes=None if vcf == '-' else sum(map(os.path.getsize, vcf_paths))
+        )
+        for reader in readers:
+            reader.time_reading(metrics)
+    context.obj['metrics'] = metrics
+    context.obj['metrics_path'] = metrics_path
+
+    # Skip lines that can never be informative before they are parsed
+    prefilter = build_prefilter(min_af=min_af, vep_fields=csq_fields, af_tag=af_tag, 
+                                all_transcripts=all_transcripts, 
+                                drops=metrics.counters if metrics else None)
+    if metrics:
+        prefilter = metrics.timed_call('filter', prefilter)
+
+    if trios:
+        if processes > 1:
+            LOG.warning("Parallel search is not supported for several trios, using one process")
+        vcf_reader.prefilter = prefilter
+        context.obj['site_calls'] = get_UPD_informative_sites_trios(
+            vcf=vcf_reader,
+            csq_fields=csq_fields,
+            trios=trios,
+            min_af=min_af,
+            af_tag=af_tag,
+            min_gq=min_gq,
+            regions=regions,
+            all_transcripts=all_transcripts,
+            metrics=metrics
+        )
+        context.obj['site_calls'] = timed_iter(context, 'classify', context.obj['site_calls'])
+        return
+
+    cache = None
+    if cache_dir and vcf == '-':
+        LOG.warning("Can not cache sites of a VCF read from stdin")
+    elif cache_dir:
+        cache = SiteCache(cache_dir, max_size=cache_size * 1024**2)
+        cache_key = cache.key(vcf, proband, mother, father, min_af=min_af, af_tag=af_tag, 
+                              min_gq=min_gq, vep=vep, regions=regions,
+                              all_transcripts=all_transcripts, **shard_params(vcf_paths))
+        cached_sites = cache.get(cache_key)
+        if cached_sites is not None:
+            context.obj['site_calls'] = cached_sites
+            return
+
+    if checkpoint and checkpoint.complete:
+        context.obj['site_calls'] = checkpoint.sites
+        if cache:
+            cache.put(cache_key, checkpoint.sites)
+        return
+
+    if shards:
+        for reader in shards:
+            reader.prefilter = prefilter
+        if processes > 1 and metrics:
+            LOG.warning("Variants searched in parallel are not timed or counted")
+        context.obj['site_calls'] = get_UPD_informative_sites_sharded(
+            vcf_readers=shards,
+            vcf_paths=vcf_paths,
+            csq_fields=csq_fields,
+            proband=proband,
+            mother=mother,
+            father=father,
+            min_af=min_af,
+            af_tag=af_tag,
+            min_gq=min_gq,
+            processes=processes,
+            threads=threads,
+            regions=regions,
+            all_transcripts=all_transcripts,
+            metrics=metrics
+        )
+    else:
+        context.obj['site_calls'] = get_site_calls(vcf, vcf_reader, csq_fields, proband, mother, 
+                                                   father, min_af, af_tag, min_gq, processes, 
+                                                   prefilter, regions, all_transcripts, metrics)
+    if checkpoint:
+        context.obj['site_calls'] = itertools.chain(
+            checkpoint.sites, checkpoint.track_sites(context.obj['site_calls'])
+        )
+    if cache:
+        context.obj['site_calls'] = cache.cached(cache_key, context.obj['site_calls'])
+    context.obj['site_calls'] = timed_iter(context, 'classify', context.obj['site_calls'])
+
+
+def shard_params(vcf_paths):
+    """Identify the other shards of a VCF in the cache key, the first is the VCF of the key"""
+    if len(vcf_paths) < 2:
+        return {}
+    shards = []
+    for vcf_path in vcf_paths[1:]:
+        stat = os.stat(vcf_path)
+        shards.append([os.path.abspath(vcf_path), stat.st_size, stat.st_mtime_ns])
+    return {'shards': shards}
+
+
+def get_site_calls(vcf, vcf_reader, csq_fields, proband, mother, father, min_af, af_tag, min_gq,
+                   processes, prefilter, regions=None, all_transcripts=False, metrics=None):
+    """Get the informative sites of a trio, in parallel if possible
+    
+    Indexed files are searched one chromosome per process, other VCFs are parsed in batches by 
+    the processes while they are read.
+    """
+    if processes > 1 and regions:
+        LOG.warning("Parallel search is not supported with regions, using one process")
+    elif processes > 1:
+        if vcf != '-' and is_bgzf(vcf) and find_index(vcf):
+            if metrics:
+                LOG.warning("Variants searched in parallel are not timed or counted")
+            return get_UPD_informative_sites_parallel(
+                vcf_path=vcf,
+                csq_fields=csq_fields,
+                proband=proband,
+                mother=mother,
+                father=father,
+                min_af=min_af,
+                af_tag=af_tag,
+                min_gq=min_gq,
+                processes=processes,
+                all_transcripts=all_transcripts
+            )
+        if not isinstance(vcf_reader, Bcf):
+            if metrics:
+                LOG.warning("Variants searched in parallel are not timed or counted")
+            return get_UPD_informative_sites_pipelined(
+                vcf=vcf_reader,
+                csq_fields=csq_fields,
+                proband=proband,
+                mother=mother,
+                father=father,
+                min_af=min_af,
+                af_tag=af_tag,
+                min_gq=min_gq,
+                processes=processes,
+                all_transcripts=all_transcripts
+            )
+        LOG.warning("Parallel search needs an indexed BCF, using one process")
+
+    vcf_reader.prefilter = prefilter
+
     # Get all UPD informative sites into a list
-    context.obj['site_calls'] = get_UPD_informative_sites(
+    return get_UPD_informative_sites(
         vcf=vcf_reader,
         csq_fields=csq_fields,
         proband=proband,
@@ -114,7 +462,10 @@ def cli(context, vcf, proband, mother, father, af_tag, vep, min_af, min_gq, logl
         father=father,
         min_af=min_af,
         af_tag=af_tag,
-        min_gq=min_gq
+        min_gq=min_gq,
+        regions=regions,
+        all_transcripts=all_transcripts,
+        metrics=metrics
     )
 
 @cli.command()
@@ -129,7 +480,8 @@ def cli(context, vcf, proband, mother, father, af_tag, vep, min_af, min_gq, logl
     show_default=True
 )
 @click.option('-o','--out',
-    help="Output bed file of all informative sites",
+    help="Output bed file of all informative sites. A name ending with .gz is written bgzipped "
+         "with a tabix index",
     type=click.Path(exists=False),
     default='-',
 )
@@ -139,45 +491,354 @@ def cli(context, vcf, proband, mother, father, af_tag, vep, min_af, min_gq, logl
     default=0.01,
     show_default=True
 )
-
+@click.option('--out-dir',
+    help="Output directory for one bed file per trio, used with --ped/--trio",
+    type=click.Path(file_okay=False),
+    default='.',
+    show_default=True
+)
+@click.option('--sites-out',
+    help="Also write the informative sites to this bed file, in the same pass over the VCF. "
+         "Bgzipped and indexed if it ends with .gz. With --ped/--trio, a directory for one file "
+         "per trio",
+    type=click.Path(exists=False),
+)
+@click.option('--format', 'out_format',
+    help="Output format. npz (NumPy) and arrow (Arrow IPC, needs pyarrow) write typed columns "
+         "to --out, for loading without parsing",
+    type=click.Choice(EXPORT_FORMATS),
+    default='bed',
+    show_default=True
+)
 @click.pass_context
-def regions(context, min_sites, min_size, iso_het_pct, out):
+def regions(context, min_sites, min_size, iso_het_pct, out, out_dir, sites_out, out_format):
     """Call UPD regions"""
-    # Make region calls
-    calls = call_regions(context.obj['site_calls'])
+    check_export(context, out_format, out)
+    if context.obj['trios']:
+        out_paths = trio_out_paths(context.obj['trios'], out_dir, 'upd_regions.bed')
+        callers = [RegionCaller() for _ in out_paths]
+        add_site = [timed_call(context, 'segment', caller.add) for caller in callers]
+        handles = [open(out_path, 'w') for out_path in out_paths]
+        site_handles = None
+        if sites_out:
+            site_handles = [open(out_path, 'w') for out_path in 
+                            trio_out_paths(context.obj['trios'], sites_out, 'upd_sites.bed')]
+        with stage_timer(context, 'write'):
+            for trio_nr, scall in context.obj['site_calls']:
+                if site_handles:
+                    for line in output_sites([scall]):
+                        site_handles[trio_nr].write(line+'\n')
+                rcall = add_site[trio_nr](scall)
+                if rcall:
+                    for line in output_filtered_regions([rcall], min_sites, min_size, iso_het_pct):
+                        handles[trio_nr].write(line+'\n')
+            for caller, f in zip(callers, handles):
+                rcall = caller.finish()
+                if rcall:
+                    for line in output_filtered_regions([rcall], min_sites, min_size, iso_het_pct):
+                        f.write(line+'\n')
+                f.close()
+        for f in site_handles or []:
+            f.close()
+    else:
+        site_calls = context.obj['site_calls']
+        sites_handle = None
+        if sites_out:
+            sites_handle = open_output(sites_out)
+            site_calls = tee_sites(site_calls, sites_handle)
 
-    out_lines = output_filtered_regions(calls, min_sites, min_size, iso_het_pct)
+        # Make region calls
+        calls = segment_sites(context, site_calls)
 
-    with click.open_file(out, 'w') as f:
-        for line in out_lines:
-            f.write(line+'\n')
+        if out_format != 'bed':
+            with stage_timer(context, 'write'):
+                write_regions(filter_regions(calls, min_sites, min_size, iso_het_pct), out,
+                              out_format)
+            if sites_handle:
+                sites_handle.close()
+            finish_run(context)
+            return
 
-    end_time = datetime.datetime.now() - context.obj['start_time']
-    LOG.info(f"Time to parse variants {end_time}")
+        out_lines = output_filtered_regions(calls, min_sites, min_size, iso_het_pct)
+
+        with open_output(out) as f, stage_timer(context, 'write'):
+            for line in out_lines:
+                f.write(line+'\n')
+        if sites_handle:
+            sites_handle.close()
+
+    finish_run(context)
+
+
+class SweepValues(click.ParamType):
+    """A list of values, given as 'a,b,c' or as an inclusive range 'start:stop:step'"""
+    name = 'values'
+
+    def __init__(self, value_type):
+        self.value_type = value_type
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, list):
+            return value
+        try:
+            if ':' in value:
+                start, stop, step = [self.value_type(val) for val in value.split(':')]
+                if step <= 0:
+                    self.fail(f"Step must be positive in {value}", param, ctx)
+                values = []
+                nr_steps = 0
+                while start + nr_steps * step <= stop + step * 1e-9:
+                    values.append(self.value_type(round(start + nr_steps * step, 10)))
+                    nr_steps += 1
+                return values
+            return [self.value_type(val) for val in value.split(',')]
+        except ValueError:
+            self.fail(f"{value} is not a list or range of {self.value_type.__name__}", param, ctx)
+
+
+@cli.command()
+@click.option('--min-sites',
+    help="Minimum UPD informative sites required to call a region, e.g. 3,5,10 or 3:10:1",
+    type=SweepValues(int),
+    default='3',
+    show_default=True
+)
+@click.option('--min-size',
+    help="Minimum size (bp) required to call a region, e.g. 1000,10000 or 1000:100000:1000",
+    type=SweepValues(int),
+    default='1000',
+    show_default=True
+)
+@click.option('--iso-het-pct',
+    help="Ratio iso/het for determening UPD type, e.g. 0.01,0.05 or 0.01:0.1:0.01",
+    type=SweepValues(float),
+    default='0.01',
+    show_default=True
+)
+@click.option('--out-dir',
+    help="Output directory for one bed file per parameter combination",
+    type=click.Path(file_okay=False),
+    default='.',
+    show_default=True
+)
+@click.pass_context
+def sweep(context, min_sites, min_size, iso_het_pct, out_dir):
+    """Call UPD regions for every combination of region filter parameters
+    
+    The regions are called once and filtered with each combination.
+    """
+    if context.obj['trios']:
+        prefixes = [f"{proband}." for proband, _, _ in context.obj['trios']]
+        callers = [RegionCaller() for _ in prefixes]
+        add_site = [timed_call(context, 'segment', caller.add) for caller in callers]
+        trio_calls = [[] for _ in prefixes]
+        for trio_nr, scall in context.obj['site_calls']:
+            rcall = add_site[trio_nr](scall)
+            if rcall:
+                trio_calls[trio_nr].append(rcall)
+        for caller, calls in zip(callers, trio_calls):
+            rcall = caller.finish()
+            if rcall:
+                calls.append(rcall)
+    else:
+        prefixes = ['']
+        trio_calls = [list(segment_sites(context, context.obj['site_calls']))]
+
+    os.makedirs(out_dir, exist_ok=True)
+    with stage_timer(context, 'write'):
+        for prefix, calls in zip(prefixes, trio_calls):
+            for sites_cut, size_cut, het_cut in itertools.product(min_sites, min_size, 
+                                                                  iso_het_pct):
+                out_path = os.path.join(out_dir, (f"{prefix}upd_regions.min_sites_{sites_cut}"
+                                                  f".min_size_{size_cut}"
+                                                  f".iso_het_pct_{het_cut}.bed"))
+                with open(out_path, 'w') as f:
+                    for line in output_filtered_regions(calls, sites_cut, size_cut, het_cut):
+                        f.write(line+'\n')
+
+    LOG.info("Regions written for %s parameter combinations", 
+             len(min_sites) * len(min_size) * len(iso_het_pct))
+    finish_run(context)
 
 
 @cli.command()
 @click.option('-o','--out',
-    help="Output bed file of all informative sites",
+    help="Output bed file of all informative sites. A name ending with .gz is written bgzipped "
+         "with a tabix index",
     type=click.Path(exists=False),
     default='-',
 )
+@click.option('--out-dir',
+    help="Output directory for one bed file per trio, used with --ped/--trio",
+    type=click.Path(file_okay=False),
+    default='.',
+    show_default=True
+)
+@click.option('--format', 'out_format',
+    help="Output format. npz (NumPy) and arrow (Arrow IPC, needs pyarrow) write typed columns "
+         "to --out, for loading without parsing",
+    type=click.Choice(EXPORT_FORMATS),
+    default='bed',
+    show_default=True
+)
 @click.pass_context
-def sites(context, out):
+def sites(context, out, out_dir, out_format):
     """Prints the sites that are informative for UPD"""
-    site_type_name = [
-        "UNINFORMATIVE", "UPD_MATERNAL_ORIGIN", "UPD_PATERNAL_ORIGIN", "ANTI_UPD",
-        "PB_HOMOZYGOUS", "PB_HETEROZYGOUS"
-    ]
-
-    with click.open_file(out, 'w') as f:
-        for scall in context.obj['site_calls']:
-            f.write("{}\t{}\t{}\t{}\n".format(
-                scall['chrom'],
-                scall['pos']-1,
-                scall['pos'],
-                site_type_name[scall['call']]
-            ))
+    check_export(context, out_format, out)
+    if context.obj['trios']:
+        out_paths = trio_out_paths(context.obj['trios'], out_dir, 'upd_sites.bed')
+        handles = [open(out_path, 'w') for out_path in out_paths]
+        with stage_timer(context, 'write'):
+            for trio_nr, scall in context.obj['site_calls']:
+                for line in output_sites([scall]):
+                    handles[trio_nr].write(line+'\n')
+        for f in handles:
+            f.close()
+    elif out_format != 'bed':
+        site_calls = context.obj['site_calls']
+        if not isinstance(site_calls, SiteTable):
+            site_calls = SiteTable(site_calls)
+        with stage_timer(context, 'write'):
+            write_sites(site_calls, out, out_format)
+    else:
+        with open_output(out) as f, stage_timer(context, 'write'):
+            for line in output_sites(context.obj['site_calls']):
+                f.write(line+'\n')
 
+    finish_run(context)
+
+
+@cli.command()
+@click.option('--socket', 'socket_path',
+    help="Listen for jobs on this Unix socket instead of reading them from stdin",
+    type=click.Path(dir_okay=False),
+)
+@click.pass_context
+def serve(context, socket_path):
+    """Run jobs given as JSON lines, keeping the worker processes and caches between jobs
+
+    Each job gives a vcf, a proband, mother and father, and optionally filters, regions and out
+    and sites_out paths. A JSON line with the regions and metrics is written for each job when
+    it is done. Use --processes for the number of jobs run at the same time and --cache-dir to
+    keep the informative sites between runs of the server.
+    """
+    with JobServer(context.obj['processes'], context.obj['cache_dir'],
+                   context.obj['cache_size'] * 1024**2, context.obj['threads']) as server:
+        if socket_path:
+            try:
+                server.serve_socket(socket_path)
+            except KeyboardInterrupt:
+                LOG.info("Server stopped")
+            except OSError as err:
+                LOG.warning(err)
+                context.abort()
+        else:
+            with click.open_file('-', 'r') as stdin, click.open_file('-', 'w') as stdout:
+                def write(line):
+                    stdout.write(line)
+                    stdout.flush()
+                server.serve_lines(stdin, write)
+
+
+def check_export(context, out_format, out):
+    """Check that the output can be written in a typed columnar format"""
+    if out_format == 'bed':
+        return
+    if context.obj['trios']:
+        LOG.warning("--format %s is not supported with --ped/--trio", out_format)
+        context.abort()
+    if out == '-':
+        LOG.warning("--format %s needs an output file given with --out", out_format)
+        context.abort()
+    try:
+        check_format(out_format)
+    except ValueError as err:
+        LOG.warning(err)
+        context.abort()
+
+
+def open_output(path):
+    """Open an output BED file, - for stdout. Files ending with .gz are bgzipped and indexed"""
+    if path == '-':
+        return click.open_file(path, 'w')
+    return open_bed(path)
+
+
+def tee_sites(sites, handle):
+    """Pass sites on while writing them as bed lines
+    
+    Args:
+        sites (iterable(dict)): Site calls
+        handle (file): Output for the bed lines
+    
+    Yields:
+        site_call (dict)
+    """
+    sites, sites_copy = itertools.tee(sites)
+    for scall, line in zip(sites, output_sites(sites_copy)):
+        handle.write(line+'\n')
+        yield scall
+
+
+def segment_sites(context, site_calls):
+    """Call the regions of one trio, segmenting the sites in bulk if they are in a SiteTable"""
+    if isinstance(site_calls, SiteTable):
+        return timed_iter(context, 'segment', call_regions_table(site_calls))
+    return timed_iter(context, 'segment', call_regions(site_calls))
+
+
+def stage_timer(context, stage):
+    """Time a block of code as a stage, if metrics are collected"""
+    metrics = context.obj['metrics']
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.timer(stage)
+
+
+def timed_iter(context, stage, iterable):
+    """Time each step of an iterable as a stage, if metrics are collected"""
+    metrics = context.obj['metrics']
+    if metrics is None:
+        return iterable
+    return metrics.timed_iter(stage, iterable)
+
+
+def timed_call(context, stage, func):
+    """Time each call of a function as a stage, if metrics are collected"""
+    metrics = context.obj['metrics']
+    if metrics is None:
+        return func
+    return metrics.timed_call(stage, func)
+
+
+def finish_run(context):
+    """Log the run time and the metrics, and write the metrics file"""
     end_time = datetime.datetime.now() - context.obj['start_time']
     LOG.info(f"Time to parse variants {end_time}")
+
+    metrics = context.obj['metrics']
+    if metrics is None:
+        return
+    for stage, (wall, cpu, _) in metrics.stages.items():
+        LOG.info("Stage %s: %.2fs wall, %.2fs CPU", stage, wall, cpu)
+    if metrics.counters:
+        LOG.info("Dropped variants: %s", 
+                 ', '.join(f"{reason} {nr}" for reason, nr in metrics.counters.items()))
+    if context.obj['metrics_path']:
+        metrics.write(context.obj['metrics_path'])
+        LOG.info("Metrics written to %s", context.obj['metrics_path'])
+
+
+def trio_out_paths(trios, out_dir, suffix):
+    """Get one output path per trio, named after the proband
+    
+    Args:
+        trios (list(tuple)): (proband, mother, father) for each trio
+        out_dir (str): Output directory, created if it does not exist
+        suffix (str): Appended to the proband ID
+    
+    Returns:
+        out_paths (list(str))
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    return [os.path.join(out_dir, f"{proband}.{suffix}") for proband, _, _ in trios]
@@ -0,0 +1,201 @@
+"""Typed columnar export of informative sites and regions
+
+Sites and regions can be written as a NumPy .npz archive, or as an Arrow IPC file when pyarrow is
+installed, instead of BED lines. Loading them needs no parsing: the arrays of an .npz are read
+as they are, and an Arrow file is memory mapped.
+
+Sites have the columns chrom (uint16), pos (uint32, 1-based) and call (uint8). Regions have
+chrom, start and end (BED coordinates), origin and type, and the statistics of the BED output as
+int64 columns. chrom, call, origin and type are codes: in an .npz the names of the codes are in
+the arrays chrom_names, call_names, origin_names and type_names, in an Arrow file they are
+dictionary encoded and load as categoricals in pandas.
+"""
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+from .bed_utils import SITE_TYPE_NAMES
+from .site_table import SiteTable
+
+LOG = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ['bed', 'npz', 'arrow']
+
+ORIGIN_NAMES = ['MATERNAL', 'PATERNAL']
+REGION_TYPE_NAMES = ['HETERODISOMY', 'ISODISOMY/DELETION']
+
+# Statistics columns of regions and the keys of the region dictionaries they are taken from
+REGION_STATS = [
+    ('low_size', 'low_size'),
+    ('inf_sites', 'run_len'),
+    ('snps', 'tot'),
+    ('het_sites', 'het_sites'),
+    ('hom_sites', 'hom_sites'),
+    ('opp_sites', 'opposites'),
+    ('start_low', 'start_lo'),
+    ('end_high', 'end_hi'),
+    ('high_size', 'high_size'),
+]
+
+ARROW_MAGIC = b'ARROW1'
+
+
+def check_format(out_format):
+    """Check that the packages needed for an export format are installed
+
+    Raises:
+        ValueError: If they are not
+    """
+    if out_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {out_format}")
+    if out_format in ('npz', 'arrow') and np is None:
+        raise ValueError(f"The {out_format} format needs numpy, install upd[numpy]")
+    if out_format == 'arrow' and pa is None:
+        raise ValueError("The arrow format needs pyarrow")
+
+
+def site_columns(sites):
+    """Get the columns of informative sites
+
+    Args:
+        sites (iterable(dict)): Site calls, a SiteTable is used without copying
+
+    Returns:
+        columns (dict(str, numpy.ndarray)), names (dict(str, list(str))): The names of the codes
+                                                                          of coded columns
+    """
+    if not isinstance(sites, SiteTable):
+        sites = SiteTable(sites)
+    columns = {
+        'chrom': np.frombuffer(sites.chrom_codes, dtype=np.uint16),
+        'pos': np.frombuffer(sites.pos, dtype=np.uint32),
+        'call': np.frombuffer(sites.calls, dtype=np.uint8),
+    }
+    return columns, {'chrom': list(sites.chroms), 'call': list(SITE_TYPE_NAMES)}
+
+
+def region_columns(regions):
+    """Get the columns of regions
+
+    Args:
+        regions (iterable(dict)): Regions annotated by upd.bed_utils.filter_regions
+
+    Returns:
+        columns (dict(str, numpy.ndarray)), names (dict(str, list(str))), see site_columns
+    """
+    regions = list(regions)
+    chroms = list(dict.fromkeys(region['chrom'] for region in regions))
+    chrom_codes = {chrom: code for code, chrom in enumerate(chroms)}
+    columns = {
+        'chrom': np.array([chrom_codes[region['chrom']] for region in regions], dtype=np.uint16),
+        'start': np.array([region['start_hi'] - 1 for region in regions], dtype=np.int64),
+        'end': np.array([region['end_lo'] for region in regions], dtype=np.int64),
+        'origin': np.array([ORIGIN_NAMES.index(region['origin']) for region in regions],
+                           dtype=np.uint8),
+        'type': np.array([REGION_TYPE_NAMES.index(region['type']) for region in regions],
+                         dtype=np.uint8),
+    }
+    for column, key in REGION_STATS:
+        columns[column] = np.array([region[key] for region in regions], dtype=np.int64)
+    names = {'chrom': chroms, 'origin': list(ORIGIN_NAMES), 'type': list(REGION_TYPE_NAMES)}
+    return columns, names
+
+
+def _index_type(nr_names):
+    """The smallest signed integer type for the codes of a dictionary column in Arrow"""
+    for dtype in (np.int8, np.int16):
+        if nr_names <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.int32
+
+
+def write_columns(columns, names, path, out_format):
+    """Write typed columns
+
+    Args:
+        columns (dict(str, numpy.ndarray)): Columns of the same length
+        names (dict(str, list(str))): Names of the codes of coded columns
+        path (str)
+        out_format (str): npz or arrow
+    """
+    check_format(out_format)
+    if out_format == 'npz':
+        arrays = dict(columns)
+        for column, column_names in names.items():
+            arrays[f"{column}_names"] = np.array(column_names, dtype=str)
+        # Not compressed, so that loading is a plain read of the arrays
+        with open(path, 'wb') as handle:
+            np.savez(handle, **arrays)
+        return
+
+    arrow_columns = []
+    for column, values in columns.items():
+        if column in names:
+            values = pa.DictionaryArray.from_arrays(
+                pa.array(values.astype(_index_type(len(names[column])))),
+                pa.array(names[column], type=pa.string())
+            )
+        else:
+            values = pa.array(values)
+        arrow_columns.append(values)
+    table = pa.Table.from_arrays(arrow_columns, names=list(columns))
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def write_sites(sites, path, out_format='npz'):
+    """Write informative sites as typed columns, see the module documentation
+
+    Args:
+        sites (iterable(dict)): Site calls
+        path (str)
+        out_format (str): npz or arrow
+    """
+    check_format(out_format)
+    columns, names = site_columns(sites)
+    write_columns(columns, names, path, out_format)
+    LOG.info("%s informative sites written to %s", len(columns['pos']), path)
+
+
+def write_regions(regions, path, out_format='npz'):
+    """Write regions as typed columns, see the module documentation
+
+    Args:
+        regions (iterable(dict)): Regions annotated by upd.bed_utils.filter_regions
+        path (str)
+        out_format (str): npz or arrow
+    """
+    check_format(out_format)
+    columns, names = region_columns(regions)
+    write_columns(columns, names, path, out_format)
+    LOG.info("%s regions written to %s", len(columns['start']), path)
+
+
+def load_columns(path):
+    """Load a file written by write_sites or write_regions
+
+    Args:
+        path (str)
+
+    Returns:
+        columns (numpy.lib.npyio.NpzFile or pyarrow.Table): The arrays of an .npz, read when
+                                                            accessed, or a memory mapped table
+    """
+    with open(path, 'rb') as handle:
+        magic = handle.read(len(ARROW_MAGIC))
+
+    if magic == ARROW_MAGIC:
+        check_format('arrow')
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    check_format('npz')
+    return np.load(path)
@@ -0,0 +1,157 @@
+"""Timers, counters and progress reporting for a run"""
+import datetime
+import json
+import logging
+import time
+
+from contextlib import contextmanager
+
+LOG = logging.getLogger(__name__)
+
+# Check the clock for progress once every this many variants
+PROGRESS_STEP = 10000
+
+
+class Metrics(object):
+    """Collects the wall and CPU time per stage and counters of a run
+
+    Timers nest, time spent in an inner stage is not counted in the outer stage. Since the stages
+    are generators pulling from each other, this gives the time of each stage on its own and the
+    stage times add up to the time of the run.
+
+    Timing costs a few clock reads per variant, so instrumentation is only set up when asked for.
+
+    Args:
+        progress_interval (float): Log progress every this many seconds, None to disable
+        position (callable): Returns the number of bytes of the input read so far, None if
+                             unknown
+        total_bytes (int): Size of the input, used to estimate the time left
+    """
+    def __init__(self, progress_interval=None, position=None, total_bytes=None):
+        super(Metrics, self).__init__()
+        self.stages = {}
+        self.counters = {}
+        self.progress_interval = progress_interval
+        self.position = position
+        self.total_bytes = total_bytes
+        self.nr_variants = 0
+        self._stack = []
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._last_progress = self._start_wall
+
+    def start(self, stage):
+        """Start timing a stage"""
+        self._stack.append([stage, time.perf_counter(), time.process_time(), 0.0, 0.0])
+
+    def stop(self):
+        """Stop timing the innermost stage"""
+        stage, wall_start, cpu_start, child_wall, child_cpu = self._stack.pop()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        stage_times = self.stages.setdefault(stage, [0.0, 0.0, 0])
+        stage_times[0] += wall - child_wall
+        stage_times[1] += cpu - child_cpu
+        stage_times[2] += 1
+        if self._stack:
+            self._stack[-1][3] += wall
+            self._stack[-1][4] += cpu
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a block of code as a stage"""
+        self.start(stage)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def timed_iter(self, stage, iterable):
+        """Iterate over iterable, timing each step as a stage"""
+        iterator = iter(iterable)
+        while True:
+            self.start(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield item
+
+    def timed_call(self, stage, func):
+        """Wrap func so that each call is timed as a stage"""
+        def timed(*args, **kwargs):
+            self.start(stage)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stop()
+        return timed
+
+    def track(self, variants, stage='parse'):
+        """Iterate over variants, timing each step and logging progress"""
+        for variant in self.timed_iter(stage, variants):
+            self.nr_variants += 1
+            if self.progress_interval and self.nr_variants % PROGRESS_STEP == 0:
+                now = time.perf_counter()
+                if now - self._last_progress >= self.progress_interval:
+                    self._last_progress = now
+                    self.log_progress()
+            yield variant
+
+    def count(self, name, nr=1):
+        """Add to a counter"""
+        self.counters[name] = self.counters.get(name, 0) + nr
+
+    def update_counters(self, counters):
+        """Add several counters, e.g. a dictionary of drop reasons"""
+        for name, nr in counters.items():
+            self.count(name, nr)
+
+    def _bytes_read(self):
+        if self.position is None:
+            return None
+        try:
+            return self.position()
+        except (OSError, ValueError):
+            return None
+
+    def log_progress(self):
+        """Log the number of variants, bytes per second and an estimate of the time left"""
+        elapsed = time.perf_counter() - self._start_wall
+        bytes_read = self._bytes_read()
+        message = (f"{self.nr_variants} variants parsed in "
+                   f"{datetime.timedelta(seconds=round(elapsed))}")
+        if bytes_read and elapsed > 0:
+            rate = bytes_read / elapsed
+            message += f", {rate / 1024**2:.1f} MB/s"
+            if self.total_bytes:
+                message += f", {100 * bytes_read / self.total_bytes:.1f}%"
+                seconds_left = max(self.total_bytes - bytes_read, 0) / rate
+                message += f", ETA {datetime.timedelta(seconds=round(seconds_left))}"
+        LOG.info(message)
+
+    def to_dict(self):
+        """The metrics as a dictionary"""
+        return {
+            'wall_seconds': time.perf_counter() - self._start_wall,
+            'cpu_seconds': time.process_time() - self._start_cpu,
+            'variants_parsed': self.nr_variants,
+            'bytes_read': self._bytes_read(),
+            'total_bytes': self.total_bytes,
+            'stages': {
+                stage: {'wall_seconds': wall, 'cpu_seconds': cpu, 'calls': calls}
+                for stage, (wall, cpu, calls) in self.stages.items()
+            },
+            'counters': dict(self.counters),
+        }
+
+    def write(self, path):
+        """Write the metrics to a JSON file"""
+        with open(path, 'w') as handle:
+            json.dump(self.to_dict(), handle, indent=2)
+            handle.write('\n')
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} ({len(self.stages)} stages)"
@@ -0,0 +1,101 @@
+"""Search for UPD informative sites with one worker process per sequence"""
+import logging
+
+from multiprocessing import Pool
+
+from .site_table import SiteTable
+from .utils import get_UPD_informative_sites
+from .vcf_tools import (get_indexed_vcf, build_prefilter)
+
+LOG = logging.getLogger(__name__)
+
+
+# The indexed VCF opened by each worker process
+_WORKER = {}
+
+
+def _init_worker(vcf_path, params):
+    """Open the indexed VCF once per worker process"""
+    vcf_reader = get_indexed_vcf(vcf_path, params['proband'], params['mother'], params['father'])
+    vcf_reader.prefilter = build_prefilter(
+        min_af=params['min_af'], 
+        vep_fields=params['csq_fields'], 
+        af_tag=params['af_tag'],
+        all_transcripts=params['all_transcripts']
+    )
+    _WORKER['vcf'] = vcf_reader
+    _WORKER['params'] = params
+
+
+def _contig_sites(contig):
+    """Get the informative sites of one sequence
+
+    Args:
+        contig (str): Name of the sequence
+
+    Returns:
+        sites (SiteTable), nr_variants (int)
+    """
+    vcf_reader = _WORKER['vcf']
+    nr_variants = vcf_reader.nr_variants
+    regions = [(contig, 0, None)]
+    try:
+        sites = SiteTable(get_UPD_informative_sites(vcf=vcf_reader, regions=regions,
+                                                    **_WORKER['params']))
+    except SystemExit as err:
+        # SystemExit would end the worker process and the pool would wait for its result forever
+        raise ValueError(str(err))
+    LOG.debug("Chromosome %s searched", contig)
+    return sites, vcf_reader.nr_variants - nr_variants
+
+
+def get_UPD_informative_sites_parallel(vcf_path, csq_fields, proband, mother, father, min_af=0.05,
+                                       af_tag='MAX_AF', min_gq=30, processes=2,
+                                       all_transcripts=False):
+    """Get UPD calls for each informative SNP, searching the sequences in parallel
+    
+    The VCF has to be BGZF compressed and indexed. Sites are yielded in the same order as 
+    get_UPD_informative_sites, sequence by sequence as they appear in the file.
+    
+    Args:
+        vcf_path (str): Path to an indexed VCF
+        csq_fields (list): describes VEP annotation
+        proband (str): ID of proband in VCF
+        mother (str): ID of mother in VCF
+        father (str): ID of father in VCF
+        min_af (float): Minimum allele frequency to consider SNP
+        af_tag (str): Key to AF in annotation
+        min_gq (int): Minimum GQ to consider variant
+        processes (int): Number of worker processes
+        all_transcripts (bool): Use the highest frequency of all VEP transcripts
+    
+    Yields:
+        site_calls (dict): A generator with dictionaries that describes the variant.
+    """
+    # The sequences are taken from the index, the workers open the VCF themselves
+    vcf_reader = get_indexed_vcf(vcf_path, proband, mother, father)
+    try:
+        contigs = vcf_reader.index.names
+    finally:
+        vcf_reader.close()
+    params = {
+        'csq_fields': csq_fields,
+        'proband': proband,
+        'mother': mother,
+        'father': father,
+        'min_af': min_af,
+        'af_tag': af_tag,
+        'min_gq': min_gq,
+        'all_transcripts': all_transcripts,
+    }
+
+    nr_variants = 0
+    nr_informative = 0
+    with Pool(processes, initializer=_init_worker, initargs=(vcf_path, params)) as pool:
+        for sites, contig_variants in pool.imap(_contig_sites, contigs):
+            nr_variants += contig_variants
+            nr_informative += len(sites)
+            yield from sites
+
+    LOG.info("%s variants in vcf", nr_variants)
+    LOG.info("%s informative variants found", nr_informative)
@@ -0,0 +1,56 @@
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+def parse_ped(ped_lines):
+    """Parse the individuals of a PED file
+    
+    Args:
+        ped_lines (iterable(str)): Lines of a PED file
+    
+    Returns:
+        individuals (list(dict)): One dictionary per individual
+    """
+    individuals = []
+    for line in ped_lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        splitted_line = line.split()
+        if len(splitted_line) < 6:
+            raise SyntaxError(f"Malformed PED line: {line}")
+        individuals.append({
+            'family_id': splitted_line[0],
+            'sample_id': splitted_line[1],
+            'father': splitted_line[2],
+            'mother': splitted_line[3],
+            'sex': splitted_line[4],
+            'phenotype': splitted_line[5],
+        })
+    
+    return individuals
+
+
+def get_trios(ped_path):
+    """Get all trios from a PED file
+    
+    A trio is an individual with both parents given.
+    
+    Args:
+        ped_path (str)
+    
+    Returns:
+        trios (list(tuple)): (proband, mother, father) for each trio
+    """
+    with open(ped_path, 'r') as ped_handle:
+        individuals = parse_ped(ped_handle)
+    
+    trios = []
+    for ind in individuals:
+        if ind['mother'] == '0' or ind['father'] == '0':
+            continue
+        trios.append((ind['sample_id'], ind['mother'], ind['father']))
+    
+    LOG.info("%s trios found in %s", len(trios), ped_path)
+    return trios
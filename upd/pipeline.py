@@ -0,0 +1,178 @@
+"""Search for UPD informative sites with overlapped reading, parsing and calling
+
+A reader thread reads the variant lines of the VCF into batches and puts them on a bounded
+queue. Worker processes parse and filter the batches and call the sites, and the sites are
+yielded in the order of the batches, so the output is the same as of a serial search. While the
+workers parse, the reader thread waits on the file and decompresses, and the consumer of the
+sites calls the regions.
+
+At most max_pending batches are queued and at most max_pending are parsed or waiting to be
+consumed, which bounds the memory used.
+"""
+import itertools
+import logging
+import queue
+import threading
+
+from collections import deque
+from multiprocessing import Pool
+
+from .site_table import SiteTable
+from .utils import get_UPD_informative_sites
+from .vcf_tools import (Vcf, build_prefilter)
+
+LOG = logging.getLogger(__name__)
+
+# Number of variant lines parsed by a worker at a time
+BATCH_SIZE = 5000
+
+# Seconds between checks for a finished batch while waiting for the reader
+POLL_SECONDS = 0.01
+
+# Marks the end of the batches on the queue
+_END = object()
+
+# The header and parameters of each worker process
+_WORKER = {}
+
+
+def _init_worker(header, params):
+    """Keep the header and build the prefilter once per worker process"""
+    # Batches would each log their number of variants, they are logged by the consumer instead
+    logging.getLogger('upd.utils').setLevel(logging.WARNING)
+    _WORKER['header'] = header
+    _WORKER['prefilter'] = build_prefilter(
+        min_af=params['min_af'],
+        vep_fields=params['csq_fields'],
+        af_tag=params['af_tag'],
+        all_transcripts=params['all_transcripts']
+    )
+    _WORKER['params'] = params
+
+
+def _batch_sites(lines):
+    """Get the informative sites of a batch of variant lines
+
+    Args:
+        lines (list(str)): Variant lines
+
+    Returns:
+        sites (SiteTable), nr_variants (int)
+    """
+    params = _WORKER['params']
+    vcf_reader = Vcf(itertools.chain(_WORKER['header'], lines), prefilter=_WORKER['prefilter'])
+    vcf_reader.select_samples([params['proband'], params['mother'], params['father']])
+    try:
+        sites = SiteTable(get_UPD_informative_sites(vcf=vcf_reader, **params))
+    except SystemExit as err:
+        # SystemExit would end the worker process and the pool would wait for its result forever
+        raise ValueError(str(err))
+    return sites, vcf_reader.nr_variants
+
+
+def _read_batches(vcf_reader, batches, batch_size, stop):
+    """Put batches of variant lines on a queue, run by the reader thread
+
+    Ends with _END, or with the exception that stopped the reading.
+    """
+    def put(item):
+        # Wait for room on the queue, unless the consumer has stopped
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        lines = vcf_reader.iter_lines()
+        while True:
+            batch = list(itertools.islice(lines, batch_size))
+            if not batch:
+                break
+            if not put(batch):
+                return
+        put(_END)
+    except Exception as err:
+        put(err)
+
+
+def get_UPD_informative_sites_pipelined(vcf, csq_fields, proband, mother, father, min_af=0.05,
+                                        af_tag='MAX_AF', min_gq=30, processes=2,
+                                        all_transcripts=False, batch_size=BATCH_SIZE,
+                                        max_pending=None):
+    """Get UPD calls for each informative SNP, parsing batches of lines in worker processes
+
+    Works on any VCF, also one read from stdin. Sites are yielded in the same order as
+    get_UPD_informative_sites.
+
+    Args:
+        vcf (upd.vcf_tools.Vcf): A VCF with the header read, the prefilter is not used
+        csq_fields (list): describes VEP annotation
+        proband (str): ID of proband in VCF
+        mother (str): ID of mother in VCF
+        father (str): ID of father in VCF
+        min_af (float): Minimum allele frequency to consider SNP
+        af_tag (str): Key to AF in annotation
+        min_gq (int): Minimum GQ to consider variant
+        processes (int): Number of worker processes
+        all_transcripts (bool): Use the highest frequency of all VEP transcripts
+        batch_size (int): Number of variant lines in a batch
+        max_pending (int): Maximum number of batches queued and of batches in the workers,
+                           defaults to twice the number of processes
+
+    Yields:
+        site_calls (dict): A generator with dictionaries that describes the variant.
+    """
+    max_pending = max_pending or 2 * processes
+    params = {
+        'csq_fields': csq_fields,
+        'proband': proband,
+        'mother': mother,
+        'father': father,
+        'min_af': min_af,
+        'af_tag': af_tag,
+        'min_gq': min_gq,
+        'all_transcripts': all_transcripts,
+    }
+
+    batches = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_batches, args=(vcf, batches, batch_size, stop),
+                              daemon=True)
+    nr_variants = 0
+    nr_informative = 0
+    with Pool(processes, initializer=_init_worker, initargs=(vcf.raw_header, params)) as pool:
+        reader.start()
+        try:
+            pending = deque()
+            done = False
+            while True:
+                while not done and len(pending) < max_pending:
+                    # Hand on finished batches first, only wait for the reader when no batch
+                    # is being parsed
+                    if pending and pending[0].ready():
+                        break
+                    try:
+                        batch = batches.get(timeout=POLL_SECONDS if pending else None)
+                    except queue.Empty:
+                        continue
+                    if batch is _END:
+                        done = True
+                    elif isinstance(batch, Exception):
+                        raise batch
+                    else:
+                        pending.append(pool.apply_async(_batch_sites, (batch,)))
+                if not pending:
+                    break
+                sites, batch_variants = pending.popleft().get()
+                nr_variants += batch_variants
+                nr_informative += len(sites)
+                yield from sites
+        finally:
+            stop.set()
+            reader.join()
+
+    LOG.info("%s variants in vcf", nr_variants)
+    LOG.info("%s informative variants found", nr_informative)
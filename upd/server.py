@@ -0,0 +1,233 @@
+"""Run UPD jobs in a long running process
+
+Jobs are JSON objects, one per line, read from stdin or from the connections to a Unix socket:
+
+    {"id": "trio1", "vcf": "trio1.vcf.gz", "proband": "PB", "mother": "MO", "father": "FA",
+     "vep": true, "min_af": 0.05, "out": "trio1.upd_regions.bed"}
+
+Besides vcf and the trio, a job can give the parameters of UpdAnalysis (af_tag, vep, min_af,
+min_gq, all_transcripts, min_sites, min_size, iso_het_pct), regions to search, and out and
+sites_out paths for the BED files of the regions and the sites, bgzipped and indexed if they end
+with .gz. The jobs run on a pool of worker processes. Each worker keeps its UpdAnalysis objects,
+with their checked headers, and the site cache between jobs.
+
+A result line is written for each job as soon as it is done, so results can come back in another
+order than the jobs were given. It holds the id of the job, status ok or error, the regions,
+the number of sites and the time the job took.
+"""
+import json
+import logging
+import os
+import socketserver
+import stat
+import threading
+
+from multiprocessing import Pool
+
+from .api import UpdAnalysis
+from .bed_utils import (format_region, open_bed, output_sites, parse_region)
+from .cache import SiteCache
+from .metrics import Metrics
+from .site_table import SiteTable
+
+LOG = logging.getLogger(__name__)
+
+# Keys of a job that are passed to UpdAnalysis
+ANALYSIS_PARAMS = ('af_tag', 'vep', 'min_af', 'min_gq', 'all_transcripts', 'min_sites',
+                   'min_size', 'iso_het_pct')
+
+# Keys every job needs
+REQUIRED_KEYS = ('vcf', 'proband', 'mother', 'father')
+
+# The analyses and the site cache of each worker process
+_WORKER = {}
+
+
+def _init_worker(cache_dir, cache_size, threads):
+    _WORKER['analyses'] = {}
+    _WORKER['cache'] = SiteCache(cache_dir, max_size=cache_size) if cache_dir else None
+    _WORKER['threads'] = threads
+
+
+def _run_job(job):
+    return run_job(job, _WORKER['analyses'], _WORKER['cache'], _WORKER['threads'])
+
+
+def run_job(job, analyses=None, cache=None, threads=1):
+    """Run a job
+
+    Args:
+        job (dict): The job, see the module documentation
+        analyses (dict): UpdAnalysis objects kept between jobs, by their parameters
+        cache (upd.cache.SiteCache): Cache of informative sites, shared with the command line
+        threads (int): Number of threads used to decompress a bgzipped VCF
+
+    Returns:
+        result (dict): The result line of the job
+    """
+    metrics = Metrics()
+    try:
+        missing = [key for key in REQUIRED_KEYS if not job.get(key)]
+        if missing:
+            raise ValueError(f"The job is missing {', '.join(missing)}")
+        params = {key: job[key] for key in ANALYSIS_PARAMS if key in job}
+        analysis_key = json.dumps(params, sort_keys=True)
+        analysis = None if analyses is None else analyses.get(analysis_key)
+        if analysis is None:
+            analysis = UpdAnalysis(threads=threads, **params)
+            if analyses is not None:
+                analyses[analysis_key] = analysis
+
+        vcf = job['vcf']
+        trio = (job['proband'], job['mother'], job['father'])
+        regions = None
+        if job.get('regions'):
+            regions = [parse_region(region) if isinstance(region, str) else tuple(region)
+                       for region in job['regions']]
+
+        sites = None
+        if cache:
+            # The same key as the command line uses
+            cache_key = cache.key(vcf, *trio, min_af=analysis.min_af, af_tag=analysis.af_tag,
+                                  min_gq=analysis.min_gq, vep=analysis.vep, regions=regions,
+                                  all_transcripts=analysis.all_transcripts)
+            sites = cache.get(cache_key)
+        cached = sites is not None
+        if sites is None:
+            with metrics.timer('search'):
+                sites = SiteTable(analysis.sites(vcf, *trio, regions=regions))
+            if cache:
+                cache.put(cache_key, sites)
+
+        with metrics.timer('segment'):
+            upd_regions = list(analysis.regions(sites))
+
+        with metrics.timer('write'):
+            if job.get('out'):
+                with open_bed(job['out']) as handle:
+                    for region in upd_regions:
+                        handle.write(format_region(region)+'\n')
+            if job.get('sites_out'):
+                with open_bed(job['sites_out']) as handle:
+                    for line in output_sites(sites):
+                        handle.write(line+'\n')
+    except (Exception, SystemExit) as err:
+        return {'id': job.get('id'), 'status': 'error', 'error': str(err) or repr(err)}
+
+    run_metrics = metrics.to_dict()
+    return {
+        'id': job.get('id'),
+        'status': 'ok',
+        'regions': upd_regions,
+        'nr_sites': len(sites),
+        'metrics': {
+            'wall_seconds': run_metrics['wall_seconds'],
+            'cpu_seconds': run_metrics['cpu_seconds'],
+            'stages': run_metrics['stages'],
+            'cached': cached,
+        },
+    }
+
+
+class JobServer(object):
+    """Runs jobs on a pool of worker processes
+
+    Args:
+        processes (int): Number of worker processes
+        cache_dir (str): Directory of the site cache, None for no cache
+        cache_size (int): Maximum size of the site cache in bytes
+        threads (int): Number of threads used to decompress a bgzipped VCF
+    """
+    def __init__(self, processes=1, cache_dir=None, cache_size=1024**3, threads=1):
+        super(JobServer, self).__init__()
+        self.pool = Pool(processes, initializer=_init_worker,
+                         initargs=(cache_dir, cache_size, threads))
+
+    def serve_lines(self, lines, write):
+        """Run the jobs of JSON lines, writing each result when its job is done
+
+        Returns when the lines are read and all their jobs are done.
+
+        Args:
+            lines (iterable(str)): Job lines
+            write (callable): Called with each result line, from one thread at a time
+        """
+        done = threading.Condition()
+        pending = [0]
+
+        def finish(result):
+            with done:
+                try:
+                    write(json.dumps(result)+'\n')
+                except OSError as err:
+                    LOG.warning("Can not send the result of job %s: %s", result.get('id'), err)
+                pending[0] -= 1
+                done.notify_all()
+
+        def failed(err):
+            finish({'id': None, 'status': 'error', 'error': str(err)})
+
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError("A job has to be a JSON object")
+            except ValueError as err:
+                with done:
+                    pending[0] += 1
+                finish({'id': None, 'status': 'error', 'error': f"Malformed job: {err}"})
+                continue
+            with done:
+                pending[0] += 1
+            LOG.debug("Job %s submitted", job.get('id'))
+            self.pool.apply_async(_run_job, (job,), callback=finish, error_callback=failed)
+
+        with done:
+            done.wait_for(lambda: pending[0] == 0)
+
+    def serve_socket(self, path):
+        """Accept connections on a Unix socket until interrupted
+
+        Each connection sends job lines and gets a result line for each job. Results are sent
+        until all jobs of the connection are done, after the client has closed its end for
+        writing.
+
+        Raises:
+            OSError: If path exists and is not a socket
+        """
+        server = self
+
+        class JobHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                lines = (line.decode('utf-8', errors='replace') for line in self.rfile)
+                def write(line):
+                    self.wfile.write(line.encode('utf-8'))
+                    self.wfile.flush()
+                server.serve_lines(lines, write)
+
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise OSError(f"{path} exists and is not a socket")
+            # Left by a server that did not stop cleanly
+            os.remove(path)
+        with socketserver.ThreadingUnixStreamServer(path, JobHandler) as socket_server:
+            created = os.stat(path)
+            LOG.info("Listening on %s", path)
+            try:
+                socket_server.serve_forever()
+            finally:
+                # Only remove the socket of this server, not one created at the path since
+                if os.path.exists(path) and os.path.samestat(os.stat(path), created):
+                    os.remove(path)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
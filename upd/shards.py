@@ -0,0 +1,270 @@
+"""Search a VCF split into shards, e.g. one file per chromosome or per scatter interval
+
+The shards are searched as one VCF without concatenating them. All shards must have the same
+samples, and each shard must be sorted. The sites of the shards are merged in contig order: the
+order of the ##contig lines of the first shard, then the order contigs without a ##contig line
+are first seen in. A shard can hold several contigs and a contig can be split over shards, as
+long as the shards do not overlap.
+
+With one process the shards are read side by side and merged as they are read. With more
+processes, the shards are searched in parallel, one shard per process, and the sites of each
+shard are merged when it is done.
+"""
+import heapq
+import logging
+import os
+import re
+
+from multiprocessing import Pool
+
+from .site_table import SiteTable
+from .tabix import (find_index, read_index)
+from .utils import get_UPD_informative_sites
+from .vcf_tools import (build_prefilter, get_vcf, parse_CSQ_header)
+
+LOG = logging.getLogger(__name__)
+
+# A --vcf with one of these suffixes is a file with the paths of VCFs, one per line
+VCF_LIST_SUFFIXES = ('.list', '.fofn')
+
+CONTIG_PATTERN = re.compile(r'##contig=<ID=([^,>]+)')
+
+# The parameters of the search in each worker process
+_WORKER = {}
+
+
+def read_vcf_list(list_path):
+    """Read the paths of a file of VCFs
+
+    Empty lines and lines starting with # are skipped. Relative paths are relative to the
+    directory of the list.
+
+    Args:
+        list_path (str)
+
+    Returns:
+        vcf_paths (list(str))
+    """
+    list_dir = os.path.dirname(list_path)
+    vcf_paths = []
+    with open(list_path, 'r') as handle:
+        for line in handle:
+            vcf_path = line.strip()
+            if not vcf_path or vcf_path.startswith('#'):
+                continue
+            vcf_path = os.path.join(list_dir, vcf_path)
+            if not os.path.exists(vcf_path):
+                raise OSError(f"{vcf_path} in {list_path} does not exist")
+            vcf_paths.append(vcf_path)
+    return vcf_paths
+
+
+def expand_vcf_paths(paths):
+    """Get the VCFs given with --vcf, reading the paths of files of VCFs
+
+    Args:
+        paths (iterable(str)): VCFs and files of VCFs
+
+    Returns:
+        vcf_paths (list(str))
+    """
+    vcf_paths = []
+    for path in paths:
+        if path.endswith(VCF_LIST_SUFFIXES):
+            vcf_paths.extend(read_vcf_list(path))
+        else:
+            vcf_paths.append(path)
+    if len(vcf_paths) > 1 and '-' in vcf_paths:
+        raise SyntaxError("stdin can only be used as the only VCF")
+    return vcf_paths
+
+
+def contig_order(vcf_reader):
+    """Get the contigs of the ##contig lines of a VCF header
+
+    Returns:
+        contigs (list(str))
+    """
+    return [match.group(1) for match in map(CONTIG_PATTERN.match, vcf_reader.raw_header) if match]
+
+
+def open_shards(vcf_paths, proband, mother, father, threads=1):
+    """Open the shards of a VCF and check that they have the same samples
+
+    Args:
+        vcf_paths (list(str))
+        proband (str): ID of proband in VCF
+        mother (str): ID of mother in VCF
+        father (str): ID of father in VCF
+        threads (int): Number of decompression threads for bgzipped VCFs
+
+    Returns:
+        vcf_readers (list(upd.vcf_tools.Vcf)): With the trio selected
+    """
+    vcf_readers = []
+    try:
+        for vcf_path in vcf_paths:
+            vcf_reader = get_vcf(vcf_path, proband, mother, father, threads)
+            vcf_readers.append(vcf_reader)
+            if vcf_reader.all_samples != vcf_readers[0].all_samples:
+                raise SyntaxError(f"The samples of {vcf_path} differ from those of {vcf_paths[0]}")
+    except Exception:
+        for vcf_reader in vcf_readers:
+            vcf_reader.close()
+        raise
+    LOG.info("Searching %s VCFs", len(vcf_paths))
+    return vcf_readers
+
+
+def check_shard_headers(vcf_readers, vcf_paths, csq_fields, af_tag):
+    """Check that all shards have the frequency field, in the same VEP annotation
+
+    Args:
+        vcf_readers (list(upd.vcf_tools.Vcf))
+        vcf_paths (list(str))
+        csq_fields (list(str)): The VEP annotation of the first shard, None without vep
+        af_tag (str): Field with the population frequency
+    """
+    for vcf_reader, vcf_path in zip(vcf_readers[1:], vcf_paths[1:]):
+        if csq_fields is not None:
+            if parse_CSQ_header(vcf_reader) != csq_fields:
+                raise SyntaxError(f"The VEP annotation of {vcf_path} differs from that of "
+                                  f"{vcf_paths[0]}")
+        elif not vcf_reader.contains(af_tag):
+            raise SyntaxError(f"The field {af_tag} does not exist in {vcf_path}")
+
+
+def set_shard_indexes(vcf_readers, vcf_paths):
+    """Read the index of every shard, for searching regions"""
+    for vcf_reader, vcf_path in zip(vcf_readers, vcf_paths):
+        index_path = find_index(vcf_path)
+        if not index_path:
+            raise OSError(f"Regions can only be used with indexed VCFs, {vcf_path} has no index")
+        vcf_reader.index = read_index(index_path)
+
+
+def merge_sites(site_streams, contigs=None, names=None):
+    """Merge the sites of shards in contig order
+
+    Args:
+        site_streams (list(iterable(dict))): The sites of each shard, sorted
+        contigs (list(str)): Contigs in order, contigs not in it are ordered as they are seen
+        names (list(str)): Names of the shards, for errors
+
+    Yields:
+        site_call (dict)
+    """
+    ranks = {contig: rank for rank, contig in enumerate(contigs or [])}
+
+    def keyed(sites, name):
+        last_key = None
+        for site in sites:
+            rank = ranks.get(site['chrom'])
+            if rank is None:
+                rank = ranks[site['chrom']] = len(ranks)
+            key = (rank, site['pos'])
+            if last_key is not None and key < last_key:
+                raise SyntaxError(f"{name} is not sorted at {site['chrom']}:{site['pos']}")
+            last_key = key
+            yield key, site
+
+    names = names or [str(nr) for nr in range(len(site_streams))]
+    streams = [keyed(sites, name) for sites, name in zip(site_streams, names)]
+    for _, site in heapq.merge(*streams, key=lambda keyed_site: keyed_site[0]):
+        yield site
+
+
+def _init_worker(params, regions, threads):
+    _WORKER['params'] = params
+    _WORKER['regions'] = regions
+    _WORKER['threads'] = threads
+    _WORKER['prefilter'] = build_prefilter(
+        min_af=params['min_af'],
+        vep_fields=params['csq_fields'],
+        af_tag=params['af_tag'],
+        all_transcripts=params['all_transcripts']
+    )
+
+
+def _shard_sites(vcf_path):
+    """Get the informative sites of one shard
+
+    Returns:
+        sites (SiteTable), nr_variants (int)
+    """
+    params = _WORKER['params']
+    vcf_reader = get_vcf(vcf_path, params['proband'], params['mother'], params['father'],
+                         _WORKER['threads'])
+    try:
+        if _WORKER['regions']:
+            set_shard_indexes([vcf_reader], [vcf_path])
+        vcf_reader.prefilter = _WORKER['prefilter']
+        sites = SiteTable(get_UPD_informative_sites(vcf=vcf_reader, regions=_WORKER['regions'],
+                                                    **params))
+    except SystemExit as err:
+        # SystemExit would end the worker process and the pool would wait for its result forever
+        raise ValueError(str(err))
+    finally:
+        vcf_reader.close()
+    LOG.debug("%s searched", vcf_path)
+    return sites, vcf_reader.nr_variants
+
+
+def _result_sites(result):
+    sites, _ = result.get()
+    yield from sites
+
+
+def get_UPD_informative_sites_sharded(vcf_readers, vcf_paths, csq_fields, proband, mother,
+                                      father, min_af=0.05, af_tag='MAX_AF', min_gq=30,
+                                      processes=1, threads=1, regions=None, all_transcripts=False,
+                                      metrics=None):
+    """Get UPD calls for each informative SNP of all shards, merged in contig order
+
+    Args:
+        vcf_readers (list(upd.vcf_tools.Vcf)): The opened shards, with the prefilter set. Used
+                                               to read the shards with one process
+        vcf_paths (list(str)): Paths of the shards, opened again by the worker processes
+        csq_fields (list): describes VEP annotation
+        proband (str): ID of proband in VCF
+        mother (str): ID of mother in VCF
+        father (str): ID of father in VCF
+        min_af (float): Minimum allele frequency to consider SNP
+        af_tag (str): Key to AF in annotation
+        min_gq (int): Minimum GQ to consider variant
+        processes (int): Number of worker processes
+        threads (int): Number of decompression threads of each worker process
+        regions (list(tuple)): Only search these regions, needs the indexes of the shards
+        all_transcripts (bool): Use the highest frequency of all VEP transcripts
+        metrics (upd.metrics.Metrics): Timing and counting of the search with one process
+
+    Yields:
+        site_calls (dict): A generator with dictionaries that describes the variant.
+    """
+    contigs = contig_order(vcf_readers[0])
+    params = {
+        'csq_fields': csq_fields,
+        'proband': proband,
+        'mother': mother,
+        'father': father,
+        'min_af': min_af,
+        'af_tag': af_tag,
+        'min_gq': min_gq,
+        'all_transcripts': all_transcripts,
+    }
+    if processes < 2:
+        streams = [get_UPD_informative_sites(vcf=vcf_reader, regions=regions, metrics=metrics,
+                                             **params)
+                   for vcf_reader in vcf_readers]
+        yield from merge_sites(streams, contigs, vcf_paths)
+        return
+
+    for vcf_reader in vcf_readers:
+        vcf_reader.close()
+    with Pool(processes, initializer=_init_worker, initargs=(params, regions, threads)) as pool:
+        results = [pool.apply_async(_shard_sites, (vcf_path,)) for vcf_path in vcf_paths]
+        streams = [_result_sites(result) for result in results]
+        yield from merge_sites(streams, contigs, vcf_paths)
+        nr_variants = sum(result.get()[1] for result in results)
+
+    LOG.info("%s variants in %s VCFs", nr_variants, len(vcf_paths))
@@ -0,0 +1,149 @@
+import logging
+import struct
+import sys
+
+from array import array
+
+LOG = logging.getLogger(__name__)
+
+# Chromosome codes are 16 bit and positions 32 bit
+MAX_CHROMS = 1 << 16
+MAX_POS = (1 << 32) - 1
+
+SITE_TABLE_MAGIC = b'UPDSITE\x01'
+
+
+class SiteTable(object):
+    """Compact columnar storage of informative site calls
+
+    Positions and calls are kept in typed arrays and chromosome names are stored once, with a
+    code per site pointing into chroms. A site costs 7 bytes instead of a dictionary. A table
+    holds at most MAX_CHROMS chromosome names and positions up to MAX_POS, other sites raise a
+    ValueError.
+
+    Sites are appended in file order and iterating over the table yields site call dictionaries,
+    so it can be used wherever the output of get_UPD_informative_sites is.
+    """
+    def __init__(self, sites=None):
+        super(SiteTable, self).__init__()
+        self.chroms = []
+        self.chrom_codes = array('H')
+        self.pos = array('I')
+        self.calls = array('B')
+        self._codes = {}
+        if sites is not None:
+            self.extend(sites)
+
+    def chrom_code(self, chrom):
+        """Get the code of a chromosome name, adding it if it is new"""
+        code = self._codes.get(chrom)
+        if code is None:
+            code = len(self.chroms)
+            if code >= MAX_CHROMS:
+                raise ValueError(f"Chromosome {chrom} is one more than the {MAX_CHROMS} "
+                                 "chromosomes a site table holds")
+            self._codes[chrom] = code
+            self.chroms.append(chrom)
+        return code
+
+    def add(self, chrom, pos, call):
+        """Add a site
+
+        Args:
+            chrom (str)
+            pos (int)
+            call (int): One of the site call globals in upd.utils
+        """
+        code = self.chrom_code(chrom)
+        try:
+            self.pos.append(pos)
+        except OverflowError:
+            raise ValueError(f"Position {chrom}:{pos} is out of the range 0 to {MAX_POS} of a "
+                             "site table") from None
+        self.chrom_codes.append(code)
+        self.calls.append(call)
+
+    def append(self, site):
+        """Add a site call dictionary"""
+        self.add(site['chrom'], site['pos'], site['call'])
+
+    def extend(self, sites):
+        """Add site call dictionaries, or all sites of another SiteTable"""
+        if isinstance(sites, SiteTable):
+            codes = [self.chrom_code(chrom) for chrom in sites.chroms]
+            self.chrom_codes.extend(codes[code] for code in sites.chrom_codes)
+            self.pos.extend(sites.pos)
+            self.calls.extend(sites.calls)
+            return
+        for site in sites:
+            self.add(site['chrom'], site['pos'], site['call'])
+
+    @property
+    def nbytes(self):
+        """Number of bytes used by the site columns"""
+        return sum(len(column) * column.itemsize
+                   for column in (self.chrom_codes, self.pos, self.calls))
+
+    def write(self, handle):
+        """Write the table in a binary format
+
+        Args:
+            handle (file): A file opened in binary mode
+        """
+        names = '\x00'.join(self.chroms).encode('utf-8')
+        handle.write(SITE_TABLE_MAGIC)
+        handle.write(struct.pack('<II', len(names), len(self)))
+        handle.write(names)
+        for column in (self.chrom_codes, self.pos, self.calls):
+            if sys.byteorder == 'big':
+                column = array(column.typecode, column)
+                column.byteswap()
+            handle.write(column.tobytes())
+
+    @classmethod
+    def read(cls, handle):
+        """Read a table written by write
+
+        Args:
+            handle (file): A file opened in binary mode
+
+        Returns:
+            table (SiteTable)
+        """
+        if handle.read(len(SITE_TABLE_MAGIC)) != SITE_TABLE_MAGIC:
+            raise SyntaxError("Not a site table")
+        header = handle.read(8)
+        if len(header) != 8:
+            raise SyntaxError("Truncated site table")
+        names_len, nr_sites = struct.unpack('<II', header)
+        names = handle.read(names_len).decode('utf-8')
+
+        table = cls()
+        for chrom in names.split('\x00') if names else []:
+            table.chrom_code(chrom)
+        for column in (table.chrom_codes, table.pos, table.calls):
+            data = handle.read(nr_sites * column.itemsize)
+            if len(data) != nr_sites * column.itemsize:
+                raise SyntaxError("Truncated site table")
+            column.frombytes(data)
+            if sys.byteorder == 'big':
+                column.byteswap()
+        return table
+
+    def __len__(self):
+        return len(self.pos)
+
+    def __getitem__(self, idx):
+        return {
+            'chrom': self.chroms[self.chrom_codes[idx]],
+            'pos': self.pos[idx],
+            'call': self.calls[idx]
+        }
+
+    def __iter__(self):
+        chroms = self.chroms
+        for code, pos, call in zip(self.chrom_codes, self.pos, self.calls):
+            yield {'chrom': chroms[code], 'pos': pos, 'call': call}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} ({len(self)} sites)"
@@ -0,0 +1,501 @@
+"""Reading of tabix (.tbi) and coordinate sorted (.csi) indexes, and writing of indexed BED files"""
+import gzip
+import logging
+import os
+import struct
+
+from .bgzf import (BGZF_BLOCK_SIZE, BgzfWriter)
+
+LOG = logging.getLogger(__name__)
+
+TBI_MAGIC = b'TBI\x01'
+CSI_MAGIC = b'CSI\x01'
+
+# Tabix configuration of BED files: 0-based half open coordinates (TBX_UCSC) in the columns
+# chrom, start and end, header lines starting with #
+TBX_BED = (0x10000, 1, 2, 3, ord('#'), 0)
+
+# Number of characters of lines collected by a TabixWriter before they are compressed
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def reg2bins(beg, end, min_shift=14, depth=5):
+    """Get the bins that may hold records overlapping a region
+
+    Args:
+        beg (int): 0-based start of the region
+        end (int): 0-based exclusive end of the region
+        min_shift (int): Size of the smallest bin as a power of two
+        depth (int): Number of levels in the binning scheme
+
+    Returns:
+        bins (list(int))
+    """
+    bins = []
+    end -= 1
+    shift = min_shift + 3 * depth
+    first = 0
+    for level in range(depth + 1):
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+        shift -= 3
+        first += 1 << (3 * level)
+    return bins
+
+
+def reg2bin(beg, end, min_shift=14, depth=5):
+    """Get the smallest bin that holds a region
+
+    Args:
+        beg (int): 0-based start of the region
+        end (int): 0-based exclusive end of the region
+
+    Returns:
+        bin (int)
+    """
+    end -= 1
+    shift = min_shift
+    first = ((1 << (3 * depth)) - 1) // 7
+    for level in range(depth, 0, -1):
+        if beg >> shift == end >> shift:
+            return first + (beg >> shift)
+        shift += 3
+        first -= 1 << (3 * (level - 1))
+    return 0
+
+
+class TabixIndex(object):
+    """A binning index over a BGZF compressed file
+
+    Args:
+        names (list(str)): Sequence names in the order they appear in the file
+        bins (list(dict)): For each sequence, a dictionary from bin number to a list of chunks.
+                           A chunk is a (begin, end) tuple of virtual offsets.
+        min_shift (int): Size of the smallest bin as a power of two
+        depth (int): Number of levels in the binning scheme
+        linear (list(list)): For each sequence, the smallest virtual offset of a record in each
+                             window of the smallest bin size (.tbi)
+        loffsets (list(dict)): For each sequence, a dictionary from bin number to the smallest
+                               virtual offset of a record in the bin (.csi)
+    """
+    def __init__(self, names, bins, min_shift=14, depth=5, linear=None, loffsets=None):
+        super(TabixIndex, self).__init__()
+        self.names = names
+        self.bins = bins
+        self.min_shift = min_shift
+        self.depth = depth
+        self.linear = linear
+        self.loffsets = loffsets
+        self._ref_ids = {name: i for i, name in enumerate(names)}
+
+    @property
+    def pseudo_bin(self):
+        """Bin number used by htslib for per sequence metadata"""
+        return ((1 << (3 * (self.depth + 1))) - 1) // 7 + 1
+
+    @property
+    def max_pos(self):
+        """The largest position covered by the binning scheme"""
+        return 1 << (self.min_shift + 3 * self.depth)
+
+    def contig_offset(self, contig):
+        """Get the virtual offset of the first record of a sequence
+
+        Args:
+            contig (str)
+
+        Returns:
+            offset (int): Virtual offset, None if the sequence is not in the index
+        """
+        chunks = self.query(contig)
+        if not chunks:
+            return None
+        return chunks[0][0]
+
+    def _min_offset(self, ref_id, beg):
+        """Smallest virtual offset of a record that can overlap beg"""
+        if self.linear is not None:
+            offsets = self.linear[ref_id]
+            if not offsets:
+                return 0
+            return offsets[min(beg >> self.min_shift, len(offsets) - 1)]
+
+        if self.loffsets is not None:
+            loffsets = self.loffsets[ref_id]
+            bin_nr = ((1 << (3 * self.depth)) - 1) // 7 + (beg >> self.min_shift)
+            while bin_nr not in loffsets and bin_nr > 0:
+                bin_nr = (bin_nr - 1) >> 3
+            return loffsets.get(bin_nr, 0)
+
+        return 0
+
+    def query(self, contig, beg=0, end=None):
+        """Get the chunks of the file that hold the records overlapping a region
+
+        Args:
+            contig (str)
+            beg (int): 0-based start of the region
+            end (int): 0-based exclusive end of the region, None for the end of the sequence
+
+        Returns:
+            chunks (list(tuple)): Sorted, non overlapping (begin, end) virtual offsets
+        """
+        ref_id = self._ref_ids.get(contig)
+        if ref_id is None:
+            return []
+        if end is None or end > self.max_pos:
+            end = self.max_pos
+
+        ref_bins = self.bins[ref_id]
+        min_offset = self._min_offset(ref_id, beg)
+        chunks = sorted(
+            chunk
+            for bin_nr in reg2bins(beg, end, self.min_shift, self.depth) if bin_nr in ref_bins
+            for chunk in ref_bins[bin_nr] if chunk[1] > min_offset
+        )
+
+        merged = []
+        for chunk_beg, chunk_end in chunks:
+            if merged and chunk_beg <= merged[-1][1]:
+                if chunk_end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], chunk_end)
+                continue
+            merged.append((max(chunk_beg, min_offset), chunk_end))
+        return merged
+
+    def __contains__(self, contig):
+        return contig in self._ref_ids
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} ({len(self.names)} sequences)"
+
+
+def _parse_names(data, pos):
+    """Parse the tabix configuration and sequence names starting at pos
+
+    Returns:
+        names (list(str)), pos (int)
+    """
+    l_nm = struct.unpack_from('<7i', data, pos)[6]
+    pos += 28
+    names = [name.decode() for name in data[pos:pos+l_nm].split(b'\x00') if name]
+    return names, pos + l_nm
+
+
+def _parse_tbi(data):
+    """Parse the content of a .tbi file"""
+    n_ref = struct.unpack_from('<i', data, 4)[0]
+    names, pos = _parse_names(data, 8)
+    bins = []
+    linear = []
+    for _ in range(n_ref):
+        ref_bins = {}
+        n_bin = struct.unpack_from('<i', data, pos)[0]
+        pos += 4
+        for _ in range(n_bin):
+            bin_nr, n_chunk = struct.unpack_from('<Ii', data, pos)
+            pos += 8
+            offsets = struct.unpack_from(f'<{2*n_chunk}Q', data, pos)
+            pos += 16 * n_chunk
+            ref_bins[bin_nr] = list(zip(offsets[::2], offsets[1::2]))
+        n_intv = struct.unpack_from('<i', data, pos)[0]
+        pos += 4
+        linear.append(list(struct.unpack_from(f'<{n_intv}Q', data, pos)))
+        pos += 8 * n_intv
+        bins.append(ref_bins)
+
+    return TabixIndex(names, bins, linear=linear)
+
+
+def _parse_csi(data):
+    """Parse the content of a .csi file"""
+    min_shift, depth, l_aux = struct.unpack_from('<3i', data, 4)
+    pos = 16
+    names = []
+    if l_aux >= 28:
+        names, _ = _parse_names(data, pos)
+    pos += l_aux
+    n_ref = struct.unpack_from('<i', data, pos)[0]
+    pos += 4
+    bins = []
+    loffsets = []
+    for _ in range(n_ref):
+        ref_bins = {}
+        n_bin = struct.unpack_from('<i', data, pos)[0]
+        pos += 4
+        ref_loffsets = {}
+        for _ in range(n_bin):
+            bin_nr, loffset, n_chunk = struct.unpack_from('<IQi', data, pos)
+            pos += 16
+            offsets = struct.unpack_from(f'<{2*n_chunk}Q', data, pos)
+            pos += 16 * n_chunk
+            ref_bins[bin_nr] = list(zip(offsets[::2], offsets[1::2]))
+            ref_loffsets[bin_nr] = loffset
+        bins.append(ref_bins)
+        loffsets.append(ref_loffsets)
+
+    return TabixIndex(names, bins, min_shift, depth, loffsets=loffsets)
+
+
+def read_index(filename):
+    """Read a tabix or csi index
+
+    Args:
+        filename (str): Path to a .tbi or .csi file
+
+    Returns:
+        index (TabixIndex)
+    """
+    with gzip.open(filename, 'rb') as handle:
+        data = handle.read()
+
+    if data[:4] == TBI_MAGIC:
+        return _parse_tbi(data)
+    if data[:4] == CSI_MAGIC:
+        return _parse_csi(data)
+    raise SyntaxError(f"{filename} is not a tabix or csi index")
+
+
+def find_index(vcf_path):
+    """Find the index of a BGZF compressed VCF
+
+    Args:
+        vcf_path (str)
+
+    Returns:
+        index_path (str): Path to a .tbi or .csi index, None if there is none
+    """
+    for suffix in ['.tbi', '.csi']:
+        index_path = vcf_path + suffix
+        if os.path.exists(index_path):
+            return index_path
+    return None
+
+
+def write_tbi(index, filename, conf=TBX_BED):
+    """Write a tabix index
+
+    Args:
+        index (TabixIndex): An index with a linear index
+        filename (str): Path of the .tbi file
+        conf (tuple): Tabix configuration: format, sequence, start and end columns, meta
+                      character and number of lines to skip
+    """
+    names = b''.join(name.encode() + b'\x00' for name in index.names)
+    parts = [TBI_MAGIC, struct.pack('<i', len(index.names)), struct.pack('<6i', *conf),
+             struct.pack('<i', len(names)), names]
+    for ref_bins, linear in zip(index.bins, index.linear):
+        parts.append(struct.pack('<i', len(ref_bins)))
+        for bin_nr in sorted(ref_bins):
+            chunks = ref_bins[bin_nr]
+            parts.append(struct.pack('<Ii', bin_nr, len(chunks)))
+            parts.append(struct.pack(f'<{2*len(chunks)}Q', *(off for chunk in chunks
+                                                              for off in chunk)))
+        parts.append(struct.pack('<i', len(linear)))
+        parts.append(struct.pack(f'<{len(linear)}Q', *linear))
+
+    with BgzfWriter(filename) as writer:
+        writer.write(b''.join(parts))
+
+
+class TabixIndexer(object):
+    """Build a tabix index from records given in file order
+
+    Records have to be sorted: all records of a sequence together, by start within a sequence.
+    """
+    def __init__(self, min_shift=14, depth=5):
+        super(TabixIndexer, self).__init__()
+        self.min_shift = min_shift
+        self.depth = depth
+        self.names = []
+        self.bins = []
+        self.linear = []
+        self.unsorted = None
+        self._last_beg = 0
+
+    def add(self, contig, beg, end, offset, end_offset):
+        """Add a record
+
+        Args:
+            contig (str)
+            beg (int): 0-based start of the record
+            end (int): 0-based exclusive end of the record
+            offset (int): Virtual offset of the start of the record
+            end_offset (int): Virtual offset of the end of the record
+
+        Returns:
+            bool: False if the record is out of order, the index is unusable then
+        """
+        return self.add_records([(contig, beg, end, offset, end_offset)])
+
+    def add_records(self, records):
+        """Add records, see add
+
+        Args:
+            records (iterable(tuple)): (contig, beg, end, offset, end_offset)
+
+        Returns:
+            bool: False if a record is out of order, the index is unusable then
+        """
+        if self.unsorted:
+            return False
+        min_shift = self.min_shift
+        leaf_first = ((1 << (3 * self.depth)) - 1) // 7
+        contig = self.names[-1] if self.names else None
+        bins = self.bins[-1] if self.bins else None
+        linear = self.linear[-1] if self.linear else None
+        last_beg = self._last_beg
+
+        for chrom, beg, end, offset, end_offset in records:
+            if chrom != contig:
+                if chrom in self.names:
+                    self.unsorted = f"{chrom} is not in one block"
+                    return False
+                contig = chrom
+                bins = {}
+                linear = []
+                self.names.append(contig)
+                self.bins.append(bins)
+                self.linear.append(linear)
+                last_beg = 0
+            elif beg < last_beg:
+                self.unsorted = f"{chrom}:{beg + 1} is not sorted"
+                return False
+            last_beg = beg
+            if end <= beg:
+                end = beg + 1
+
+            window = beg >> min_shift
+            last_window = (end - 1) >> min_shift
+            if window == last_window:
+                bin_nr = leaf_first + window
+            else:
+                bin_nr = reg2bin(beg, end, min_shift, self.depth)
+            chunks = bins.get(bin_nr)
+            if chunks is None:
+                bins[bin_nr] = [(offset, end_offset)]
+            elif chunks[-1][1] == offset:
+                chunks[-1] = (chunks[-1][0], end_offset)
+            else:
+                chunks.append((offset, end_offset))
+
+            # Records come by start, so only windows past the covered ones are new
+            nr_windows = len(linear)
+            if last_window >= nr_windows:
+                if window > nr_windows:
+                    linear.extend([None] * (window - nr_windows))
+                    nr_windows = window
+                linear.extend([offset] * (last_window + 1 - nr_windows))
+
+        self._last_beg = last_beg
+        return True
+
+    def index(self):
+        """The index of the records added so far
+
+        Returns:
+            index (TabixIndex)
+        """
+        linear = []
+        for ref_linear in self.linear:
+            offsets = []
+            previous = 0
+            for offset in ref_linear:
+                previous = previous if offset is None else offset
+                offsets.append(previous)
+            linear.append(offsets)
+        return TabixIndex(list(self.names), [dict(ref_bins) for ref_bins in self.bins],
+                          self.min_shift, self.depth, linear=linear)
+
+
+def _bed_records(data, block_offsets, within):
+    """Get the records of BED lines written to consecutive BGZF blocks
+
+    Args:
+        data (bytes): Complete lines
+        block_offsets (list(int)): Offsets of the blocks data was written to
+        within (int): Offset of data within the first block
+
+    Yields:
+        record (tuple): (contig, beg, end, offset, end_offset), see TabixIndexer.add
+    """
+    pos = within
+    for line in data.split(b'\n')[:-1]:
+        start = pos
+        pos += len(line) + 1
+        if line.startswith(b'#') or not line.strip():
+            continue
+        fields = line.split(b'\t', 3)
+        try:
+            chrom, beg, end = fields[0].decode(), int(fields[1]), int(fields[2])
+        except (IndexError, ValueError):
+            raise SyntaxError(f"Malformed BED line: {line.decode(errors='replace')}")
+        yield (chrom, beg, end,
+               (block_offsets[start // BGZF_BLOCK_SIZE] << 16) | (start % BGZF_BLOCK_SIZE),
+               (block_offsets[pos // BGZF_BLOCK_SIZE] << 16) | (pos % BGZF_BLOCK_SIZE))
+
+
+class TabixWriter(object):
+    """Write BED lines to a BGZF compressed file with a tabix index
+
+    Used like a text file. Lines are collected and compressed in batches, and indexed from their
+    first three columns. The index is written next to the file, with the .tbi suffix, on close.
+    Header lines starting with # are written but not indexed. If the lines are not sorted, no
+    index is written.
+
+    Args:
+        filename (str): Path of the compressed file
+        level (int): zlib compression level
+    """
+    def __init__(self, filename, level=6):
+        super(TabixWriter, self).__init__()
+        self.filename = filename
+        self.index_path = filename + '.tbi'
+        self.indexer = TabixIndexer()
+        self._writer = BgzfWriter(filename, level)
+        self._pending = []
+        self._pending_size = 0
+
+    def write(self, text):
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if self._pending_size >= WRITE_BUFFER_SIZE:
+            self._write_lines()
+
+    def _write_lines(self):
+        """Compress and index the complete lines collected so far"""
+        text = ''.join(self._pending)
+        end = text.rfind('\n') + 1
+        self._pending = [text[end:]] if end < len(text) else []
+        self._pending_size = len(text) - end
+
+        data = text[:end].encode('utf-8')
+        within = self._writer.tell() & 0xFFFF
+        block_offsets = self._writer.write(data)
+        if not self.indexer.unsorted:
+            self.indexer.add_records(_bed_records(data, block_offsets, within))
+
+    def close(self):
+        if self._writer is None:
+            return
+        if self._pending_size:
+            # End the last line
+            if not ''.join(self._pending).endswith('\n'):
+                self._pending.append('\n')
+            self._write_lines()
+        self._writer.close()
+        self._writer = None
+        if self.indexer.unsorted:
+            LOG.warning("Not indexing %s, %s", self.filename, self.indexer.unsorted)
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            return
+        write_tbi(self.indexer.index(), self.index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} ({self.filename})"
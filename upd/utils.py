@@ -1,6 +1,13 @@
 import logging
 
-from .vcf_tools import get_pop_AF
+from array import array
+
+from .vcf_tools import build_af_extractor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 LOG = logging.getLogger(__name__)
 
@@ -11,6 +18,9 @@ ANTI_UPD            = 3
 PB_HOMOZYGOUS       = 4
 PB_HETEROZYGOUS     = 5
 
+# Reasons a variant is not used. no_call sites are kept as UNINFORMATIVE
+DROP_REASONS = ['non_snp', 'af', 'gq', 'no_call']
+
 
 def upd_site_call(gt_pb, gt_mo, gt_fa):
     """Call UPD informative sites
@@ -53,8 +63,50 @@ def upd_site_call(gt_pb, gt_mo, gt_fa):
     return UNINFORMATIVE
 
 
+def _site_call_table():
+    """Tabulate upd_site_call for every combination of genotype codes
+    
+    The call of proband, mother and father genotypes is at index gt_pb*16 + gt_mo*4 + gt_fa.
+    
+    Returns:
+        table (bytes): 256 bytes, indexes above 63 are UNINFORMATIVE
+    """
+    table = bytearray(256)
+    for gt_pb in range(4):
+        for gt_mo in range(4):
+            for gt_fa in range(4):
+                table[gt_pb*16 + gt_mo*4 + gt_fa] = upd_site_call(gt_pb, gt_mo, gt_fa)
+    return bytes(table)
+
+SITE_CALL_TABLE = _site_call_table()
+
+
+def upd_site_calls(gt_pb, gt_mo, gt_fa):
+    """Call UPD informative sites for many sites at once
+    
+    A table lookup of upd_site_call. With numpy installed and numpy arrays given, the lookup is 
+    one vectorized operation.
+    
+    Args:
+        gt_pb (sequence(int)): Genotypes of proband as integers
+        gt_mo (sequence(int)): Genotypes of mother as integers
+        gt_fa (sequence(int)): Genotypes of father as integers
+    
+    Returns:
+        site_calls (numpy.ndarray or array.array): Call codes as unsigned bytes
+    """
+    if np is not None and isinstance(gt_pb, np.ndarray):
+        table = np.frombuffer(SITE_CALL_TABLE, dtype=np.uint8)
+        idx = (np.asarray(gt_pb, dtype=np.uint8) << 4) | (np.asarray(gt_mo, dtype=np.uint8) << 2)
+        return table[idx | np.asarray(gt_fa, dtype=np.uint8)]
+
+    idx = bytes(pb*16 + mo*4 + fa for pb, mo, fa in zip(gt_pb, gt_mo, gt_fa))
+    return array('B', idx.translate(SITE_CALL_TABLE))
+
+
 def get_UPD_informative_sites(vcf, csq_fields, proband, mother, father, min_af=0.05, 
-                              af_tag='MAX_AF', min_gq=30):
+                              af_tag='MAX_AF', min_gq=30, regions=None, all_transcripts=False,
+                              metrics=None):
     """Get UPD calls for each informative SNP above given pop freq
     
     Args:
@@ -67,6 +119,11 @@ def get_UPD_informative_sites(vcf, csq_fields, proband, mother, father, min_af=0
         proband (str): ID of proband in VCF
         mother (str): ID of mother in VCF
         father (str): ID of father in VCF
+        regions (list(tuple)): Only check the variants in these regions, needs an indexed VCF. 
+                               (chrom, start, end) with 0-based start and exclusive end
+        all_transcripts (bool): Use the highest frequency of all VEP transcripts
+        metrics (upd.metrics.Metrics): Time the parse and filter stages and count why variants 
+                                       were dropped
         
     Yields:
         site_calls (dict): A generator with dictionaries that describes the variant.
@@ -80,63 +137,179 @@ def get_UPD_informative_sites(vcf, csq_fields, proband, mother, father, min_af=0
     father_idx  = sids.index(father)
     
     nr_informative = 0
-    
-    for i,var in enumerate(vcf,1):
-    
-        # Raise error if multi-allelic site
-        if len(var.ALT) > 1:
-            raise SystemExit('ERROR: Split your variants!')
+    drops = dict.fromkeys(DROP_REASONS, 0)
+    af_key = 'CSQ' if csq_fields else af_tag
+    extract_af = build_af_extractor(csq_fields, af_tag, all_transcripts)
 
+    def drop_reason(var):
         # Skip non-SNPs
         if not var.is_snp:
-            continue
-        
+            return 'non_snp'
         # Skip variants with population frequency < threshold
-        if min_af > get_pop_AF(var, csq_fields, af_tag):
-            continue
-        
-        # Skip variants where any individual has GQ < threshold
+        if min_af > extract_af(var.get_info(af_key)):
+            return 'af'
+        # Skip variants where any parsed individual, the trio with get_vcf, has GQ < threshold
         if not all(gq >= min_gq for gq in var.gt_quals):
+            return 'gq'
+        return None
+
+    variants = vcf
+    if regions:
+        variants = vcf.query(regions)
+    if metrics:
+        variants = metrics.track(variants)
+        drop_reason = metrics.timed_call('filter', drop_reason)
+
+    for var in variants:
+    
+        # Raise error if multi-allelic site
+        if len(var.ALT) > 1:
+            raise SystemExit('ERROR: Split your variants!')
+
+        reason = drop_reason(var)
+        if reason:
+            drops[reason] += 1
             continue
 
         gt = var.gt_types
-        pos_call = upd_site_call(gt[proband_idx], gt[mother_idx], gt[father_idx])
+        pos_call = SITE_CALL_TABLE[gt[proband_idx]*16 + gt[mother_idx]*4 + gt[father_idx]]
+        if metrics and 2 in (gt[proband_idx], gt[mother_idx], gt[father_idx]):
+            drops['no_call'] += 1
         
         nr_informative += 1
         yield {'chrom':var.CHROM, 'pos':var.POS, 'call':pos_call}
     
-    LOG.info("%s variants in vcf", i)
+    if metrics:
+        metrics.update_counters(drops)
+    LOG.debug("Variants dropped: %s", drops)
+
+    if regions:
+        LOG.debug("%s variants in %s regions", vcf.nr_variants, len(regions))
+        LOG.debug("%s informative variants found in %s regions", nr_informative, len(regions))
+        return
+
+    LOG.info("%s variants in vcf", vcf.nr_variants)
     LOG.info("%s informative variants found", nr_informative)
 
-def call_regions(sites):
-    """Yields called regions
+def get_UPD_informative_sites_trios(vcf, csq_fields, trios, min_af=0.05, af_tag='MAX_AF', 
+                                    min_gq=30, regions=None, all_transcripts=False, metrics=None):
+    """Get UPD calls for several trios in one pass over a VCF
+    
+    Works like get_UPD_informative_sites, but the GQ filter is applied per trio and only to the 
+    three individuals of the trio.
+    
+    Args:
+        vcf (upd.vcf_tools.Vcf)
+        csq_fields (list): describes VEP annotation
+        trios (list(tuple)): (proband, mother, father) IDs in VCF for each trio
+        min_af (float): Minimum allele frequency to consider SNP
+        af_tag (str): Key to AF in annotation
+        min_gq (int): Minimum GQ to consider variant
+        regions (list(tuple)): Only check the variants in these regions, needs an indexed VCF
+        all_transcripts (bool): Use the highest frequency of all VEP transcripts
+        metrics (upd.metrics.Metrics): Time the parse and filter stages and count why variants 
+                                       were dropped. GQ and no-call drops are counted per trio
+        
+    Yields:
+        trio_nr, site_call (int, dict): Index of the trio in trios and the site call
+    """
+    sids = vcf.samples
+    trio_idxs = [
+        (sids.index(proband), sids.index(mother), sids.index(father)) 
+        for proband, mother, father in trios
+    ]
+    nr_informative = [0] * len(trios)
+    drops = dict.fromkeys(DROP_REASONS, 0)
+    af_key = 'CSQ' if csq_fields else af_tag
+    extract_af = build_af_extractor(csq_fields, af_tag, all_transcripts)
+
+    def drop_reason(var):
+        # Skip non-SNPs
+        if not var.is_snp:
+            return 'non_snp'
+        # Skip variants with population frequency < threshold
+        if min_af > extract_af(var.get_info(af_key)):
+            return 'af'
+        return None
+
+    variants = vcf
+    if regions:
+        variants = vcf.query(regions)
+    if metrics:
+        variants = metrics.track(variants)
+        drop_reason = metrics.timed_call('filter', drop_reason)
+
+    for var in variants:
+
+        # Raise error if multi-allelic site
+        if len(var.ALT) > 1:
+            raise SystemExit('ERROR: Split your variants!')
+
+        reason = drop_reason(var)
+        if reason:
+            drops[reason] += 1
+            continue
+        
+        gt = var.gt_types
+        gq = var.gt_quals
+        for trio_nr, (proband_idx, mother_idx, father_idx) in enumerate(trio_idxs):
+            # Skip trios where any individual has GQ < threshold
+            if gq[proband_idx] < min_gq or gq[mother_idx] < min_gq or gq[father_idx] < min_gq:
+                drops['gq'] += 1
+                continue
+            
+            pos_call = SITE_CALL_TABLE[gt[proband_idx]*16 + gt[mother_idx]*4 + gt[father_idx]]
+            if metrics and 2 in (gt[proband_idx], gt[mother_idx], gt[father_idx]):
+                drops['no_call'] += 1
+            nr_informative[trio_nr] += 1
+            yield trio_nr, {'chrom':var.CHROM, 'pos':var.POS, 'call':pos_call}
+
+    if metrics:
+        metrics.update_counters(drops)
+    LOG.debug("Variants dropped: %s", drops)
+
+    LOG.info("%s variants in vcf", vcf.nr_variants)
+    for (proband, _, _), nr_trio in zip(trios, nr_informative):
+        LOG.info("%s informative variants found for %s", nr_trio, proband)
+
+class RegionCaller(object):
+    """Incremental UPD region caller
     
     A putative_call is a collection of information from the variants in a upd region. 
     The call is started if there are variants that indicates UPD maternal or paternal origin. When 
     a anti upd site is encountered or the chromosome ends the call returned.
-    
-    Args:
-        sites (iterable(dict))
 
-    Yields:
-        putative_call (dict): UPD informative region 
+    Sites are added one at a time in file order, so several callers can be fed from one pass 
+    over a VCF.
     """
     opposite = {UPD_MATERNAL_ORIGIN:UPD_PATERNAL_ORIGIN, UPD_PATERNAL_ORIGIN:UPD_MATERNAL_ORIGIN}
-    calls = []
-    putative_call = None
-    prev = None
-    last_seen_anti = {'chrom':'0', 'pos':0}
-    
-    for c in sites:
-        if prev and (c['chrom'] != prev['chrom']):
-            LOG.info("Chromosome %s checked", prev['chrom'])
+
+    def __init__(self):
+        super(RegionCaller, self).__init__()
+        self.putative_call = None
+        self.prev = None
+        self.last_seen_anti = {'chrom':'0', 'pos':0}
+
+    def add(self, c):
+        """Add the next site
+        
+        Args:
+            c (dict): A site call
+        
+        Returns:
+            putative_call (dict): The region closed by this site, None if no region was closed
+        """
+        prev = self.prev
+        self.prev = c
+        putative_call = self.putative_call
+
         if not putative_call:
             # Create new putative call if UPD informative position
             if c["call"] in [UPD_MATERNAL_ORIGIN, UPD_PATERNAL_ORIGIN]:
-                putative_call = {
+                self.putative_call = {
                     'call':c['call'],
                     'chrom':c['chrom'],
-                    'start_lo':last_seen_anti['pos'],
+                    'start_lo':self.last_seen_anti['pos'],
                     'start_hi':c['pos'],
                     'end_lo':c['pos'],
                     'end_hi':c['pos'],
@@ -149,10 +322,9 @@ def call_regions(sites):
 
             # Save last positive which is definately not in UPD region
             if c["call"] == ANTI_UPD or not prev or c['chrom'] != prev['chrom']:
-                last_seen_anti = {'chrom':c['chrom'], 'pos':c['pos']}
+                self.last_seen_anti = {'chrom':c['chrom'], 'pos':c['pos']}
 
-            prev = c
-            continue
+            return None
 
         # If an anti-UPD site or end of chromosome => close the putative call
         if c["call"] == ANTI_UPD or c['chrom'] != putative_call['chrom']:
@@ -161,12 +333,9 @@ def call_regions(sites):
             else:
                 putative_call['end_hi'] = prev['pos']
             
-            yield putative_call
-            
-            last_seen_anti = {'chrom': c['chrom'], 'pos': c['pos']}      
-            putative_call = None
-            prev = c
-            continue
+            self.last_seen_anti = {'chrom': c['chrom'], 'pos': c['pos']}      
+            self.putative_call = None
+            return putative_call
 
         # If site call is same as putative call => extend the putative region
         if c['call'] == putative_call['call']:
@@ -179,16 +348,158 @@ def call_regions(sites):
         if c['call'] == PB_HETEROZYGOUS:
             putative_call['het_sites'] += 1
                     
-        # If site call is opposite (maternal<->paternal), count it. (This pretty much never happens?)
-        if c['call'] == opposite[putative_call['call']]:
+        # If site call is opposite (maternal<->paternal), count it.
+        # (This pretty much never happens?)
+        if c['call'] == self.opposite[putative_call['call']]:
             putative_call['opposites'] += 1
 
         # Count total number of SNPs in the call region
         putative_call['tot'] += 1
 
+        return None
+
+    def finish(self):
+        """Close the last region
+        
+        Returns:
+            putative_call (dict): The open region, None if there is none
+        """
+        putative_call = self.putative_call
+        self.putative_call = None
+        return putative_call
+
+
+def call_regions(sites):
+    """Yields called regions
+    
+    See RegionCaller for how regions are called.
+    
+    Args:
+        sites (iterable(dict))
+
+    Yields:
+        putative_call (dict): UPD informative region 
+    """
+    caller = RegionCaller()
+    prev = None
+    
+    for c in sites:
+        if prev and (c['chrom'] != prev['chrom']):
+            LOG.info("Chromosome %s checked", prev['chrom'])
+        putative_call = caller.add(c)
+        if putative_call:
+            yield putative_call
         prev = c
 
-    LOG.info("Chromosome %s checked", prev['chrom'])
+    if prev:
+        LOG.info("Chromosome %s checked", prev['chrom'])
 
+    putative_call = caller.finish()
     if putative_call:
-        yield putative_call
\ No newline at end of file
+        yield putative_call
+
+
+def call_regions_table(table):
+    """Yields called regions of a SiteTable, segmenting all sites at once
+    
+    Gives the same regions as call_regions. The sites are split into segments at ANTI_UPD sites
+    and chromosome changes. A region opens at the first UPD site of a segment and is closed by 
+    the site starting the next segment, which can not open a region itself. The counts of each 
+    region are then taken from cumulative sums over the site arrays.
+    
+    Needs numpy, without it the sites are passed to call_regions.
+    
+    Args:
+        table (upd.site_table.SiteTable)
+
+    Yields:
+        putative_call (dict): UPD informative region 
+    """
+    if np is None:
+        yield from call_regions(table)
+        return
+
+    nr_sites = len(table)
+    if not nr_sites:
+        return
+    chrom = np.frombuffer(table.chrom_codes, dtype=np.uint16)
+    pos = np.frombuffer(table.pos, dtype=np.uint32).astype(np.int64)
+    call = np.frombuffer(table.calls, dtype=np.uint8)
+    idx = np.arange(nr_sites)
+
+    # Segments start at the first site, at ANTI_UPD sites and at chromosome changes
+    is_start = call == ANTI_UPD
+    is_start[0] = True
+    is_start[1:] |= chrom[1:] != chrom[:-1]
+    starts = np.flatnonzero(is_start)
+    ends = np.append(starts[1:], nr_sites)
+
+    is_upd = (call == UPD_MATERNAL_ORIGIN) | (call == UPD_PATERNAL_ORIGIN)
+    # Index of the first UPD site at or after each site, nr_sites if there is none
+    next_upd = np.append(np.where(is_upd, idx, nr_sites), nr_sites)
+    next_upd = np.minimum.accumulate(next_upd[::-1])[::-1]
+    first_inner = next_upd[starts + 1]
+    has_inner = first_inner < ends
+    first_upd = is_upd[starts]
+
+    # A segment starting with its only UPD site opens a region unless the site closes the region
+    # of the previous segment. Runs of such segments alternate, starting from the last segment 
+    # that is decided by its other sites
+    chained = first_upd & ~has_inner
+    decided = np.maximum.accumulate(np.where(chained, -1, np.arange(len(starts))))
+    prev_opened = np.where(decided >= 0, has_inner[np.maximum(decided, 0)], False)
+    run_nr = np.arange(len(starts)) - decided - 1
+    opened = np.where(chained, np.where(run_nr % 2 == 0, ~prev_opened, prev_opened), has_inner)
+
+    prev_segment_opened = np.append(False, opened[:-1])
+    opens_at_start = first_upd & ~prev_segment_opened
+    segments = np.flatnonzero(opened)
+    opener = np.where(opens_at_start, starts, first_inner)[segments]
+    start = starts[segments]
+    end = ends[segments]
+
+    # Last position outside a region before the opening site
+    prev_start_pos = np.append(0, pos[starts[:-1]])[segments]
+    start_lo = np.where(opener > start, pos[start], prev_start_pos)
+    
+    closed = end < nr_sites
+    closing = np.minimum(end, nr_sites - 1)
+    end_hi = np.where(call[closing] == ANTI_UPD, pos[closing] - 1, pos[end - 1])
+    end_hi = np.where(closed, end_hi, pos[opener])
+
+    def counts(mask):
+        cumulative = np.append(0, np.cumsum(mask))
+        return cumulative[end] - cumulative[opener + 1]
+
+    def last(mask):
+        return np.maximum.accumulate(np.where(mask, idx, -1))[end - 1]
+
+    upd_call = call[opener]
+    is_maternal = upd_call == UPD_MATERNAL_ORIGIN
+    maternal = counts(call == UPD_MATERNAL_ORIGIN)
+    paternal = counts(call == UPD_PATERNAL_ORIGIN)
+    run_len = 1 + np.where(is_maternal, maternal, paternal)
+    opposites = np.where(is_maternal, paternal, maternal)
+    end_lo = pos[np.where(is_maternal, last(call == UPD_MATERNAL_ORIGIN),
+                          last(call == UPD_PATERNAL_ORIGIN))]
+    hom_sites = 1 + counts(call == PB_HOMOZYGOUS)
+    het_sites = counts(call == PB_HETEROZYGOUS)
+    tot = end - opener
+
+    chroms = table.chroms
+    for row in zip(upd_call.tolist(), chrom[opener].tolist(), start_lo.tolist(), 
+                   pos[opener].tolist(), end_lo.tolist(), end_hi.tolist(), run_len.tolist(),
+                   opposites.tolist(), hom_sites.tolist(), het_sites.tolist(), tot.tolist()):
+        yield {
+            'call': row[0],
+            'chrom': chroms[row[1]],
+            'start_lo': row[2],
+            'start_hi': row[3],
+            'end_lo': row[4],
+            'end_hi': row[5],
+            'run_len': row[6],
+            'opposites': row[7],
+            'hom_sites': row[8],
+            'het_sites': row[9],
+            'tot': row[10]
+        }
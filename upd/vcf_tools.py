@@ -1,60 +1,167 @@
 import logging
 import gzip
+import io
 import re
+import sys
 
 from codecs import (open, getreader)
 from pprint import pprint as pp
 
+from .bgzf import (BgzfReader, is_bgzf, is_bgzf_header)
+from .tabix import (find_index, read_index)
+from .bed_utils import (parse_region, merge_regions)
+
 LOG = logging.getLogger(__name__)
 
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def open_file(filename, threads=1):
+    """Open a file and return a iterable with lines
+    
+    Compression is detected from the first bytes of the file. BGZF compressed files are read 
+    block by block, inflating the blocks on threads. A filename of '-' reads from stdin. Instead 
+    of a filename, a binary or text file object can be given.
+    """
+    name = filename
+    if isinstance(filename, io.TextIOBase):
+        return filename
+    if not isinstance(filename, str) or filename == '-':
+        name = getattr(filename, 'name', 'stream')
+        stream = filename
+        if filename == '-':
+            name = 'stdin'
+            stream = sys.stdin.buffer
+        if not hasattr(stream, 'peek'):
+            stream = io.BufferedReader(stream)
+        header = stream.peek(18)[:18]
+    else:
+        stream = None
+        with io.open(filename, 'rb') as handle:
+            header = handle.read(18)
 
-def open_file(filename):
-    """Open a file and return a iterable with lines"""
-    if filename.endswith('.gz'):
-        LOG.info(f"{filename} is zipped")
-        handle = getreader('utf-8')(gzip.open(filename), errors='replace')
+    if is_bgzf_header(header):
+        LOG.info(f"{name} is bgzipped")
+        handle = BgzfReader(stream or filename, threads=threads)
+    elif header[:2] == GZIP_MAGIC:
+        LOG.info(f"{name} is zipped")
+        handle = getreader('utf-8')(gzip.open(stream or filename), errors='replace')
+    elif stream:
+        handle = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
     else:
         handle = open(filename, mode='r', encoding='utf-8', errors='replace')
 
     return handle
 
 
+def get_info_value(info, key, default=None):
+    """Get the value of a single key from a raw VCF INFO string
+    
+    Args:
+        info (str): Raw vcf info string
+        key (str): The INFO key to look up
+        default: Returned if key is not present
+    
+    Returns:
+        value (str or bool): The raw value, True for flags
+    """
+    if info == '.':
+        return default
+    
+    key_len = len(key)
+    start = 0
+    while True:
+        idx = info.find(key, start)
+        if idx == -1:
+            return default
+        end = idx + key_len
+        if idx == 0 or info[idx-1] == ';':
+            if end == len(info) or info[end] == ';':
+                return True
+            if info[end] == '=':
+                stop = info.find(';', end)
+                if stop == -1:
+                    return info[end+1:]
+                return info[end+1:stop]
+        start = end
+
+
 class Variant(object):
     """Implements a Variant class for VCF variants
     
     gt_types: 0=HOM_REF, 1=HET, 3=HOM_ALT, 2=other
+
+    The INFO dictionary is built lazily the first time it is accessed. Use get_info to look up a
+    single key straight from the raw INFO string.
+
+    Args:
+        variant_line (str)
+        sample_columns (list(int)): Only parse the genotypes in these columns, in this order. The 
+                                    line is only split up to the last of them
+        layouts (dict): Cache of the GT and GQ positions of each FORMAT string, shared between 
+                        variants
     """
-    def __init__(self, variant_line):
+    def __init__(self, variant_line, sample_columns=None, layouts=None):
         super(Variant, self).__init__()
         self.variant_line = variant_line
+        self._sample_columns = sample_columns
+        self._layouts = {} if layouts is None else layouts
         self.CHROM = None
         self.POS = None
-        self.INFO = {}
         self.ALT = None
         self.is_snp = True
         self.gt_quals = []
         self.gt_types = []
+        self._raw_info = '.'
+        self._info = None
         self._initialize()
     
     def _initialize(self):
-        splitted_line = self.variant_line.split('\t')
+        if self._sample_columns:
+            splitted_line = self.variant_line.split('\t', max(self._sample_columns) + 1)
+        else:
+            splitted_line = self.variant_line.split('\t')
         self.CHROM = splitted_line[0]
         self.POS = int(splitted_line[1])
         self.ALT = splitted_line[4].split(',')
         if len(splitted_line[3]) != len(splitted_line[4]):
             self.is_snp = False
-        self.INFO = self._build_info(splitted_line[7])
+        self._raw_info = splitted_line[7]
         
         if not len(splitted_line) > 8:
             return
         
         self.gt_quals, self.gt_types = self._build_gt(splitted_line)
+
+    @property
+    def INFO(self):
+        """The INFO column as a dictionary, built on first access"""
+        if self._info is None:
+            self._info = self._build_info(self._raw_info)
+        return self._info
+
+    def get_info(self, key, default=None):
+        """Get the value of a single INFO key
+        
+        Searches the raw INFO string for key without building the full INFO dictionary.
+        
+        Args:
+            key (str): The INFO key to look up
+            default: Returned if key is not present
+        
+        Returns:
+            value (str or bool): The raw value, True for flags
+        """
+        if self._info is not None:
+            return self._info.get(key, default)
+
+        return get_info_value(self._raw_info, key, default)
     
     def _build_gt(self, var_info):
         """Build the genotype information
         
-        Collapse the FORMAT information from the 8th column with each individual genotype 
-        information. Then retrieve the genotype call and genotype quality
+        Look up the positions of GT and GQ in the FORMAT column, then retrieve the genotype call 
+        and genotype quality of each individual
         
         Args:
              var_info (list): A splited variant line
@@ -67,35 +174,43 @@ class Variant(object):
         gt_types = []
         gt_quals = []
         
-        form = var_info[8].split(':')
-        for ind_info in var_info[9:]:
-            gt_info = dict(zip(form, ind_info.split(':')))
+        layout = self._layouts.get(var_info[8])
+        if layout is None:
+            keys = {key: idx for idx, key in enumerate(var_info[8].split(':'))}
+            layout = self._layouts[var_info[8]] = (keys.get('GT'), keys.get('GQ'))
+        gt_idx, gq_idx = layout
+
+        columns = self._sample_columns or range(9, len(var_info))
+        for column in columns:
+            ind_info = var_info[column].split(':')
             gq = 0
-            try:
-                gq = int(gt_info.get('GQ',0))
-            except Exception as err:
-                pass
+            if gq_idx is not None and gq_idx < len(ind_info):
+                try:
+                    gq = int(ind_info[gq_idx])
+                except ValueError:
+                    pass
             gt_quals.append(gq)
-            genotype = gt_info.get('GT','./.')
-            if not genotype in gt_map:
-                gt_types.append(2)
-                continue
-            gt_types.append(gt_map[genotype])
+            genotype = './.'
+            if gt_idx is not None and gt_idx < len(ind_info):
+                genotype = ind_info[gt_idx]
+            gt_types.append(gt_map.get(genotype, 2))
         
         return gt_quals, gt_types
 
     def _build_info(self, info):
-        """Build a info dictionary from a info str and set self.INFO
+        """Build a info dictionary from a info str
         
         Args:
             info (str): Raw vcf info string
         
+        Returns:
+            info_dict (dict)
         """
         info_dict = {}
         if info == '.':
             return info_dict
         for value in info.split(';'):
-            vals = value.split('=')
+            vals = value.split('=', 1)
             if not len(vals) == 2:
                 info_dict[vals[0]] = True
                 continue
@@ -128,14 +243,34 @@ class HREC(object):
         
 
 class Vcf(object):
-    """Implements a simple vcf parser that mimics parts of cyvcf2.VCF"""
-    def __init__(self, variant_file):
+    """Implements a simple vcf parser that mimics parts of cyvcf2.VCF
+    
+    If a prefilter is set, every raw variant line is passed to it before a Variant is built and
+    lines it rejects are skipped. nr_variants counts all variant lines read, nr_skipped the ones
+    rejected by the prefilter.
+
+    If the file is BGZF compressed and an index is set, calling the object with a region 
+    iterates over the variants of that region only.
+
+    After select_samples, only the genotypes of the selected samples are parsed and samples 
+    holds the selected samples, so indexes into it match gt_types and gt_quals.
+    """
+    def __init__(self, variant_file, prefilter=None, index=None):
         super(Vcf, self).__init__()
+        self._handle = variant_file
         self.variant_file = iter(variant_file)
+        self.index = index
         self.raw_header = []
         self.samples = []
+        self.all_samples = []
+        self.sample_idxs = None
+        self.prefilter = prefilter
+        self.nr_variants = 0
+        self.nr_skipped = 0
         self._current_variant = None
         self._header_keys = set()
+        self._sample_columns = None
+        self._layouts = {}
         self._initialize()
     
     def _initialize(self):
@@ -153,9 +288,20 @@ class Vcf(object):
                     splitted_line = line.split('\t')
                     if not len(splitted_line) > 9:
                         raise SyntaxError("No individuals in VCF")
-                    self.samples = splitted_line[9:]
+                    self.all_samples = splitted_line[9:]
+                    self.samples = list(self.all_samples)
         self._current_variant = line
 
+    def select_samples(self, samples):
+        """Only parse the genotypes of some samples
+
+        Args:
+            samples (list(str)): Sample IDs in the header, gt_types follows this order
+        """
+        self.samples = list(samples)
+        self.sample_idxs = [self.all_samples.index(sample) for sample in self.samples]
+        self._sample_columns = [9 + idx for idx in self.sample_idxs]
+
     def contains(self, key):
         """Check if the header contains key"""
         if not self._header_keys:
@@ -191,13 +337,132 @@ class Vcf(object):
                                         match.group('type'), match.group('desc'))
                 yield header_record
     
+    def _next_line(self):
+        """Return the next non-empty variant line"""
+        line = self._current_variant
+        self._current_variant = None
+        while not line:
+            line = next(self.variant_file).rstrip()
+        self.nr_variants += 1
+        return line
+
+    def seek(self, virtual_offset):
+        """Continue reading at the start of a line at a virtual offset of a bgzipped VCF"""
+        if not isinstance(self._handle, BgzfReader):
+            raise ValueError("Only a bgzipped VCF can be read from an offset")
+        self._handle.seek(virtual_offset)
+        self._current_variant = None
+        self.variant_file = iter(self._handle)
+
+    def iter_lines(self):
+        """Iterate over the raw variant lines, without prefiltering or parsing them"""
+        while True:
+            try:
+                yield self._next_line()
+            except StopIteration:
+                return
+
     def __next__(self):
-        current_variant = Variant(self._current_variant)
-        self._current_variant = next(self.variant_file).rstrip()
-        return current_variant
+        line = self._next_line()
+        prefilter = self.prefilter
+        if prefilter:
+            while not prefilter(line):
+                self.nr_skipped += 1
+                line = self._next_line()
+        return Variant(line, self._sample_columns, self._layouts)
     
     def __iter__(self):
         return self
+
+    def bytes_read(self):
+        """Number of bytes of the file read so far, compressed bytes for compressed files
+        
+        Returns:
+            bytes_read (int): None if the position is unknown, e.g. when reading from a pipe
+        """
+        handle = self._handle
+        if isinstance(handle, BgzfReader):
+            return handle.raw_tell()
+        raw = getattr(handle, 'stream', None) or getattr(handle, 'buffer', None)
+        raw = getattr(raw, 'fileobj', raw)
+        try:
+            if raw is None or not raw.seekable():
+                return None
+            return raw.tell()
+        except (OSError, ValueError):
+            return None
+
+    def __call__(self, region):
+        """Iterate over the variants in a region
+        
+        Args:
+            region (str): 'chrom', 'chrom:start' or 'chrom:start-end', 1-based and inclusive
+        
+        Yields:
+            variant (Variant)
+        """
+        return self.query([parse_region(region)])
+
+    def query(self, regions):
+        """Iterate over the variants overlapping several regions
+        
+        The regions are merged and visited in file order, only the BGZF blocks listed in the 
+        index for each region are read. Each variant is yielded once.
+        
+        Args:
+            regions (iterable(tuple)): (chrom, start, end) with 0-based start and exclusive end,
+                                       end is None for the end of the sequence
+        
+        Yields:
+            variant (Variant)
+        """
+        if self.index is None:
+            raise ValueError("Region queries need an indexed VCF")
+
+        self._current_variant = None
+        prefilter = self.prefilter
+        handle = self._handle
+        done = 0
+        for chrom, start, end in merge_regions(regions, self.index.names):
+            if end is None:
+                end = self.index.max_pos
+            for chunk_start, chunk_end in self.index.query(chrom, start, end):
+                if chunk_end <= done:
+                    continue
+                handle.seek(max(chunk_start, done))
+                while handle.tell() < chunk_end:
+                    line = next(handle, None)
+                    if line is None:
+                        break
+                    fields = line.split('\t', 4)
+                    if fields[0] != chrom:
+                        continue
+                    pos = int(fields[1]) - 1
+                    if pos >= end:
+                        break
+                    if pos + len(fields[3]) <= start:
+                        continue
+                    done = handle.tell()
+                    self.nr_variants += 1
+                    line = line.rstrip()
+                    if prefilter and not prefilter(line):
+                        self.nr_skipped += 1
+                        continue
+                    yield Variant(line, self._sample_columns, self._layouts)
+
+    def time_reading(self, metrics):
+        """Time reading and decompressing the lines as the decompress stage of metrics
+
+        Args:
+            metrics (upd.metrics.Metrics)
+        """
+        self.variant_file = metrics.timed_iter('decompress', self.variant_file)
+
+    def close(self):
+        """Close the file"""
+        close = getattr(self._handle, 'close', None)
+        if close:
+            close()
     
     def __repr__(self):
         return f"{self.__class__.__name__} ({self.samples})"
@@ -219,25 +484,80 @@ def check_samples(sids, proband, mother, father):
     
     return True
 
-def get_vcf(vcf_path, proband, mother, father):
-    """Check and open a VCF
+def get_vcf(vcf_path, proband, mother, father, threads=1):
+    """Check and open a VCF or BCF
+    
+    Only the genotypes of the trio are parsed.
     
     Args:
         vcf_path (str)
         proband (str): ID of proband in VCF
         mother (str): ID of mother in VCF
         father (str): ID of father in VCF
+        threads (int): Number of decompression threads for bgzipped VCFs
     
     Returns:
         vcf_reader (Vcf)
         
     """
-    vcf_handle = open_file(vcf_path)
-    vcf_reader = Vcf(vcf_handle)
+    vcf_reader = open_vcf(vcf_path, threads)
     
     if not check_samples(vcf_reader.samples, proband, mother, father):
         raise SyntaxError("At least one of the given sample IDs do not exist in the VCF header")
 
+    vcf_reader.select_samples([proband, mother, father])
+
+    return vcf_reader
+
+def open_vcf(vcf_path, threads=1):
+    """Open a VCF or BCF file
+    
+    Args:
+        vcf_path (str): A path, '-' for a VCF on stdin, or a file object of a VCF
+        threads (int): Number of decompression threads for BGZF compressed files
+    
+    Returns:
+        vcf_reader (Vcf): A Bcf reader for BCF files
+    """
+    # Imported here since upd.bcf builds on Vcf
+    from .bcf import (is_bcf, open_bcf)
+
+    if isinstance(vcf_path, str) and vcf_path != '-' and is_bcf(vcf_path):
+        LOG.info(f"{vcf_path} is BCF")
+        return open_bcf(vcf_path, threads)
+    return Vcf(open_file(vcf_path, threads))
+
+def get_indexed_vcf(vcf_path, proband, mother, father):
+    """Check and open a BGZF compressed VCF or BCF together with its tabix or csi index
+    
+    Args:
+        vcf_path (str)
+        proband (str): ID of proband in VCF
+        mother (str): ID of mother in VCF
+        father (str): ID of father in VCF
+    
+    Returns:
+        vcf_reader (Vcf): A reader that supports region queries
+    
+    """
+    if not is_bgzf(vcf_path):
+        raise SyntaxError(f"{vcf_path} is not BGZF compressed")
+    index_path = find_index(vcf_path)
+    if not index_path:
+        raise OSError(f"Could not find a .tbi or .csi index for {vcf_path}")
+
+    from .bcf import (is_bcf, open_bcf)
+
+    if is_bcf(vcf_path):
+        vcf_reader = open_bcf(vcf_path, index=read_index(index_path))
+    else:
+        vcf_reader = Vcf(BgzfReader(vcf_path), index=read_index(index_path))
+
+    if not check_samples(vcf_reader.samples, proband, mother, father):
+        raise SyntaxError("At least one of the given sample IDs do not exist in the VCF header")
+
+    vcf_reader.select_samples([proband, mother, father])
+
     return vcf_reader
 
 def get_header_desc(reader, header_id):
@@ -276,27 +596,116 @@ def parse_CSQ_header(reader):
     csq_format = csq_format_str.split('|')
     return csq_format
 
-def get_pop_AF(variant, vep_fields, af_tag):
+def build_af_extractor(vep_fields=None, af_tag='MAX_AF', all_transcripts=False):
+    """Build a function that converts a raw INFO value to a population frequency
+    
+    The position of af_tag in the VEP annotation is looked up once, so for each variant only the 
+    CSQ string up to that field of the first transcript is split.
+    
+    Args:
+        vep_fields (list): Description of VEP annotation, None if af_tag is an INFO key
+        af_tag (str): Name of AF field to parse
+        all_transcripts (bool): Use the highest frequency of all transcripts instead of the 
+                                frequency of the first transcript
+    
+    Returns:
+        extract_af (callable): Takes the CSQ string if vep_fields is given, otherwise the af_tag 
+                               value. Returns the frequency, 0 if no data
+    """
+    if not vep_fields:
+        def extract_af(value):
+            if isinstance(value, float):
+                # Decoded from a BCF
+                return value
+            if not isinstance(value, str):
+                return 0.0
+            return float(value or 0)
+        return extract_af
+
+    if af_tag not in vep_fields:
+        return lambda value: 0.0
+    # If the tag is repeated the last one is used
+    field_idx = len(vep_fields) - 1 - vep_fields[::-1].index(af_tag)
+
+    def transcript_af(transcript):
+        data = transcript.split('|', field_idx + 1)
+        if len(data) <= field_idx:
+            return 0.0
+        return float(data[field_idx] or 0)
+
+    if all_transcripts:
+        def extract_af(value):
+            if not isinstance(value, str):
+                return 0.0
+            return max(transcript_af(transcript) for transcript in value.split(','))
+        return extract_af
+
+    def extract_af(value):
+        if not isinstance(value, str):
+            return 0.0
+        data = value.split('|', field_idx + 1)
+        if len(data) <= field_idx:
+            return 0.0
+        freq = data[field_idx]
+        # The last field of a transcript runs into the next transcript
+        if ',' in freq:
+            freq = freq.split(',', 1)[0]
+        return float(freq or 0)
+
+    return extract_af
+
+def get_pop_AF(variant, vep_fields, af_tag, all_transcripts=False):
     """Extract population frequency from VEP annotations.
     
     Args:
         variant (Variant)
         vep_fields (list): Description of VEP annotation
         af_tag (str): Name of AF field to parse
+        all_transcripts (bool): Use the highest frequency of all transcripts
     
     Returns:
         freq (float): The annotated frequency, returns 0 if no data
     """
-    freq = 0
-    if vep_fields:
-        vep_data = variant.INFO['CSQ']
-        first_vep_str = vep_data.split(',')[0]
-        data = first_vep_str.split('|')
-
-        for i in range(len(data)):
-            if vep_fields[i] == af_tag:
-                freq = data[i]
-    else:
-        freq = variant.INFO.get(af_tag)
-            
-    return float(freq or 0)
+    key = 'CSQ' if vep_fields else af_tag
+    return build_af_extractor(vep_fields, af_tag, all_transcripts)(variant.get_info(key))
+
+def build_prefilter(snps_only=True, min_af=None, vep_fields=None, af_tag='MAX_AF', 
+                    all_transcripts=False, drops=None):
+    """Build a filter for raw variant lines
+    
+    The filter only looks at the REF, ALT and INFO columns of the line text, so lines that can 
+    never be UPD informative are rejected before a Variant is built. Multi-allelic lines are 
+    always kept, they are reported as errors downstream.
+    
+    Args:
+        snps_only (bool): Reject lines where REF and ALT differ in length
+        min_af (float): Reject lines with a population frequency below this, None to disable
+        vep_fields (list): Description of VEP annotation
+        af_tag (str): Name of AF field to parse
+        all_transcripts (bool): Use the highest frequency of all transcripts
+        drops (dict): If given, rejected lines are counted here by reason, 'non_snp' or 'af'
+    
+    Returns:
+        prefilter (callable): Takes a raw variant line, returns False if it can be skipped
+    """
+    key = 'CSQ' if vep_fields else af_tag
+    extract_af = build_af_extractor(vep_fields, af_tag, all_transcripts)
+
+    def prefilter(line):
+        fields = line.split('\t', 8)
+        alt = fields[4]
+        if ',' in alt:
+            return True
+        if snps_only and len(fields[3]) != len(alt):
+            if drops is not None:
+                drops['non_snp'] = drops.get('non_snp', 0) + 1
+            return False
+        if min_af is not None:
+            value = get_info_value(fields[7], key)
+            if min_af > extract_af(value):
+                if drops is not None:
+                    drops['af'] = drops.get('af', 0) + 1
+                return False
+        return True
+
+    return prefilter